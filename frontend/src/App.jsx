@@ -61,6 +61,10 @@ function App() {
           image: item.main_image
             ? (item.main_image.startsWith('http') ? item.main_image : `${BASE_URL}${item.main_image}`)
             : logoImg,
+          // Variantes livianas (WebP) de la portada; undefined mientras el backend las genera
+          imageSrcSet: item.main_image_srcset
+            ? item.main_image_srcset.sources[0].srcset.split(', ').map(entry => entry.startsWith('http') ? entry : `${BASE_URL}${entry}`).join(', ')
+            : undefined,
           images: item.all_images && item.all_images.length > 0
             ? item.all_images.map(img => img.startsWith('http') ? img : `${BASE_URL}${img}`)
             : [logoImg]
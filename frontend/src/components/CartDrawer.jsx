@@ -1,5 +1,5 @@
 import { X, Trash2, ShoppingBag, Plus, Minus } from 'lucide-react';
-import { useCart } from '../context/CartContext';
+import { useCart, unitPrice } from '../context/CartContext';
 // 1. AQUI AGREGAMOS LA IMPORTACIÓN DE USENAVIGATE
 import { useNavigate } from 'react-router-dom'; 
 
@@ -67,7 +67,7 @@ const CartDrawer = () => {
                                                 <Plus size={14} />
                                             </button>
                                         </div>
-                                        <div className="font-bold text-pink-600">{item.price}</div>
+                                        <div className="font-bold text-pink-600">{new Intl.NumberFormat('es-CL', { style: 'currency', currency: 'CLP' }).format(unitPrice(item))}</div>
                                     </div>
                                 </div>
 
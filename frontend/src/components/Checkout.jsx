@@ -1,29 +1,10 @@
 import { useState, useEffect } from 'react';
-import { useCart } from '../context/CartContext';
+import { useCart, unitPrice } from '../context/CartContext';
 import { useAuth } from '../context/AuthContext';
 import { Link } from 'react-router-dom';
 import { ChevronLeft, ShieldCheck, Loader2, Info } from 'lucide-react';
 import axios from 'axios';
 
-const REGIONES_CHILE = [
-    { nombre: "Región de Arica y Parinacota", zona: "extremo", precio: 5200 },
-    { nombre: "Región de Tarapacá", zona: "extremo", precio: 5200 },
-    { nombre: "Región de Antofagasta", zona: "extremo", precio: 5200 },
-    { nombre: "Región de Atacama", zona: "centro", precio: 4300 },
-    { nombre: "Región de Coquimbo", zona: "centro", precio: 4300 },
-    { nombre: "Región de Valparaíso", zona: "centro", precio: 4300 },
-    { nombre: "Región Metropolitana", zona: "santiago", precio: 4300 },
-    { nombre: "Región del Libertador Gral. Bernardo O'Higgins", zona: "local", precio: 3100 },
-    { nombre: "Región del Maule", zona: "centro", precio: 4300 },
-    { nombre: "Región de Ñuble", zona: "centro", precio: 4300 },
-    { nombre: "Región del Biobío", zona: "centro", precio: 4300 },
-    { nombre: "Región de La Araucanía", zona: "centro", precio: 4300 },
-    { nombre: "Región de Los Ríos", zona: "centro", precio: 4300 },
-    { nombre: "Región de Los Lagos", zona: "centro", precio: 4300 },
-    { nombre: "Región de Aysén", zona: "extremo", precio: 5200 },
-    { nombre: "Región de Magallanes", zona: "extremo", precio: 5200 },
-];
-
 const Checkout = () => {
     const { cart, totalPrice } = useCart();
     const { user } = useAuth();
@@ -31,6 +12,8 @@ const Checkout = () => {
     const [isLoading, setIsLoading] = useState(false);
     const [showAutoFillAlert, setShowAutoFillAlert] = useState(false);
     const [shippingCost, setShippingCost] = useState(0);
+    // Tarifas de envío: las mismas con que el servidor calcula el total
+    const [shippingRates, setShippingRates] = useState([]);
 
     const [formData, setFormData] = useState({
         nombre: '', apellido: '', email: '', telefono: '', direccion: '', ciudad: '', region: ''
@@ -42,14 +25,17 @@ const Checkout = () => {
 
     const formatearDinero = (monto) => new Intl.NumberFormat('es-CL', { style: 'currency', currency: 'CLP' }).format(monto);
 
-    // Función de ayuda para limpiar precios (Evita el error de $NaN y el error de los decimales)
-    const obtenerPrecioNumerico = (precio) => {
-        if (typeof precio === 'number') return precio;
-        if (!precio) return 0;
-        // Eliminamos el signo $, los puntos de miles y espacios
-        const limpio = precio.toString().replace(/[$. ]/g, '');
-        return parseInt(limpio, 10) || 0;
-    };
+    useEffect(() => {
+        axios.get(`${BASE_URL}/api/shipping-rates/`)
+            .then(res => setShippingRates(res.data.rates))
+            .catch(error => console.error("Error cargando tarifas de envío", error));
+    }, [BASE_URL]);
+
+    // Si la región ya venía del perfil, el costo se calcula cuando llegan las tarifas
+    useEffect(() => {
+        const regionSeleccionada = shippingRates.find(r => r.region === formData.region);
+        setShippingCost(regionSeleccionada ? regionSeleccionada.price : 0);
+    }, [shippingRates, formData.region]);
 
     useEffect(() => {
         if (user && user.email) {
@@ -83,11 +69,6 @@ const Checkout = () => {
     const handleChange = (e) => {
         const { name, value } = e.target;
         setFormData({ ...formData, [name]: value });
-
-        if (name === 'region') {
-            const regionSeleccionada = REGIONES_CHILE.find(r => r.nombre === value);
-            setShippingCost(regionSeleccionada ? regionSeleccionada.precio : 0);
-        }
     };
 
     const handleSubmit = async (e) => {
@@ -179,8 +160,8 @@ const Checkout = () => {
                                         <label className="block text-xs text-gray-500 uppercase tracking-wider mb-1 font-bold">Región</label>
                                         <select required name="region" value={formData.region} onChange={handleChange} className="w-full border border-gray-200 rounded-xl p-3 focus:outline-none focus:border-indigo-400 focus:ring-1 focus:ring-indigo-400 bg-white">
                                             <option value="" disabled>Selecciona tu región...</option>
-                                            {REGIONES_CHILE.map(r => (
-                                                <option key={r.nombre} value={r.nombre}>{r.nombre}</option>
+                                            {shippingRates.map(r => (
+                                                <option key={r.region} value={r.region}>{r.region}</option>
                                             ))}
                                         </select>
                                     </div>
@@ -201,7 +182,7 @@ const Checkout = () => {
                             {/* AJUSTE DE SCROLL: lg:max-h-none para que se vea completo en PC */}
                             <div className="space-y-4 mb-6 max-h-[400px] lg:max-h-none overflow-y-auto pr-2 custom-scrollbar">
                                 {cart.map(item => {
-                                    const precioUnitario = obtenerPrecioNumerico(item.price);
+                                    const precioUnitario = unitPrice(item);
                                     const subtotalItem = precioUnitario * item.quantity;
 
                                     return (
@@ -30,6 +30,8 @@ const User = () => {
     const [isRetryingPayment, setIsRetryingPayment] = useState(false);
     
     const [orders, setOrders] = useState([]);
+    const [ordersCursor, setOrdersCursor] = useState(null);
+    const [loadingMoreOrders, setLoadingMoreOrders] = useState(false);
     const [favoritesPreview, setFavoritesPreview] = useState([]);
     const [loadingData, setLoadingData] = useState(false);
 
@@ -120,6 +122,18 @@ const User = () => {
         }
     };
 
+    const loadMoreOrders = async () => {
+        setLoadingMoreOrders(true);
+        try {
+            const res = await axios.get(`${BASE_URL}/api/orders/`, { params: { email: user.email, cursor: ordersCursor } });
+            setOrders(prev => [...prev, ...res.data.results]);
+            setOrdersCursor(res.data.next_cursor);
+        } catch (error) {
+            console.error("Error trayendo más pedidos:", error);
+        }
+        setLoadingMoreOrders(false);
+    };
+
     useEffect(() => {
         if (user && user.email) {
             const fetchData = async () => {
@@ -128,19 +142,19 @@ const User = () => {
                     const token = localStorage.getItem('access_token');
                     const config = token ? { headers: { Authorization: `Bearer ${token}` } } : {};
                     
-                    const resOrders = await axios.get(`${BASE_URL}/api/orders/`, { params: { email: user.email }, ...config });
-                    setOrders(resOrders.data);
+                    // Perfil, primera página de pedidos y favoritos en una sola llamada
+                    const res = await axios.get(`${BASE_URL}/api/account/`, { params: { email: user.email, favorites_limit: 4 }, ...config });
+                    setOrders(res.data.orders.results);
+                    setOrdersCursor(res.data.orders.next_cursor);
 
-                    const resFavs = await axios.get(`${BASE_URL}/api/favorites/`, { params: { email: user.email }, ...config });
-                    const formattedFavs = resFavs.data.slice(0, 4).map(item => ({
+                    const formattedFavs = res.data.favorites.map(item => ({
                         ...item,
                         priceFormatted: new Intl.NumberFormat('es-CL', { style: 'currency', currency: 'CLP' }).format(item.price),
                         imageUrl: item.image ? (item.image.startsWith('http') ? item.image : `${BASE_URL}${item.image}`) : logoImg,
                     }));
                     setFavoritesPreview(formattedFavs);
 
-                    const resProfile = await axios.get(`${BASE_URL}/api/profile/`, { params: { email: user.email }, ...config });
-                    setProfileData(resProfile.data);
+                    setProfileData(res.data.profile);
 
                 } catch (error) {
                     console.error("Error trayendo datos del usuario:", error);
@@ -274,6 +288,12 @@ const User = () => {
                                                         )}
                                                     </div>
                                                 ))}
+                                                {ordersCursor && (
+                                                    <button onClick={loadMoreOrders} disabled={loadingMoreOrders} className="w-full py-2 text-[10px] font-black uppercase tracking-widest text-indigo-600 hover:text-indigo-800 flex items-center justify-center gap-2">
+                                                        {loadingMoreOrders && <Loader2 size={14} className="animate-spin" />}
+                                                        Ver más pedidos
+                                                    </button>
+                                                )}
                                             </div>
                                         )}
                                     </section>
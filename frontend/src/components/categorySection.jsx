@@ -4,6 +4,7 @@ import { Link } from 'react-router-dom';
 import { useCart } from '../context/CartContext';
 import { useAuth } from '../context/AuthContext';
 import axios from 'axios';
+import { queueFavorite } from './favoritesSync';
 
 const CategorySection = ({ title, buttonText, bannerImage, products, isReversed }) => {
   const { addToCart } = useCart();
@@ -23,8 +24,8 @@ const CategorySection = ({ title, buttonText, bannerImage, products, isReversed
         const fetchFavs = async () => {
             const BASE_URL = import.meta.env.MODE === 'production' ? 'https://tienda-backend-fn64.onrender.com' : 'http://127.0.0.1:8000';
             try {
-                const res = await axios.get(`${BASE_URL}/api/favorites/`, { params: { email: user.email } });
-                setFavIds(res.data.map(f => f.id));
+                const res = await axios.get(`${BASE_URL}/api/favorites/ids/`, { params: { email: user.email } });
+                setFavIds(res.data.ids);
             } catch (e) { console.error("Error trayendo favs:", e); }
         };
         fetchFavs();
@@ -34,7 +35,7 @@ const CategorySection = ({ title, buttonText, bannerImage, products, isReversed
   }, [user]);
 
   // 2. Función para dar/quitar Like
-  const toggleFav = async (e, productId) => {
+  const toggleFav = (e, productId) => {
     e.preventDefault(); // Evita que se abra el producto
     e.stopPropagation();
     
@@ -44,13 +45,11 @@ const CategorySection = ({ title, buttonText, bannerImage, products, isReversed
     // Actualización visual instantánea
     setFavIds(prev => isFav ? prev.filter(id => id !== productId) : [...prev, productId]);
 
-    try {
-        const BASE_URL = import.meta.env.MODE === 'production' ? 'https://tienda-backend-fn64.onrender.com' : 'http://127.0.0.1:8000';
-        await axios.post(`${BASE_URL}/api/favorites/toggle/`, { email: user.email, product_id: productId });
-    } catch (err) {
+    // Se envía junto con los demás clics cercanos (ver favoritesSync.js)
+    queueFavorite(user.email, productId, isFav ? 'remove' : 'add', (err) => {
         // Si falla, revertimos el color
-        setFavIds(prev => isFav ? [...prev, productId] : prev.filter(id => id !== productId));
-    }
+        if (err) setFavIds(prev => isFav ? [...prev, productId] : prev.filter(id => id !== productId));
+    });
   };
 
   const handleMouseDown = (e) => {
@@ -116,7 +115,7 @@ const CategorySection = ({ title, buttonText, bannerImage, products, isReversed
                 </button>
 
                 <div className="relative h-48 bg-gray-100 rounded-xl mb-3 overflow-hidden pointer-events-none">
-                   <img src={product.image} className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-500" alt={product.name} draggable="false" />
+                   <img src={product.image} srcSet={product.imageSrcSet} sizes="(min-width: 768px) 25vw, 50vw" loading="lazy" className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-500" alt={product.name} draggable="false" />
                 </div>
 
                 <div className="flex flex-col flex-grow justify-between pointer-events-none z-10">
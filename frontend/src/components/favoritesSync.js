@@ -0,0 +1,41 @@
+import axios from 'axios';
+
+const BASE_URL = import.meta.env.MODE === 'production' ? 'https://tienda-backend-fn64.onrender.com' : 'http://127.0.0.1:8000';
+const FLUSH_DELAY_MS = 600;
+
+// Los clics en los corazones se acumulan unos milisegundos y se mandan juntos
+// a /api/favorites/batch/ (una sola transacción en el backend). Si el usuario
+// marca y desmarca el mismo producto, solo viaja el estado final.
+let pending = new Map(); // productId -> 'add' | 'remove'
+let pendingEmail = null;
+let waiting = [];
+let timer = null;
+
+const flush = async () => {
+    const email = pendingEmail;
+    const ops = [...pending].map(([product_id, action]) => ({ product_id, action }));
+    const callbacks = waiting;
+    pending = new Map();
+    waiting = [];
+    timer = null;
+
+    try {
+        const res = await axios.post(`${BASE_URL}/api/favorites/batch/`, { email, ops });
+        callbacks.forEach(cb => cb(null, res.data.ids));
+    } catch (err) {
+        callbacks.forEach(cb => cb(err));
+    }
+};
+
+// callback(error, ids): ids es la lista de favoritos confirmada por el servidor
+export const queueFavorite = (email, productId, action, callback) => {
+    if (pendingEmail !== email && pending.size > 0) {
+        clearTimeout(timer);
+        flush();
+    }
+    pendingEmail = email;
+    pending.set(productId, action);
+    if (callback) waiting.push(callback);
+    clearTimeout(timer);
+    timer = setTimeout(flush, FLUSH_DELAY_MS);
+};
@@ -4,6 +4,7 @@ import { Link } from 'react-router-dom';
 import { useCart } from '../context/CartContext'; 
 import { useAuth } from '../context/AuthContext';
 import axios from 'axios';
+import { queueFavorite } from './favoritesSync';
 
 const FullWidthCarousel = ({ title, products }) => {
     const { addToCart } = useCart(); 
@@ -22,8 +23,8 @@ const FullWidthCarousel = ({ title, products }) => {
             const fetchFavs = async () => {
                 const BASE_URL = import.meta.env.MODE === 'production' ? 'https://tienda-backend-fn64.onrender.com' : 'http://127.0.0.1:8000';
                 try {
-                    const res = await axios.get(`${BASE_URL}/api/favorites/`, { params: { email: user.email } });
-                    setFavIds(res.data.map(f => f.id));
+                    const res = await axios.get(`${BASE_URL}/api/favorites/ids/`, { params: { email: user.email } });
+                    setFavIds(res.data.ids);
                 } catch (e) {}
             };
             fetchFavs();
@@ -32,18 +33,15 @@ const FullWidthCarousel = ({ title, products }) => {
         }
     }, [user]);
 
-    const toggleFav = async (e, productId) => {
+    const toggleFav = (e, productId) => {
         e.preventDefault();
         e.stopPropagation();
         if (!user) return alert("¡Inicia sesión para guardar tus favoritos!");
         const isFav = favIds.includes(productId);
         setFavIds(prev => isFav ? prev.filter(id => id !== productId) : [...prev, productId]);
-        try {
-            const BASE_URL = import.meta.env.MODE === 'production' ? 'https://tienda-backend-fn64.onrender.com' : 'http://127.0.0.1:8000';
-            await axios.post(`${BASE_URL}/api/favorites/toggle/`, { email: user.email, product_id: productId });
-        } catch (err) {
-            setFavIds(prev => isFav ? [...prev, productId] : prev.filter(id => id !== productId));
-        }
+        queueFavorite(user.email, productId, isFav ? 'remove' : 'add', (err) => {
+            if (err) setFavIds(prev => isFav ? [...prev, productId] : prev.filter(id => id !== productId));
+        });
     };
 
     const handleMouseDown = (e) => {
@@ -3,6 +3,9 @@ import { createContext, useState, useEffect, useContext } from 'react';
 export const CartContext = createContext();
 export const useCart = () => useContext(CartContext);
 
+// Carritos guardados antes de final_price solo traen price
+export const unitPrice = (item) => parseFloat(item.final_price ?? item.price) || 0;
+
 export const CartProvider = ({ children }) => {
     const [isCartOpen, setIsCartOpen] = useState(false);
     
@@ -66,11 +69,8 @@ export const CartProvider = ({ children }) => {
 
     const totalItems = cart.reduce((total, item) => total + item.quantity, 0);
     
-    // CORRECCIÓN: Usamos el precio como número directamente
-    const totalPrice = cart.reduce((total, item) => {
-        const priceNum = parseFloat(item.price) || 0;
-        return total + (priceNum * item.quantity);
-    }, 0);
+    // Precio con descuento (final_price): es el que cobra el servidor en el checkout
+    const totalPrice = cart.reduce((total, item) => total + (unitPrice(item) * item.quantity), 0);
 
     return (
         <CartContext.Provider value={{ 
@@ -0,0 +1,77 @@
+from django.contrib.auth import get_user_model
+
+from .favorites import favorites_queryset, serialize_favorite
+from .models import Address
+from .orders import ORDER_HISTORY_PAGE_SIZE, MAX_ORDER_HISTORY_PAGE_SIZE, page_order_history
+
+User = get_user_model()
+
+# ==========================================
+# PANEL DE CUENTA (/api/account/)
+# ==========================================
+# Lo que User.jsx pedía en tres llamadas (órdenes, favoritos, perfil) en una
+# sola respuesta, con un número fijo de queries sin importar cuántas órdenes
+# o favoritos tenga el cliente:
+#   1) usuario   2) dirección principal
+#   3) página de órdenes   4) favoritos + producto + categoría (con su portada)
+# ?sections=profile,orders elige qué secciones armar (por defecto, todas).
+
+ACCOUNT_SECTIONS = ('profile', 'orders', 'favorites')
+
+
+def default_address(user):
+    # La marcada como principal; si ninguna lo está, la más antigua (como antes)
+    return Address.objects.filter(user=user).order_by('-is_default', 'id').first()
+
+
+def serialize_profile(user, address):
+    # Mismo formato que /api/profile/
+    return {
+        'nombre': user.first_name,
+        'telefono': user.phone or '',
+        'direccion': address.street_address if address else '',
+        'ciudad': address.city if address else '',
+    }
+
+
+def parse_sections(value):
+    if not value:
+        return ACCOUNT_SECTIONS
+    sections = tuple(s.strip() for s in value.split(',') if s.strip())
+    unknown = set(sections) - set(ACCOUNT_SECTIONS)
+    if unknown:
+        raise ValueError(f"Sección desconocida: {', '.join(sorted(unknown))}")
+    return sections
+
+
+def _parse_limit(value, default, maximum, name):
+    try:
+        limit = int(value or default)
+    except ValueError:
+        raise ValueError(f"Parámetro '{name}' inválido")
+    return max(1, min(limit, maximum))
+
+
+def build_account(email, params):
+    """
+    Arma el panel de la cuenta. Lanza User.DoesNotExist si el correo no
+    existe y ValueError si algún parámetro es inválido.
+    """
+    sections = parse_sections(params.get('sections'))
+    orders_limit = _parse_limit(params.get('orders_limit'), ORDER_HISTORY_PAGE_SIZE, MAX_ORDER_HISTORY_PAGE_SIZE, 'orders_limit')
+    favorites_limit = None
+    if params.get('favorites_limit'):
+        favorites_limit = _parse_limit(params['favorites_limit'], None, 100, 'favorites_limit')
+
+    user = User.objects.only('id', 'email', 'first_name', 'phone').get(email=email)
+    data = {}
+    if 'profile' in sections:
+        data['profile'] = serialize_profile(user, default_address(user))
+    if 'orders' in sections:
+        data['orders'] = page_order_history(user_id=user.id, limit=orders_limit)
+    if 'favorites' in sections:
+        favorites = favorites_queryset(user.email)
+        if favorites_limit:
+            favorites = favorites[:favorites_limit]
+        data['favorites'] = [serialize_favorite(fav) for fav in favorites]
+    return data
@@ -1,16 +1,19 @@
 from django.contrib import admin
-from .models import User, Category, Product, ProductImage, Order, OrderItem, Address, Shipment, Payment, ContactMessage
+from django.utils import timezone
+from .models import User, Category, Product, ProductImage, Order, OrderItem, Address, Shipment, Payment, ContactMessage, EmailOutbox
 
 # 1. Configuración para ver las imágenes DENTRO del producto
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
     extra = 1  # Cuántos espacios vacíos muestra por defecto
+    # Las variantes se generan después de guardar (manage.py process_images)
+    readonly_fields = ('processing_status',)
 
 # 2. Configuración del Producto
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     # Agregamos 'is_featured' para verlo en la tabla
-    list_display = ('name', 'sku', 'price', 'stock', 'is_featured', 'active_status') 
+    list_display = ('name', 'sku', 'price', 'final_price', 'stock', 'is_featured', 'active_status') 
     
     # NUEVO: Permitir editar la casilla directamente desde la lista
     list_editable = ('is_featured',) 
@@ -30,6 +33,8 @@ class ProductAdmin(admin.ModelAdmin):
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'slug', 'parent')
+    list_select_related = ('parent',)
+    ordering = ('full_name',) # Agrupa cada categoría con sus subcategorías
     prepopulated_fields = {'slug': ('name',)} # Rellena el slug automáticamente al escribir el nombre
 
 # 4. Configuración de Órdenes (Para verlas claritas)
@@ -51,6 +56,20 @@ class ContactMessageAdmin(admin.ModelAdmin):
     search_fields = ('name', 'email', 'subject')
     list_editable = ('is_read',) # Permite marcar como leído desde la lista
 
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject')
+    readonly_fields = ('last_error', 'sent_at', 'created_at')
+    actions = ['retry_now']
+
+    @admin.action(description="Reintentar ahora")
+    def retry_now(self, request, queryset):
+        queryset.exclude(status=EmailOutbox.StatusChoices.SENT).update(
+            status=EmailOutbox.StatusChoices.PENDING, next_attempt_at=timezone.now(), attempts=0
+        )
+
 # 5. Registros simples para el resto
 admin.site.register(User)
 admin.site.register(Address)
@@ -0,0 +1,161 @@
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+
+from . import flow
+from .models import Order
+from .orders import ORDER_EXPIRATION, create_order_from_cart, discard_order
+from .views import confirm_paid_order
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# VISTAS DE PAGO ASÍNCRONAS (ASGI / UVICORN)
+# ==========================================
+# Mismo contrato que las vistas de core/views.py, pero mientras se espera a
+# Flow el worker sigue atendiendo otras peticiones: unos pocos getStatus
+# lentos ya no bloquean todo el pool en un peak de ventas.
+# Las llamadas a Flow usan flow.AsyncFlowClient (httpx, conexiones
+# reutilizadas); el ORM corre vía sync_to_async en el hilo de la BD.
+# Se activan con ASYNC_PAYMENT_VIEWS=True y sirviendo con:
+#   uvicorn proyecto.asgi:application
+
+
+@sync_to_async
+def _create_order(email, cart_items, shipping_data):
+    with transaction.atomic():
+        return create_order_from_cart(email, cart_items, shipping_data)
+
+
+@csrf_exempt
+async def create_payment(request):
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            email = data.get('email', 'cliente@policromica.cl')
+            cart_items = data.get('cart', [])
+            shipping_data = data.get('shipping', {})
+
+            # No se puede tener la transacción abierta mientras esperamos a
+            # Flow: la orden se confirma antes y se deshace si Flow falla
+            order = await _create_order(email, cart_items, shipping_data)
+            amount = int(order.total_amount)  # Calculado en el servidor con los precios de la BD
+            commerce_order = f"POLI-{order.id}"
+
+            try:
+                response = await flow.get_async_client().create_payment(
+                    commerce_order=commerce_order,
+                    subject=f"Pedido {commerce_order} en Policrómica",
+                    amount=amount,
+                    email=email,
+                )
+            except Exception:
+                await sync_to_async(discard_order)(order.id)
+                raise
+
+            if response.status_code != 200:
+                await sync_to_async(discard_order)(order.id)
+                return JsonResponse({'error': 'Error comunicando con Flow', 'details': response.text}, status=400)
+
+            flow_data = response.json()
+            payment_url = f"{flow_data['url']}?token={flow_data['token']}"
+            return JsonResponse({'url': payment_url, 'total': amount}, status=200)
+
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'error': 'Método no permitido'}, status=405)
+
+
+@csrf_exempt
+async def payment_confirm(request):
+    if request.method == 'POST':
+        token = request.POST.get('token')
+        if token:
+            try:
+                # Un "pendiente" cacheado no sirve aquí: solo se reutilizan estados finales
+                flow_data = await flow.aget_payment_status(token, allow_pending=False)
+            except flow.FlowError as e:
+                # Respondemos error para que Flow reintente la notificación más tarde
+                logger.warning("No se pudo consultar el estado en Flow: %s", e)
+                return JsonResponse({'error': 'Flow no disponible'}, status=502)
+
+            if flow_data is not None:
+                status = flow_data.get('status')
+                order_id_str = flow_data.get('commerceOrder', '')
+
+                if status == flow.STATUS_PAID and order_id_str.startswith('POLI-'):
+                    order_id = int(order_id_str.replace('POLI-', ''))
+                    try:
+                        await sync_to_async(confirm_paid_order)(order_id, order_id_str)
+                    except Exception:
+                        # Nada quedó confirmado: Flow reintenta la notificación
+                        return JsonResponse({'error': 'No se pudo confirmar la orden'}, status=500)
+
+            return JsonResponse({'status': 'ok'}, status=200)
+    return JsonResponse({'error': 'Método no permitido'}, status=400)
+
+
+@csrf_exempt
+async def payment_final_redirect(request):
+    if request.method == 'POST':
+        token = request.POST.get('token')
+        frontend_url = "https://policromica.vercel.app/checkout/status"
+
+        if token:
+            order_id = ""
+            try:
+                flow_data = await flow.aget_payment_status(token)
+                if flow_data is not None:
+                    order_id = flow_data.get('commerceOrder', '')
+            except flow.FlowError:
+                pass  # La página de estado del frontend igual puede consultar con el token
+
+            return redirect(f"{frontend_url}?token={token}&order={order_id}")
+
+        return redirect(frontend_url)
+    return redirect("https://policromica.vercel.app")
+
+
+@csrf_exempt
+async def retry_payment(request):
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            order_id = data.get('order_id')
+            email = data.get('email')
+
+            if not order_id or not email:
+                return JsonResponse({'error': 'Faltan datos'}, status=400)
+
+            order = await Order.objects.aget(id=order_id, user__email=email, status=Order.StatusChoices.PENDING)
+
+            expiration_threshold = timezone.now() - ORDER_EXPIRATION
+            if order.created_at < expiration_threshold:
+                return JsonResponse({'error': 'Esta orden ha expirado por inactividad. Por favor, realiza un nuevo pedido.'}, status=400)
+
+            commerce_order = f"POLI-{order.id}"
+            response = await flow.get_async_client().create_payment(
+                commerce_order=commerce_order,
+                subject=f"Reintento Pago Pedido {commerce_order} en Policrómica",
+                amount=int(order.total_amount),
+                email=email,
+            )
+
+            if response.status_code == 200:
+                flow_data = response.json()
+                payment_url = f"{flow_data['url']}?token={flow_data['token']}"
+                return JsonResponse({'url': payment_url}, status=200)
+            return JsonResponse({'error': 'Error reintentando pago con Flow', 'details': response.text}, status=400)
+
+        except Order.DoesNotExist:
+            return JsonResponse({'error': 'Orden no encontrada o ya pagada'}, status=404)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'error': 'Método no permitido'}, status=405)
@@ -0,0 +1,349 @@
+import base64
+import binascii
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, Q
+
+from .images import srcset
+from .models import Product, ProductImage, Category
+
+# ==========================================
+# CAPA DE CONSULTAS DEL CATÁLOGO
+# ==========================================
+# Todo el catálogo se arma con un número fijo de queries:
+#   1) productos activos + categoría (JOIN)
+#   2) todas las imágenes de esos productos (prefetch, solo para all_images)
+# La portada viene resuelta en el mismo Product (main_image_url), sin volver
+# a tocar el ORM ni el storage por cada fila.
+
+
+def catalog_queryset():
+    images = ProductImage.objects.order_by('id')
+    return (
+        Product.objects.filter(is_active=True)
+        .select_related('category')
+        .prefetch_related(Prefetch('images', queryset=images))
+    )
+
+
+def pick_main_image(images):
+    # Misma regla de siempre: la marcada como portada, si no, la primera
+    for img in images:
+        if img.is_main:
+            return img
+    return images[0] if images else None
+
+
+# ==========================================
+# PORTADA DENORMALIZADA EN PRODUCT
+# ==========================================
+# Elegir la portada costaba queries (o un prefetch) y una llamada al builder
+# de URLs de Cloudinary por producto en cada listado. Ahora se resuelve una
+# vez al guardar/borrar una ProductImage (ver core/signals.py) y queda en
+# Product.main_image_url / main_image_srcset / image_count.
+# manage.py backfill_product_covers la recalcula para todo el catálogo.
+
+
+def cover_fields(images):
+    main = pick_main_image(images)
+    return {
+        'main_image_url': main.image.url if main else '',
+        'main_image_srcset': srcset(main),
+        'image_count': len(images),
+    }
+
+
+def sync_product_cover(product_id):
+    # Con .update(): no dispara las señales de Product (el snapshot ya lo
+    # invalida la señal de ProductImage que nos llamó)
+    images = list(ProductImage.objects.filter(product_id=product_id).order_by('id'))
+    Product.objects.filter(pk=product_id).update(**cover_fields(images))
+
+
+def keep_single_main_image(image):
+    # Solo una portada por producto: la última marcada gana
+    if image.is_main:
+        ProductImage.objects.filter(product_id=image.product_id, is_main=True).exclude(pk=image.pk).update(is_main=False)
+
+
+def backfill_product_covers(batch_size=500):
+    """
+    Recalcula la portada de todos los productos por bloques: dos queries y un
+    bulk_update por bloque. Devuelve cuántos productos se actualizaron.
+    """
+    images = ProductImage.objects.order_by('id')
+    queryset = Product.objects.only('id').order_by('id').prefetch_related(Prefetch('images', queryset=images))
+    updated = 0
+    batch = []
+    for product in queryset.iterator(chunk_size=batch_size):
+        for name, value in cover_fields(list(product.images.all())).items():
+            setattr(product, name, value)
+        batch.append(product)
+        if len(batch) >= batch_size:
+            updated += len(batch)
+            Product.objects.bulk_update(batch, ['main_image_url', 'main_image_srcset', 'image_count'])
+            batch = []
+    if batch:
+        updated += len(batch)
+        Product.objects.bulk_update(batch, ['main_image_url', 'main_image_srcset', 'image_count'])
+    return updated
+
+
+def serialize_product(product):
+    images = list(product.images.all())  # Ya viene del prefetch
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': float(product.price),
+        'final_price': float(product.final_price),
+        'discount_percent': product.discount_percent,
+        'stock': product.stock,
+        'category__name': product.category.name if product.category else "Sin categoría",
+        'main_image': product.main_image_url or None,
+        'main_image_srcset': product.main_image_srcset,  # None hasta que haya variantes
+        'all_images': [img.image.url for img in images],
+        'description': product.description,
+        'is_featured': product.is_featured,
+    }
+
+
+def build_catalog(queryset=None):
+    if queryset is None:
+        queryset = catalog_queryset()
+    return [serialize_product(product) for product in queryset]
+
+
+# ==========================================
+# SNAPSHOT EN MEMORIA DEL CATÁLOGO
+# ==========================================
+# El catálogo cambia pocas veces al día (desde el admin), pero se pide en
+# cada visita. Guardamos el JSON ya serializado + su hash y solo lo
+# reconstruimos cuando las señales de Product/ProductImage/Category avisan
+# que algo cambió (ver core/signals.py).
+#
+# La "generación" vive en el cache de Django para que todos los workers de
+# gunicorn se enteren de la invalidación, aunque el save ocurra en otro.
+
+CATALOG_GENERATION_KEY = 'catalog:generation'
+
+CatalogSnapshot = namedtuple('CatalogSnapshot', ['body', 'etag', 'generation', 'built_at'])
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def _current_generation():
+    return cache.get(CATALOG_GENERATION_KEY, 0)
+
+
+def invalidate_catalog():
+    global _snapshot
+    _snapshot = None
+    try:
+        cache.incr(CATALOG_GENERATION_KEY)
+    except ValueError:
+        # La llave no existe todavía (cache recién iniciado)
+        cache.set(CATALOG_GENERATION_KEY, 1, timeout=None)
+
+
+def build_catalog_snapshot():
+    generation = _current_generation()
+    body = json.dumps(build_catalog(), cls=DjangoJSONEncoder).encode('utf-8')
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    return CatalogSnapshot(body, etag, generation, time.monotonic())
+
+
+def _is_fresh(snapshot):
+    if snapshot is None:
+        return False
+    if snapshot.generation != _current_generation():
+        return False
+    # Red de seguridad por si alguna escritura no pasó por las señales (ej: .update())
+    max_age = getattr(settings, 'CATALOG_SNAPSHOT_MAX_AGE', 300)
+    return time.monotonic() - snapshot.built_at < max_age
+
+
+def get_catalog_snapshot():
+    global _snapshot
+    snapshot = _snapshot
+    if _is_fresh(snapshot):
+        return snapshot
+    with _snapshot_lock:
+        # Otro hilo pudo haberlo reconstruido mientras esperábamos el lock
+        if not _is_fresh(_snapshot):
+            _snapshot = build_catalog_snapshot()
+        return _snapshot
+
+
+# ==========================================
+# FILTROS, ORDEN Y PAGINACIÓN (KEYSET)
+# ==========================================
+# /api/products/?category=aros&is_featured=1&min_price=5000&in_stock=1&on_sale=1&sort=price_asc&limit=24
+# Los filtros y el orden por precio usan final_price (precio con descuento, columna indexada).
+# La paginación usa un cursor opaco con (valor_orden, id) del último
+# producto de la página, así cada página es un "WHERE ... > cursor LIMIT n"
+# que usa índice, en vez de un OFFSET que se vuelve lento con el catálogo.
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# sort -> (campo, descendente)
+CATALOG_SORTS = {
+    'newest': ('created_at', True),
+    'price_asc': ('final_price', False),
+    'price_desc': ('final_price', True),
+    'name': ('name', False),
+}
+DEFAULT_SORT = 'newest'
+
+TRUE_VALUES = ('1', 'true', 'True', 'si', 'yes')
+
+# Solo estos parámetros cambian la respuesta a una página: cualquier otro
+# (?utm_source=..., ?fbclid=...) sigue devolviendo el catálogo completo.
+CATALOG_PARAMS = ('category', 'is_featured', 'min_price', 'max_price', 'on_sale', 'in_stock', 'sort', 'cursor', 'limit')
+
+
+def is_catalog_query(params):
+    return any(name in params for name in CATALOG_PARAMS)
+
+
+def filter_by_category_slug(queryset, slug):
+    # Incluye subcategorías: el subárbol es un prefijo del path materializado
+    path = Category.objects.filter(slug=slug).values_list('path', flat=True).first()
+    if not path:
+        return queryset.none()
+    return queryset.filter(category__path__startswith=path)
+
+
+def _parse_price(value, name):
+    try:
+        return Product._meta.get_field('final_price').to_python(value)
+    except ValidationError:
+        raise ValueError(f"Parámetro '{name}' inválido")
+
+
+def filter_catalog(queryset, params):
+    slug = params.get('category')
+    if slug:
+        queryset = filter_by_category_slug(queryset, slug)
+
+    featured = params.get('is_featured')
+    if featured not in (None, ''):
+        queryset = queryset.filter(is_featured=featured in TRUE_VALUES)
+
+    if params.get('min_price'):
+        queryset = queryset.filter(final_price__gte=_parse_price(params['min_price'], 'min_price'))
+    if params.get('max_price'):
+        queryset = queryset.filter(final_price__lte=_parse_price(params['max_price'], 'max_price'))
+
+    if params.get('on_sale') in TRUE_VALUES:
+        queryset = queryset.filter(discount_percent__gt=0)
+
+    if params.get('in_stock') in TRUE_VALUES:
+        queryset = queryset.filter(stock__gt=0)
+    return queryset
+
+
+def encode_cursor(sort, value, pk):
+    # isoformat() completo: DjangoJSONEncoder recorta los microsegundos y el cursor perdería precisión
+    value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+    raw = json.dumps([sort, value, pk])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, pk = json.loads(base64.urlsafe_b64decode(padded))
+        field, _ = CATALOG_SORTS[cursor_sort]
+        value = Product._meta.get_field(field).to_python(value)
+        pk = int(pk)
+    except (binascii.Error, ValueError, TypeError, KeyError, ValidationError):
+        raise ValueError("Cursor inválido")
+    if cursor_sort != sort:
+        raise ValueError("El cursor no corresponde a este orden")
+    return value, pk
+
+
+def paginate_catalog(queryset, sort=DEFAULT_SORT, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    if sort not in CATALOG_SORTS:
+        raise ValueError(f"Orden '{sort}' no soportado")
+    field, descending = CATALOG_SORTS[sort]
+
+    if cursor:
+        value, pk = decode_cursor(cursor, sort)
+        if descending:
+            queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}))
+        else:
+            queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk}))
+
+    prefix = '-' if descending else ''
+    # Pedimos uno extra para saber si hay página siguiente sin hacer COUNT(*)
+    page = list(queryset.order_by(f'{prefix}{field}', f'{prefix}id')[:limit + 1])
+    has_next = len(page) > limit
+    page = page[:limit]
+
+    next_cursor = None
+    if has_next:
+        last = page[-1]
+        next_cursor = encode_cursor(sort, getattr(last, field), last.id)
+    return {
+        'results': [serialize_product(product) for product in page],
+        'next_cursor': next_cursor,
+    }
+
+
+def query_catalog(params):
+    try:
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("Parámetro 'limit' inválido")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    queryset = filter_catalog(catalog_queryset(), params)
+    return paginate_catalog(
+        queryset,
+        sort=params.get('sort') or DEFAULT_SORT,
+        cursor=params.get('cursor'),
+        limit=limit,
+    )
+
+
+# ==========================================
+# RESPUESTA EN STREAMING (MEMORIA ACOTADA)
+# ==========================================
+# /api/products/?stream=1 (acepta los mismos filtros, sin paginar).
+# En vez de armar la lista completa en memoria, recorremos el queryset por
+# bloques con .iterator(chunk_size) (el prefetch de imágenes se hace por
+# bloque) y vamos emitiendo el arreglo JSON de a pedazos.
+
+STREAM_CHUNK_SIZE = 500
+
+
+def iter_catalog_json(queryset=None, chunk_size=STREAM_CHUNK_SIZE):
+    if queryset is None:
+        queryset = catalog_queryset()
+    yield b'['
+    separator = b''
+    pending = []
+    for product in queryset.order_by('id').iterator(chunk_size=chunk_size):
+        pending.append(json.dumps(serialize_product(product), cls=DjangoJSONEncoder).encode('utf-8'))
+        if len(pending) >= chunk_size:
+            yield separator + b','.join(pending)
+            separator = b','
+            pending = []
+    if pending:
+        yield separator + b','.join(pending)
+    yield b']'
+
+
+def stream_catalog(params):
+    return iter_catalog_json(filter_catalog(catalog_queryset(), params))
@@ -0,0 +1,218 @@
+import hashlib
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from .models import Favorite, Product
+
+User = get_user_model()
+
+# ==========================================
+# FAVORITOS
+# ==========================================
+# El listado completo (Favoritos.jsx, panel de cuenta) sale en una sola query:
+# favoritos + producto + categoría (JOIN); la portada viene en el producto.
+#
+# Las tarjetas de producto solo necesitan saber qué corazones pintar: para eso
+# está /api/favorites/ids/, con un número de versión por usuario (por id, así
+# las señales de Favorite no consultan el usuario) guardado en el cache de
+# Django. Cada alta/baja sube la versión (ver core/signals.py), y si el
+# navegador ya tiene la versión actual responde 304 sin tocar la BD.
+
+# El email -> id se olvida cuando el email cambia o lo toma otra cuenta (ver
+# core/signals.py); el vencimiento es solo una red de seguridad.
+USER_ID_CACHE_TIMEOUT = 60 * 60
+
+
+def favorites_queryset(email):
+    return (
+        Favorite.objects.filter(user__email=email)
+        .select_related('product__category')
+        .order_by('-created_at', '-id')
+    )
+
+
+def serialize_favorite(favorite):
+    product = favorite.product
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': float(product.price),
+        'final_price': float(product.final_price),  # Lo que se cobra en el checkout
+        'stock': product.stock,
+        'category__name': product.category.name if product.category else "Sin categoría",
+        'image': product.main_image_url or None,  # Portada guardada en Product
+    }
+
+
+def favorite_product_ids(email):
+    # Una sola query: índice único de email + índice (user, product) de Favorite
+    return list(
+        Favorite.objects.filter(user__email=email).order_by('product_id').values_list('product_id', flat=True)
+    )
+
+
+def _version_key(user_id):
+    return f'favorites:version:{user_id}'
+
+
+def _user_key(email):
+    return 'favorites:user:' + hashlib.sha256(email.encode()).hexdigest()
+
+
+def favorites_user_id(email):
+    """
+    Id del usuario para un email, guardado en el cache: así el 304 de
+    /api/favorites/ids/ sigue sin tocar la BD. None si no existe.
+    """
+    key = _user_key(email)
+    user_id = cache.get(key)
+    if user_id is None:
+        user_id = User.objects.filter(email=email).values_list('id', flat=True).first()
+        if user_id is not None:
+            cache.set(key, user_id, timeout=USER_ID_CACHE_TIMEOUT)
+    return user_id
+
+
+def forget_favorites_user(email):
+    cache.delete(_user_key(email))
+
+
+def _seed_version():
+    # Si el cache se pierde, la versión nueva igual es mayor que cualquiera
+    # que tenga guardada un navegador (nunca un 304 con datos viejos)
+    return time.time_ns() // 1_000_000
+
+
+def get_favorites_version(user_id):
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _seed_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_favorites_version(user_id):
+    key = _version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _seed_version(), timeout=None)
+
+
+# ==========================================
+# ALTAS / BAJAS SIN INSTANCIAR MODELOS
+# ==========================================
+# Un corazón = a lo más dos sentencias, resolviendo el usuario por email en
+# una subconsulta:
+#   DELETE ... WHERE user_id = (SELECT id FROM user WHERE email = %s) AND product_id IN (...)
+#   INSERT ... SELECT user.id, product.id ... (ignorando duplicados)
+# El INSERT ignora el choque con unique_together (user, product), así un
+# doble clic rápido ya no revienta con IntegrityError. Como no pasan por
+# save()/delete(), la versión de /api/favorites/ids/ se sube aquí mismo.
+
+FAVORITES_BATCH_MAX = 100
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _user_id_subquery():
+    return f"(SELECT {_quote('id')} FROM {_quote(User._meta.db_table)} WHERE {_quote('email')} = %s)"
+
+
+def remove_favorites(email, product_ids):
+    if not product_ids:
+        return 0
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    sql = (
+        f"DELETE FROM {_quote(Favorite._meta.db_table)} "
+        f"WHERE {_quote('user_id')} = {_user_id_subquery()} AND {_quote('product_id')} IN ({placeholders})"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [email, *product_ids])
+        return cursor.rowcount
+
+
+def add_favorites(email, product_ids):
+    if not product_ids:
+        return 0
+    fields = [Favorite._meta.get_field(name) for name in ('user', 'product', 'created_at')]
+    created_at = fields[2].get_db_prep_value(timezone.now(), connection)
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    sql = (
+        f"{connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)} {_quote(Favorite._meta.db_table)} "
+        f"({', '.join(_quote(f.column) for f in fields)}) "
+        f"SELECT u.{_quote('id')}, p.{_quote('id')}, %s "
+        f"FROM {_quote(User._meta.db_table)} u, {_quote(Product._meta.db_table)} p "
+        f"WHERE u.{_quote('email')} = %s AND p.{_quote('id')} IN ({placeholders}) "
+        f"{connection.ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None)}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [created_at, email, *product_ids])
+        return cursor.rowcount
+
+
+def _changed(email):
+    def bump():
+        user_id = favorites_user_id(email)
+        if user_id is not None:
+            bump_favorites_version(user_id)
+    transaction.on_commit(bump)
+
+
+def toggle_favorite(email, product_id):
+    """
+    Devuelve 'added' o 'removed'. Lanza ValueError si el usuario o el
+    producto no existen (solo en ese caso hay una tercera query).
+    """
+    with transaction.atomic():
+        if remove_favorites(email, [product_id]):
+            _changed(email)
+            return 'removed'
+        if add_favorites(email, [product_id]):
+            _changed(email)
+            return 'added'
+    # No borró ni insertó: o ya estaba (otro clic ganó la carrera) o faltan datos
+    if Favorite.objects.filter(user__email=email, product_id=product_id).exists():
+        return 'added'
+    raise ValueError("Usuario o producto no encontrado")
+
+
+def parse_favorite_ops(ops):
+    # [{'product_id': 1, 'action': 'add'|'remove'}, ...] -> estado final por producto (gana el último)
+    if not isinstance(ops, list) or len(ops) > FAVORITES_BATCH_MAX:
+        raise ValueError(f"Se esperaba una lista de hasta {FAVORITES_BATCH_MAX} operaciones")
+    final = {}
+    for op in ops:
+        try:
+            product_id = int(op['product_id'])
+            action = op['action']
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Operación inválida")
+        if action not in ('add', 'remove'):
+            raise ValueError(f"Acción '{action}' no soportada")
+        final[product_id] = action
+    return final
+
+
+def apply_favorite_ops(email, ops):
+    """
+    Aplica un lote de altas/bajas en una transacción: un DELETE y un INSERT
+    en total, sin importar cuántas operaciones traiga el lote.
+    """
+    final = parse_favorite_ops(ops)
+    adds = sorted(pk for pk, action in final.items() if action == 'add')
+    removes = sorted(pk for pk, action in final.items() if action == 'remove')
+    with transaction.atomic():
+        removed = remove_favorites(email, removes)
+        added = add_favorites(email, adds)
+        if added or removed:
+            _changed(email)
+    return {'added': added, 'removed': removed}
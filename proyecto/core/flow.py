@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import random
+import threading
+import time
+import weakref
+from collections import defaultdict, deque
+from urllib.parse import urlencode
+
+import httpx
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# CLIENTE DE LA API DE FLOW
+# ==========================================
+# Un solo lugar para firmar y llamar a Flow. Reutiliza conexiones
+# (keep-alive) con un pool por proceso, siempre con timeouts de conexión y
+# lectura: un Flow lento ya no deja colgados a los workers de gunicorn.
+# Solo se reintentan las llamadas idempotentes (getStatus); payment/create
+# únicamente si la conexión ni siquiera llegó a establecerse.
+
+
+class FlowError(Exception):
+    """Flow no respondió (timeout / error de red) después de los reintentos."""
+
+
+def sign(params, secret_key):
+    # Firma de Flow: parámetros ordenados por nombre, concatenados "nombrevalor", HMAC-SHA256
+    to_sign = "".join(f"{key}{value}" for key, value in sorted(params.items(), key=lambda x: x[0]))
+    return hmac.new(secret_key.encode(), to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+class FlowClient:
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, api_url, api_key, secret_key, connect_timeout=3.05, read_timeout=10,
+                 max_retries=2, backoff=0.3, pool_maxsize=10):
+        self.api_url = api_url.rstrip('/')
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = self._make_session(pool_maxsize)
+        # Últimas latencias (ms) por endpoint, para diagnóstico
+        self.latencies = defaultdict(lambda: deque(maxlen=200))
+
+    def _make_session(self, pool_maxsize):
+        session = requests.Session()
+        # Reintentos los manejamos nosotros (con jitter), no urllib3
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def signed(self, params):
+        params = {"apiKey": self.api_key, **params}
+        params["s"] = sign(params, self.secret_key)
+        return params
+
+    def _retry_delay(self, attempt):
+        # Backoff exponencial con "full jitter"
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def _sleep_before_retry(self, attempt):
+        time.sleep(self._retry_delay(attempt))
+
+    def _request(self, method, endpoint, idempotent, **kwargs):
+        url = f"{self.api_url}/{endpoint}"
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.ConnectTimeout as e:
+                # Ni siquiera conectó: reintentar es seguro incluso para un POST
+                error = e
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                if not idempotent:
+                    # El POST pudo haber llegado a Flow: no lo repetimos
+                    self._record(endpoint, started, type(e).__name__)
+                    break
+            else:
+                self._record(endpoint, started, response.status_code)
+                if idempotent and response.status_code in self.RETRY_STATUSES and attempt < self.max_retries:
+                    self._sleep_before_retry(attempt)
+                    continue
+                return response
+            self._record(endpoint, started, type(error).__name__)
+            if attempt < self.max_retries:
+                self._sleep_before_retry(attempt)
+        raise FlowError(f"Flow no responde ({endpoint}): {error}") from error
+
+    def _record(self, endpoint, started, outcome):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.latencies[endpoint].append(elapsed_ms)
+        metrics.observe_external('flow', endpoint, elapsed_ms / 1000, str(outcome))
+        logger.info("flow %s -> %s en %.0f ms", endpoint, outcome, elapsed_ms)
+
+    def _create_payment_params(self, commerce_order, subject, amount, email):
+        return self.signed({
+            "commerceOrder": commerce_order,
+            "subject": subject,
+            "currency": "CLP",
+            "amount": amount,
+            "email": email,
+            "urlConfirmation": settings.FLOW_URL_CONFIRMATION,
+            "urlReturn": settings.FLOW_URL_RETURN,
+        })
+
+    def create_payment(self, commerce_order, subject, amount, email):
+        params = self._create_payment_params(commerce_order, subject, amount, email)
+        return self._request(
+            'POST', 'payment/create', idempotent=False,
+            data=urlencode(params), headers={'Content-Type': 'application/x-www-form-urlencoded'},
+        )
+
+    def get_status(self, token):
+        return self._request('GET', 'payment/getStatus', idempotent=True, params=self.signed({"token": token}))
+
+
+class AsyncFlowClient(FlowClient):
+    """
+    Misma API que FlowClient pero con httpx.AsyncClient, para las vistas
+    async (core/async_views.py) servidas con uvicorn: mientras se espera a
+    Flow el worker sigue atendiendo otras peticiones.
+    """
+
+    def _make_session(self, pool_maxsize):
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+            limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize),
+        )
+
+    async def _request(self, method, endpoint, idempotent, **kwargs):
+        url = f"{self.api_url}/{endpoint}"
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = await self.session.request(method, url, **kwargs)
+            except (httpx.ConnectTimeout, httpx.ConnectError) as e:
+                # Ni siquiera conectó: reintentar es seguro incluso para un POST
+                error = e
+            except httpx.TransportError as e:
+                error = e
+                if not idempotent:
+                    # El POST pudo haber llegado a Flow: no lo repetimos
+                    self._record(endpoint, started, type(e).__name__)
+                    break
+            else:
+                self._record(endpoint, started, response.status_code)
+                if idempotent and response.status_code in self.RETRY_STATUSES and attempt < self.max_retries:
+                    await asyncio.sleep(self._retry_delay(attempt))
+                    continue
+                return response
+            self._record(endpoint, started, type(error).__name__)
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._retry_delay(attempt))
+        raise FlowError(f"Flow no responde ({endpoint}): {error}") from error
+
+    async def create_payment(self, commerce_order, subject, amount, email):
+        params = self._create_payment_params(commerce_order, subject, amount, email)
+        return await self._request(
+            'POST', 'payment/create', idempotent=False,
+            content=urlencode(params), headers={'Content-Type': 'application/x-www-form-urlencoded'},
+        )
+
+    async def get_status(self, token):
+        return await self._request('GET', 'payment/getStatus', idempotent=True, params=self.signed({"token": token}))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+# httpx.AsyncClient queda atado al event loop donde se creó: uno por loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _build_client(client_class):
+    return client_class(
+        api_url=settings.FLOW_API_URL,
+        api_key=settings.FLOW_API_KEY,
+        secret_key=settings.FLOW_SECRET_KEY or '',
+        connect_timeout=settings.FLOW_CONNECT_TIMEOUT,
+        read_timeout=settings.FLOW_READ_TIMEOUT,
+        max_retries=settings.FLOW_MAX_RETRIES,
+        pool_maxsize=settings.FLOW_POOL_MAXSIZE,
+    )
+
+
+def get_client():
+    # Un cliente (y un pool de conexiones) por proceso
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client(FlowClient)
+    return _client
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = _build_client(AsyncFlowClient)
+    return client
+
+
+@receiver(setting_changed)
+def reset_client(setting=None, **kwargs):
+    # Si cambian los FLOW_* (ej: override_settings en tests) se arman clientes nuevos
+    global _client
+    if setting is None or setting.startswith('FLOW_'):
+        _client = None
+        _async_clients.clear()
+
+
+# ==========================================
+# CACHE DE ESTADOS DE PAGO (por token)
+# ==========================================
+# Para un mismo pago Flow llama a payment_confirm (y lo reintenta) y luego el
+# navegador pasa por payment_final_redirect: todos preguntan getStatus por el
+# mismo token. Guardamos la respuesta en el cache compartido de Django:
+#   - estados finales (pagado / rechazado / anulado): no cambian más, TTL largo
+#   - pendiente: TTL corto
+# payment_confirm nunca confía en un "pendiente" cacheado (pasaría por alto el
+# pago), solo en estados finales.
+
+STATUS_PENDING = 1
+STATUS_PAID = 2
+STATUS_REJECTED = 3
+STATUS_CANCELED = 4
+TERMINAL_STATUSES = (STATUS_PAID, STATUS_REJECTED, STATUS_CANCELED)
+
+
+def _status_cache_key(token):
+    return 'flow:status:' + hashlib.sha256(token.encode()).hexdigest()
+
+
+def _status_ttl(data):
+    if data.get('status') in TERMINAL_STATUSES:
+        return settings.FLOW_STATUS_TERMINAL_TTL
+    return settings.FLOW_STATUS_PENDING_TTL
+
+
+def get_payment_status(token, allow_pending=True):
+    """
+    Devuelve el JSON de getStatus (dict) o None si Flow respondió con error.
+    Lanza FlowError si Flow no responde.
+    """
+    key = _status_cache_key(token)
+    cached = cache.get(key)
+    if cached is not None and (allow_pending or cached.get('status') in TERMINAL_STATUSES):
+        return cached
+
+    response = get_client().get_status(token)
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    cache.set(key, data, timeout=_status_ttl(data))
+    return data
+
+
+async def aget_payment_status(token, allow_pending=True):
+    """Versión async de get_payment_status (mismo cache, mismas reglas)."""
+    key = _status_cache_key(token)
+    cached = await cache.aget(key)
+    if cached is not None and (allow_pending or cached.get('status') in TERMINAL_STATUSES):
+        return cached
+
+    response = await get_async_client().get_status(token)
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    await cache.aset(key, data, timeout=_status_ttl(data))
+    return data
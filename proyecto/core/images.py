@@ -0,0 +1,282 @@
+import logging
+import math
+import os
+import threading
+from datetime import timedelta
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import ProductImage
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# VARIANTES RESPONSIVE DE LAS FOTOS
+# ==========================================
+# El admin sube la foto original (a veces 4000px) y antes esa misma URL se
+# usaba en carruseles, tarjetas y miniaturas: el celular bajaba la foto
+# completa. Ahora, después del commit y fuera del request del admin, se
+# generan una vez:
+#   - thumb (160px), card (480px) y detail (1080px), cada una en WebP y JPEG
+#   - ancho/alto de la original (para reservar el espacio y evitar saltos)
+#   - un blurhash (~30 caracteres) para pintar un placeholder difuminado
+# Las variantes se guardan en el mismo storage que la original (Cloudinary
+# en producción, disco con MEDIA_STORAGE=local) y srcset() arma lo que el
+# frontend pone en <picture><source srcset=...>.
+#
+# Pillow y las subidas al storage no corren dentro de una transacción: el
+# worker reclama el lote (PROCESANDO, commit corto) y procesa cada foto sin
+# locks. Si muere a mitad, las fotos reclamadas se retoman al vencer
+# PROCESSING_LEASE.
+
+IMAGE_VARIANT_WIDTHS = (('thumb', 160), ('card', 480), ('detail', 1080))
+# El primero que el navegador soporte es el que usa: WebP antes que JPEG
+IMAGE_VARIANT_FORMATS = (('webp', 'WEBP', 'image/webp'), ('jpeg', 'JPEG', 'image/jpeg'))
+IMAGE_VARIANT_QUALITY = 80
+VARIANTS_DIR = 'products/variants'
+FALLBACK_VARIANT = 'card'
+DEFAULT_BATCH_SIZE = 20
+PROCESSING_LEASE = timedelta(minutes=15)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# ==========================================
+# BLURHASH (https://blurha.sh)
+# ==========================================
+# Implementación directa del encoder: se calcula sobre una copia de 32px,
+# así que el costo no depende del tamaño de la foto original.
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+BLURHASH_COMPONENTS = (4, 3)
+BLURHASH_SAMPLE_SIZE = 32
+
+
+def _base83(value, length):
+    return ''.join(BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _srgb_to_linear(value):
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value):
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exp):
+    return math.copysign(abs(value) ** exp, value)
+
+
+def blurhash(img, components=BLURHASH_COMPONENTS):
+    nx, ny = components
+    small = img.convert('RGB')
+    small.thumbnail((BLURHASH_SAMPLE_SIZE, BLURHASH_SAMPLE_SIZE))
+    width, height = small.size
+    linear = [tuple(_srgb_to_linear(c) for c in pixel) for pixel in small.getdata()]
+
+    factors = []
+    for j in range(ny):
+        cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(nx):
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[x] * cos_y[y]
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = (1 if i == j == 0 else 2) / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((nx - 1) + (ny - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(max(abs(c) for f in ac for c in f) * 166 - 0.5)))
+        maximum = (quantised_max + 1) / 166
+        result += _base83(quantised_max, 1)
+    else:
+        maximum = 1
+        result += _base83(0, 1)
+    result += _base83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for f in ac:
+        q = [max(0, min(18, int(_sign_pow(c / maximum, 0.5) * 9 + 9.5))) for c in f]
+        result += _base83(q[0] * 19 * 19 + q[1] * 19 + q[2], 2)
+    return result
+
+
+# ==========================================
+# GENERACIÓN DE VARIANTES
+# ==========================================
+
+def _encode(img, pil_format):
+    buffer = BytesIO()
+    img.save(buffer, pil_format, quality=IMAGE_VARIANT_QUALITY, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def delete_variant_files(variants, storage=None):
+    storage = storage or default_storage
+    for variant in variants:
+        try:
+            storage.delete(variant['path'])
+        except Exception as e:
+            logger.warning("No se pudo borrar la variante %s: %s", variant.get('path'), e)
+
+
+def process_image(image):
+    """
+    Genera las variantes de una ProductImage y guarda medidas, blurhash y
+    estado. Lanza la excepción si la original no se puede leer. Devuelve
+    None (y borra lo generado) si mientras tanto la foto se reemplazó o se
+    volvió a encolar.
+    """
+    field = image.image
+    storage = field.storage
+    claimed = (field.name, image.processing_status)
+    with field.open('rb') as f:
+        original = ImageOps.exif_transpose(Image.open(f))
+        original.load()
+    rgb = original.convert('RGB')  # JPEG no tiene alfa; WebP así pesa menos
+
+    # Mismos nombres en cada reproceso: primero se borran las anteriores
+    delete_variant_files(image.variants, storage)
+    stem = os.path.splitext(os.path.basename(field.name))[0]
+    variants = []
+    done_widths = set()
+    for name, target in IMAGE_VARIANT_WIDTHS:
+        width = min(target, rgb.width)  # Nunca se agranda
+        if width in done_widths:
+            continue  # Foto chica: thumb/card/detail saldrían iguales
+        done_widths.add(width)
+        height = max(1, round(rgb.height * width / rgb.width))
+        resized = rgb.resize((width, height), Image.LANCZOS)
+        for ext, pil_format, _ in IMAGE_VARIANT_FORMATS:
+            path = storage.save(f"{VARIANTS_DIR}/{stem}_{name}.{ext}", _encode(resized, pil_format))
+            variants.append({
+                'name': name, 'format': ext, 'width': width, 'height': height,
+                'path': path, 'url': storage.url(path),
+            })
+
+    image.width, image.height = original.size
+    image.blurhash = blurhash(rgb)
+    image.variants = variants
+    image.processing_status = ProductImage.ProcessingChoices.READY
+    image.processing_error = ''
+    with transaction.atomic():
+        # Lock corto solo para el guardado: que nadie la haya cambiado mientras tanto
+        current = ProductImage.objects.select_for_update().filter(pk=image.pk).values_list('image', 'processing_status').first()
+        if current == claimed:
+            image.save(update_fields=['width', 'height', 'blurhash', 'variants', 'processing_status', 'processing_error'])
+    if current != claimed:
+        delete_variant_files(variants, storage)
+        return None
+    return image
+
+
+def claim_pending_images(batch_size=DEFAULT_BATCH_SIZE, ids=None):
+    """
+    Marca como PROCESANDO un lote de fotos pendientes (o reclamadas por un
+    worker que no terminó) y lo devuelve. skip_locked permite correr más de
+    un worker sin que se pisen. Con ids, solo considera esas fotos.
+    """
+    now = timezone.now()
+    expired = Q(processing_status=ProductImage.ProcessingChoices.PROCESSING, processing_started_at__lt=now - PROCESSING_LEASE)
+    pending = ProductImage.objects.select_for_update(skip_locked=True).filter(
+        Q(processing_status=ProductImage.ProcessingChoices.PENDING) | expired
+    )
+    if ids is not None:
+        pending = pending.filter(pk__in=ids)
+    with transaction.atomic():
+        batch = list(pending.order_by('id')[:batch_size])
+        for image in batch:
+            image.processing_status = ProductImage.ProcessingChoices.PROCESSING
+            image.processing_started_at = now
+        ProductImage.objects.bulk_update(batch, ['processing_status', 'processing_started_at'])
+    return batch
+
+
+def process_pending_images(batch_size=DEFAULT_BATCH_SIZE, ids=None):
+    """
+    Procesa un lote de fotos pendientes. Devuelve {'ready': n, 'failed': n}.
+    """
+    stats = {'ready': 0, 'failed': 0}
+    for image in claim_pending_images(batch_size, ids):
+        try:
+            if process_image(image) is not None:
+                stats['ready'] += 1
+        except Exception as e:
+            logger.error("No se pudieron generar las variantes de la imagen %s: %s", image.id, e)
+            # Solo si sigue reclamada: un reemplazo hecho mientras tanto vuelve a PENDIENTE
+            failed = ProductImage.objects.filter(pk=image.pk, processing_status=ProductImage.ProcessingChoices.PROCESSING)
+            failed.update(processing_status=ProductImage.ProcessingChoices.FAILED, processing_error=str(e))
+            stats['failed'] += 1
+    return stats
+
+
+def schedule_processing(image_id):
+    if _setting('IMAGE_VARIANTS_AUTOPROCESS', False):
+        # Solo para desarrollo (en producción corre process_images): un hilo
+        # aparte después del commit procesa esta foto y nada más. El resto
+        # de la cola (p. ej. lo que dejó pendiente la migración 0009) es
+        # trabajo del worker, no de un worker web.
+        transaction.on_commit(partial(_process_in_background, image_id))
+
+
+def _process_in_background(image_id):
+    def run():
+        from django.db import connection
+        try:
+            process_pending_images(ids=[image_id])
+        except Exception:
+            logger.exception("Error procesando las variantes de imágenes")
+        finally:
+            connection.close()
+    threading.Thread(target=run, name='image-variants', daemon=True).start()
+
+
+# ==========================================
+# SALIDA PARA EL FRONTEND
+# ==========================================
+
+def srcset(image):
+    """
+    Estructura lista para <picture>/<img srcset>:
+      {"src": url card JPEG, "width", "height", "blurhash",
+       "sources": [{"type": "image/webp", "srcset": "url 160w, url 480w, ..."}, ...]}
+    None si la foto todavía no tiene variantes (el frontend usa la URL original).
+    """
+    if image is None or image.processing_status != ProductImage.ProcessingChoices.READY or not image.variants:
+        return None
+    by_format = {}
+    for variant in image.variants:
+        by_format.setdefault(variant['format'], []).append(variant)
+    fallback = by_format.get('jpeg') or image.variants
+    src = next((v for v in fallback if v['name'] == FALLBACK_VARIANT), fallback[-1])
+    return {
+        'src': src['url'],
+        'width': image.width,
+        'height': image.height,
+        'blurhash': image.blurhash,
+        'sources': [
+            {'type': mime, 'srcset': ', '.join(f"{v['url']} {v['width']}w" for v in by_format[ext])}
+            for ext, _, mime in IMAGE_VARIANT_FORMATS if ext in by_format
+        ],
+    }
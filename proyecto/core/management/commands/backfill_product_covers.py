@@ -0,0 +1,16 @@
+from django.core.management import BaseCommand
+
+from core.catalog import backfill_product_covers, invalidate_catalog
+
+
+class Command(BaseCommand):
+    help = "Recalcula la portada guardada en cada producto (main_image_url, main_image_srcset, image_count)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        updated = backfill_product_covers(batch_size=options['batch_size'])
+        # bulk_update no dispara señales: el snapshot de /api/products/ se invalida a mano
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f"Portadas recalculadas: {updated} productos"))
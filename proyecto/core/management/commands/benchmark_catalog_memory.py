@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+from django.core.management import BaseCommand, call_command
+from django.http import JsonResponse, StreamingHttpResponse
+from django.test.utils import override_settings
+
+from core.catalog import build_catalog, iter_catalog_json
+from core.models import Category, Product, ProductImage
+
+# Las URLs de imágenes se arman con el storage local: no queremos medir Cloudinary
+LOCAL_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el RSS máximo de /api/products/ armado en memoria (JsonResponse) "
+        "vs. en streaming. Cada medición corre en un proceso aparte contra una "
+        "base SQLite temporal, así el pico de memoria de una no contamina a la otra."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 50000])
+        parser.add_argument('--images', type=int, default=3, help="Imágenes por producto")
+        parser.add_argument('--json', action='store_true', help="Salida en JSON")
+        # Modos internos (los usa el proceso hijo)
+        parser.add_argument('--seed', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--measure', choices=['buffered', 'streamed'], help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            return self.seed(options['seed'], options['images'])
+        if options['measure']:
+            return self.measure(options['measure'])
+
+        results = []
+        for size in options['sizes']:
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}")
+                self.run_child(env, '--seed', str(size), '--images', str(options['images']))
+                for mode in ('buffered', 'streamed'):
+                    result = self.run_child(env, '--measure', mode)
+                    result.update(products=size, mode=mode)
+                    results.append(result)
+                    if not options['json']:
+                        self.stdout.write(
+                            f"{size:>7} productos | {mode:<8} | pico RSS {result['peak_rss_kb'] / 1024:8.1f} MB "
+                            f"(+{result['delta_rss_kb'] / 1024:7.1f} MB) | {result['seconds']:6.2f}s | "
+                            f"{result['bytes'] / 1024:9.0f} KB"
+                        )
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def run_child(self, env, *args):
+        cmd = [sys.executable, sys.argv[0], 'benchmark_catalog_memory', *args]
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True)
+        # settings.py imprime cosas al arrancar: el resultado es la última línea
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    def seed(self, size, images_per_product):
+        call_command('migrate', verbosity=0)
+        categories = Category.objects.bulk_create(
+            [Category(name=f"Categoría {i}", slug=f"categoria-{i}") for i in range(20)]
+        )
+        products = Product.objects.bulk_create(
+            [
+                Product(
+                    category=categories[i % len(categories)],
+                    sku=f"BENCH-{i}",
+                    name=f"Producto de prueba {i}",
+                    description="Aros de plata hechos a mano con piedras naturales. " * 3,
+                    price=Decimal(1000 + i % 50000),
+                    stock=i % 7,
+                    is_featured=i % 10 == 0,
+                )
+                for i in range(size)
+            ],
+            batch_size=2000,
+        )
+        ProductImage.objects.bulk_create(
+            [
+                ProductImage(product=product, image=f"products/bench_{product.id}_{j}.jpg", is_main=j == 0)
+                for product in products
+                for j in range(images_per_product)
+            ],
+            batch_size=5000,
+        )
+        self.stdout.write(json.dumps({'seeded': size}))
+
+    def measure(self, mode):
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        size = 0
+        with override_settings(STORAGES=LOCAL_STORAGES):
+            if mode == 'buffered':
+                # El camino antiguo: lista completa de dicts + serialización de una vez
+                response = JsonResponse(build_catalog(), safe=False)
+                size = len(response.content)
+            else:
+                response = StreamingHttpResponse(iter_catalog_json(), content_type='application/json')
+                for chunk in response.streaming_content:
+                    size += len(chunk)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(json.dumps({
+            'peak_rss_kb': peak,
+            'delta_rss_kb': peak - baseline,
+            'seconds': round(time.perf_counter() - started, 3),
+            'bytes': size,
+        }))
@@ -0,0 +1,408 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+import requests
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.catalog import backfill_product_covers
+from core.models import Address, Category, Favorite, Order, OrderItem, Product, ProductImage, Shipment, User, compute_final_price
+
+# ==========================================
+# BENCHMARK DE ENDPOINTS CON UN CATÁLOGO GRANDE
+# ==========================================
+# Siembra un dataset realista (por defecto 20k productos en un árbol de
+# categorías de 3 niveles, 5 fotos c/u, 100k órdenes, 50k favoritos) en una
+# base SQLite aparte y mide latencia (p50/p95/p99) y queries por request de
+# los endpoints calientes y los changelists del admin.
+#
+#   python manage.py benchmark_endpoints --output base.json        # antes del cambio
+#   python manage.py benchmark_endpoints --compare base.json        # después
+#
+# --compare termina con error si algún endpoint hace más queries que en la
+# base o si su p95 empeora más de --latency-tolerance. Con --db la base
+# sembrada se reutiliza entre corridas (el dataset es determinista).
+
+DEFAULT_SIZES = {'products': 20000, 'images': 5, 'users': 5000, 'orders': 100000, 'favorites': 50000}
+CATEGORY_TREE = (8, 5, 5)  # raíces, hijas por raíz, nietas por hija
+HEAVY_USER_EMAIL = 'cliente0@bench.cl'  # El cliente con más órdenes y favoritos
+HEAVY_USER_ORDERS = 500
+HEAVY_USER_FAVORITES = 300
+ORDER_STATUSES = (
+    (Order.StatusChoices.PAID, 50),
+    (Order.StatusChoices.DELIVERED, 20),
+    (Order.StatusChoices.PENDING, 15),
+    (Order.StatusChoices.SHIPPED, 10),
+    (Order.StatusChoices.CANCELED, 5),
+)
+BATCH_SIZE = 2000
+
+# Sin Cloudinary ni cache en disco: se mide el código, no la red
+BENCH_SETTINGS = {
+    'STORAGES': {
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    },
+    'CACHES': {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    'DEBUG': False,
+    'EMAIL_OUTBOX_AUTODRAIN': False,
+    'IMAGE_VARIANTS_AUTOPROCESS': False,
+    'SQL_INSTRUMENTATION': False,
+    'FLOW_API_KEY': 'bench-key',
+    'FLOW_SECRET_KEY': 'bench-secret',
+    'FLOW_API_URL': 'https://flow.bench/api',
+}
+
+
+# ==========================================
+# DATASET
+# ==========================================
+
+@contextmanager
+def explicit_created_at(*models):
+    # bulk_create respeta auto_now_add: lo apagamos para repartir las fechas
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def seed_categories():
+    roots, children, grandchildren = CATEGORY_TREE
+    leaves = []
+    for i in range(roots):
+        root = Category.objects.create(name=f"Línea {i}", slug=f"linea-{i}")
+        for j in range(children):
+            child = Category.objects.create(name=f"Tipo {i}.{j}", slug=f"tipo-{i}-{j}", parent=root)
+            for k in range(grandchildren):
+                leaves.append(Category.objects.create(name=f"Modelo {i}.{j}.{k}", slug=f"modelo-{i}-{j}-{k}", parent=child))
+    return leaves
+
+
+def seed_dataset(products, images, users, orders, favorites, seed=42):
+    """
+    Siembra el dataset con ids explícitos (la base está vacía), en bloques de
+    bulk_create. Devuelve los conteos finales.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    leaves = seed_categories()
+
+    with explicit_created_at(Product, Order, Favorite):
+        Product.objects.bulk_create(
+            (
+                Product(
+                    id=i, category=leaves[i % len(leaves)], sku=f"BENCH-{i}", name=f"Producto {i}",
+                    description="Aros de plata hechos a mano con piedras naturales. " * 3,
+                    price=Decimal(1000 + i % 50000), discount_percent=(i % 4) * 10,
+                    final_price=compute_final_price(Decimal(1000 + i % 50000), (i % 4) * 10),
+                    stock=1000, is_featured=i % 20 == 0, is_active=i % 50 != 0,
+                    created_at=now - timedelta(minutes=i),
+                )
+                for i in range(1, products + 1)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        ProductImage.objects.bulk_create(
+            (
+                ProductImage(product_id=p, image=f"products/bench_{p}_{j}.jpg", is_main=j == 1)
+                for p in range(1, products + 1) for j in range(images)
+            ),
+            batch_size=BATCH_SIZE * 5,
+        )
+
+        User.objects.bulk_create(
+            (User(id=u, username=f"cliente{u - 1}@bench.cl", email=f"cliente{u - 1}@bench.cl", first_name=f"Cliente {u}")
+             for u in range(1, users + 1)),
+            batch_size=BATCH_SIZE,
+        )
+        Address.objects.bulk_create(
+            (Address(id=u, user_id=u, street_address=f"Calle {u}", city="Santiago", state="RM", zip_code="8320000", is_default=True)
+             for u in range(1, users + 1)),
+            batch_size=BATCH_SIZE,
+        )
+
+        statuses = [status for status, weight in ORDER_STATUSES for _ in range(weight)]
+        order_rows, item_rows, shipments = [], [], []
+        item_id = 0
+        for o in range(1, orders + 1):
+            user_id = 1 if o <= min(HEAVY_USER_ORDERS, orders) else rng.randint(2, max(2, users))
+            user_id = min(user_id, users)
+            status = rng.choice(statuses)
+            lines = [(rng.randint(1, products), rng.randint(1, 3)) for _ in range(rng.randint(1, 3))]
+            total = Decimal(0)
+            for product_id, quantity in lines:
+                item_id += 1
+                price = Decimal(1000 + product_id % 50000)
+                total += price * quantity
+                item_rows.append(OrderItem(id=item_id, order_id=o, product_id=product_id, quantity=quantity, unit_price=price))
+            order_rows.append(Order(
+                id=o, user_id=user_id, shipping_address_id=user_id, status=status,
+                total_amount=total, created_at=now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+            ))
+            if status in (Order.StatusChoices.SHIPPED, Order.StatusChoices.DELIVERED):
+                shipments.append(Shipment(order_id=o, tracking_number=f"TRK{o:08d}", courier="Starken", shipped_at=now))
+            if len(order_rows) >= BATCH_SIZE:
+                Order.objects.bulk_create(order_rows)
+                OrderItem.objects.bulk_create(item_rows)
+                order_rows, item_rows = [], []
+        Order.objects.bulk_create(order_rows)
+        OrderItem.objects.bulk_create(item_rows)
+        Shipment.objects.bulk_create(shipments, batch_size=BATCH_SIZE)
+
+        pairs = {(1, p) for p in rng.sample(range(1, products + 1), min(HEAVY_USER_FAVORITES, products, favorites))}
+        while len(pairs) < min(favorites, users * products):
+            pairs.add((rng.randint(1, users), rng.randint(1, products)))
+        Favorite.objects.bulk_create(
+            (Favorite(user_id=u, product_id=p, created_at=now - timedelta(minutes=n)) for n, (u, p) in enumerate(sorted(pairs))),
+            batch_size=BATCH_SIZE,
+        )
+
+    # bulk_create no pasa por las señales: portadas guardadas en Product
+    backfill_product_covers()
+    return dataset_counts()
+
+
+def dataset_counts():
+    return {
+        'categories': Category.objects.count(),
+        'products': Product.objects.count(),
+        'images': ProductImage.objects.count(),
+        'users': User.objects.count(),
+        'orders': Order.objects.count(),
+        'order_items': OrderItem.objects.count(),
+        'favorites': Favorite.objects.count(),
+    }
+
+
+# ==========================================
+# MEDICIÓN
+# ==========================================
+
+def flow_create_response(*args, **kwargs):
+    # Flow "instantáneo": se mide nuestro lado de create_payment, no la red
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps({'url': 'https://flow.bench/pay', 'token': 'bench', 'flowOrder': 1}).encode()
+    return response
+
+
+def build_scenarios(client, admin_client):
+    """{nombre: función(i) -> response}. i es el número de iteración."""
+    heavy = HEAVY_USER_EMAIL
+    order_ids = list(Order.objects.order_by('id').values_list('id', flat=True)[:1000])
+    product_ids = list(Product.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)[:1000])
+    leaf = Category.objects.filter(depth=1).order_by('id').values_list('slug', flat=True).first()
+
+    def create_payment(i):
+        cart = [{'id': product_ids[i % len(product_ids)], 'quantity': 1}, {'id': product_ids[(i * 7) % len(product_ids)], 'quantity': 2}]
+        payload = json.dumps({'email': heavy, 'cart': cart, 'shipping': {'nombre': 'Bench', 'region': 'RM'}})
+        with mock.patch('requests.Session.request', side_effect=flow_create_response):
+            return client.post(reverse('create_payment'), payload, content_type='application/json')
+
+    return {
+        'get_products': lambda i: client.get(reverse('get_products')),
+        'get_products_page': lambda i: client.get(reverse('get_products'), {'category': leaf, 'limit': 24, 'sort': 'price_asc'}),
+        'get_user_orders': lambda i: client.get(reverse('get_user_orders'), {'email': heavy}),
+        'get_user_orders_page': lambda i: client.get(reverse('get_user_orders'), {'email': heavy, 'limit': 20}),
+        'get_favorites': lambda i: client.get(reverse('get_favorites'), {'email': heavy}),
+        # Un código distinto por iteración: casi todas son consultas sin cache
+        'track_order': lambda i: client.get(reverse('track_order'), {'code': f"POLI-{order_ids[i % len(order_ids)]}"}),
+        'create_payment': create_payment,
+        'admin_products': lambda i: admin_client.get(reverse('admin:core_product_changelist')),
+        'admin_orders': lambda i: admin_client.get(reverse('admin:core_order_changelist')),
+        'admin_categories': lambda i: admin_client.get(reverse('admin:core_category_changelist')),
+        'admin_users': lambda i: admin_client.get(reverse('admin:core_user_changelist')),
+    }
+
+
+def percentile(samples, pct):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def measure_scenario(func, iterations, warmup):
+    for i in range(warmup):
+        func(i)
+    timings, queries, statuses = [], [], set()
+    for i in range(warmup, warmup + iterations):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = func(i)
+            elapsed = time.perf_counter() - started
+        timings.append(elapsed * 1000)
+        queries.append(len(ctx.captured_queries))
+        statuses.add(response.status_code)
+    return {
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'queries': max(queries),
+        'queries_min': min(queries),
+        'status': sorted(statuses),
+    }
+
+
+def measure_endpoints(iterations=30, warmup=3, only=None):
+    # Todo en una transacción que se deshace al final: las órdenes que crea
+    # create_payment no se acumulan y una base --db sirve igual en la próxima corrida
+    with override_settings(**BENCH_SETTINGS), transaction.atomic():
+        admin = User.objects.filter(username='bench-admin').first()
+        if admin is None:
+            admin = User.objects.create_superuser('bench-admin', 'admin@bench.cl', 'bench')
+        client = Client()
+        admin_client = Client()
+        admin_client.force_login(admin)
+        results = {}
+        for name, func in build_scenarios(client, admin_client).items():
+            if only and name not in only:
+                continue
+            results[name] = measure_scenario(func, iterations, warmup)
+        transaction.set_rollback(True)
+        return results
+
+
+def compare_results(baseline, current, query_tolerance=0, latency_tolerance=0.25, min_latency_delta_ms=2.0):
+    """
+    Lista de regresiones (texto) de current contra baseline. Una regresión es:
+    otro status HTTP, más queries que la base (+ query_tolerance), o un p95 que
+    empeora más de latency_tolerance (fracción) y de min_latency_delta_ms (para
+    no saltar por ruido).
+    """
+    regressions = []
+    for name, now in current.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if now['status'] != before['status']:
+            regressions.append(f"{name}: status {before['status']} -> {now['status']}")
+        if now['queries'] > before['queries'] + query_tolerance:
+            regressions.append(f"{name}: queries {before['queries']} -> {now['queries']}")
+        limit = before['p95_ms'] * (1 + latency_tolerance)
+        if now['p95_ms'] > limit and now['p95_ms'] - before['p95_ms'] > min_latency_delta_ms:
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f} ms -> {now['p95_ms']:.1f} ms")
+    return regressions
+
+
+# ==========================================
+# COMANDO
+# ==========================================
+
+class Command(BaseCommand):
+    help = (
+        "Siembra un catálogo grande en una base SQLite aparte y mide latencia y "
+        "queries de los endpoints principales y del admin. Con --compare falla si "
+        "hay regresiones contra un resultado anterior."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help="Multiplica el tamaño del dataset (ej: 0.1 para una corrida rápida)")
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--only', nargs='+', help="Medir solo estos escenarios")
+        parser.add_argument('--db', help="Archivo SQLite a reutilizar (se siembra solo si está vacío)")
+        parser.add_argument('--output', help="Guardar el resultado en este archivo JSON")
+        parser.add_argument('--json', action='store_true', help="Salida en JSON")
+        parser.add_argument('--compare', help="Resultado JSON anterior contra el cual comparar")
+        parser.add_argument('--query-tolerance', type=int, default=0)
+        parser.add_argument('--latency-tolerance', type=float, default=0.25, help="Fracción de empeoramiento del p95 permitida")
+        parser.add_argument('--min-latency-delta-ms', type=float, default=2.0)
+        # Modos internos (los usa el proceso hijo)
+        parser.add_argument('--seed', action='store_true', help=argparse.SUPPRESS)
+        parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        sizes = {name: max(1, int(value * options['scale'])) for name, value in DEFAULT_SIZES.items()}
+        sizes['images'] = DEFAULT_SIZES['images']
+        if options['seed']:
+            return self.seed(sizes)
+        if options['measure']:
+            results = measure_endpoints(options['iterations'], options['warmup'], options['only'])
+            self.stdout.write(json.dumps({'dataset': dataset_counts(), 'results': results}))
+            return
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = options['db'] or os.path.join(tmp, 'bench.sqlite3')
+            env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.abspath(path)}")
+            seeded = self.run_child(env, '--seed', '--scale', str(options['scale']))
+            if not options['json']:
+                self.stdout.write(f"Dataset: {seeded['dataset']} ({seeded['seconds']:.0f}s de siembra)")
+            measure_args = ['--measure', '--iterations', str(options['iterations']), '--warmup', str(options['warmup'])]
+            if options['only']:
+                measure_args += ['--only', *options['only']]
+            report = self.run_child(env, *measure_args)
+        report['iterations'] = options['iterations']
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_table(report['results'])
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = compare_results(
+                baseline['results'], report['results'],
+                query_tolerance=options['query_tolerance'],
+                latency_tolerance=options['latency_tolerance'],
+                min_latency_delta_ms=options['min_latency_delta_ms'],
+            )
+            if regressions:
+                raise CommandError("Regresiones contra la base:\n  " + "\n  ".join(regressions))
+            self.stdout.write(self.style.SUCCESS("Sin regresiones contra la base."))
+
+    def run_child(self, env, *args):
+        cmd = [sys.executable, sys.argv[0], 'benchmark_endpoints', *args]
+        try:
+            proc = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True)
+        except subprocess.CalledProcessError as e:
+            # Una corrida fallida nunca se compara como si hubiera medido algo
+            stderr = e.stderr.strip()
+            raise CommandError(stderr.splitlines()[-1] if stderr else f"Falló el proceso hijo ({e.returncode})")
+        # settings.py imprime cosas al arrancar: el resultado es la última línea
+        lines = proc.stdout.strip().splitlines()
+        try:
+            return json.loads(lines[-1])
+        except (IndexError, ValueError):
+            raise CommandError(f"El proceso hijo no devolvió un resultado: {' '.join(args)}")
+
+    def seed(self, sizes):
+        started = time.perf_counter()
+        call_command('migrate', verbosity=0)
+        if Product.objects.exists():
+            dataset = dataset_counts()  # --db ya sembrada: el dataset es determinista
+        else:
+            with override_settings(**BENCH_SETTINGS):  # URLs de portada con el storage local
+                dataset = seed_dataset(**sizes)
+        self.stdout.write(json.dumps({'dataset': dataset, 'seconds': round(time.perf_counter() - started, 1)}))
+
+    def print_table(self, results):
+        self.stdout.write(f"{'escenario':<22} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8}  status")
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<22} {r['p50_ms']:>7.1f}ms {r['p95_ms']:>7.1f}ms {r['p99_ms']:>7.1f}ms {r['queries']:>8}  {r['status']}"
+            )
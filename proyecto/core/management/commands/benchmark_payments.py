@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+from django.conf import settings
+from django.core.management import BaseCommand
+
+ENDPOINTS = {
+    'final-redirect': '/api/payment/final-redirect/',
+    'confirm': '/api/payment/confirm/',
+}
+
+
+class FakeFlowHandler(BaseHTTPRequestHandler):
+    """Imita payment/getStatus y payment/create de Flow, con latencia fija."""
+
+    latency = 0.2
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        query = parse_qs(urlparse(self.path).query)
+        token = query.get('token', [''])[0]
+        # Siempre "pendiente": nada queda en cache y no se toca el stock
+        self.send_json({'flowOrder': 1, 'commerceOrder': f"POLI-{token}", 'status': 1})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.latency)
+        self.send_json({'url': 'https://sandbox.flow.cl/app/web/pay.php', 'token': 'fake', 'flowOrder': 1})
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"El servidor no levantó en el puerto {port}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara las vistas de pago síncronas (gunicorn/WSGI) vs. async "
+        "(uvicorn/ASGI) con un Flow falso local que responde con latencia. "
+        "Cada servidor corre en un proceso aparte contra una base SQLite temporal."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.2, help="Latencia de Flow en segundos")
+        parser.add_argument('--requests', type=int, default=200, help="Peticiones por servidor")
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=2, help="Procesos por servidor")
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='final-redirect')
+        parser.add_argument('--json', action='store_true', help="Salida en JSON")
+
+    def handle(self, *args, **options):
+        FakeFlowHandler.latency = options['latency']
+        flow_server = ThreadingHTTPServer(('127.0.0.1', 0), FakeFlowHandler)
+        flow_server.daemon_threads = True
+        threading.Thread(target=flow_server.serve_forever, daemon=True).start()
+
+        results = []
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(
+                    os.environ,
+                    DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}",
+                    CACHE_DIR=os.path.join(tmp, 'cache'),
+                    FLOW_API_URL=f"http://127.0.0.1:{flow_server.server_address[1]}",
+                    FLOW_API_KEY='bench',
+                    FLOW_SECRET_KEY='bench',
+                    EMAIL_OUTBOX_AUTODRAIN='False',
+                )
+                subprocess.run(
+                    [sys.executable, 'manage.py', 'migrate', '--verbosity', '0'],
+                    cwd=settings.BASE_DIR, env=env, check=True, capture_output=True,
+                )
+                for mode in ('wsgi', 'asgi'):
+                    result = self.run_server(mode, env, options)
+                    results.append(result)
+                    if not options['json']:
+                        self.stdout.write(
+                            f"{mode:<4} | {result['requests']} req, {options['concurrency']} concurrentes | "
+                            f"{result['rps']:7.1f} req/s | p50 {result['p50_ms']:7.0f} ms | "
+                            f"p95 {result['p95_ms']:7.0f} ms | errores {result['errors']}"
+                        )
+        finally:
+            flow_server.shutdown()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def run_server(self, mode, env, options):
+        port = free_port()
+        workers = str(options['workers'])
+        if mode == 'wsgi':
+            cmd = [sys.executable, '-m', 'gunicorn', 'proyecto.wsgi:application',
+                   '--bind', f"127.0.0.1:{port}", '--workers', workers]
+            server_env = dict(env, ASYNC_PAYMENT_VIEWS='False')
+        else:
+            cmd = [sys.executable, '-m', 'uvicorn', 'proyecto.asgi:application',
+                   '--host', '127.0.0.1', '--port', str(port), '--workers', workers]
+            server_env = dict(env, ASYNC_PAYMENT_VIEWS='True')
+
+        proc = subprocess.Popen(cmd, cwd=settings.BASE_DIR, env=server_env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            result = asyncio.run(self.load(f"http://127.0.0.1:{port}", options))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+        result['mode'] = mode
+        return result
+
+    async def load(self, base_url, options):
+        url = base_url + ENDPOINTS[options['endpoint']]
+        total = options['requests']
+        latencies = []
+        errors = 0
+        counter = iter(range(total))
+
+        async def worker(client):
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    # Token distinto por petición: ninguna se sirve desde el cache
+                    response = await client.post(url, data={'token': f"bench-{i}-{time.monotonic_ns()}"})
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        limits = httpx.Limits(max_connections=options['concurrency'])
+        async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*[worker(client) for _ in range(options['concurrency'])])
+            elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'requests': total,
+            'errors': errors,
+            'seconds': round(elapsed, 3),
+            'rps': round(total / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies), 1),
+            'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 1),
+        }
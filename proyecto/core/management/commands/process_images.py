@@ -0,0 +1,39 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from core.images import process_pending_images, DEFAULT_BATCH_SIZE
+from core.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = "Genera las variantes responsive (miniatura, tarjeta, detalle; WebP y JPEG) de las fotos pendientes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--all', action='store_true', help="Volver a generar las variantes de todas las fotos")
+        parser.add_argument('--retry-failed', action='store_true', help="Reintentar las que fallaron")
+        parser.add_argument('--loop', action='store_true', help="Quedarse corriendo como worker")
+        parser.add_argument('--interval', type=float, default=5.0, help="Segundos de espera cuando no hay pendientes")
+
+    def handle(self, *args, **options):
+        requeue = ProductImage.objects.none()
+        if options['all']:
+            requeue = ProductImage.objects.exclude(processing_status=ProductImage.ProcessingChoices.PENDING)
+        elif options['retry_failed']:
+            requeue = ProductImage.objects.filter(processing_status=ProductImage.ProcessingChoices.FAILED)
+        requeued = requeue.update(processing_status=ProductImage.ProcessingChoices.PENDING, processing_error='')
+        if requeued:
+            self.stdout.write(f"Reencoladas: {requeued}")
+
+        while True:
+            close_old_connections()
+            stats = process_pending_images(batch_size=options['batch_size'])
+            if any(stats.values()):
+                self.stdout.write(f"Listas: {stats['ready']} | Fallidas: {stats['failed']}")
+            # Si el lote salió lleno probablemente quedan más: seguimos sin esperar
+            if sum(stats.values()) < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand
+
+from core.models import Product, ProductSearchGram
+from core.search import index_products
+
+
+class Command(BaseCommand):
+    help = "Reconstruye desde cero el índice de búsqueda de productos (ProductSearchGram)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ProductSearchGram.objects.all().delete()
+        batch, total = [], 0
+        for product in Product.objects.select_related('category').iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                index_products(batch)
+                total += len(batch)
+                batch = []
+        index_products(batch)
+        total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Índice reconstruido: {total} productos"))
@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+
+from core.catalog import invalidate_catalog
+from core.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recalcula el precio final guardado en cada producto (después de importar o editar precios por SQL)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        changed = Product.objects.all().refresh_final_prices(batch_size=options['batch_size'])
+        # bulk_update no dispara señales: el snapshot de /api/products/ se invalida a mano
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f"Precios finales recalculados: {changed} productos"))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from core.outbox import drain_outbox, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Despacha los correos en cola (EmailOutbox) por lotes, reutilizando una conexión SMTP."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help="Quedarse corriendo como worker")
+        parser.add_argument('--interval', type=float, default=5.0, help="Segundos de espera cuando la cola está vacía")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            stats = drain_outbox(batch_size=options['batch_size'])
+            if any(stats.values()):
+                self.stdout.write(f"Enviados: {stats['sent']} | Reintentos: {stats['retry']} | Fallidos: {stats['dead']}")
+            # Si el lote salió lleno probablemente quedan más: seguimos sin esperar
+            if sum(stats.values()) < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
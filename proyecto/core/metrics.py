@@ -0,0 +1,253 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# ==========================================
+# MÉTRICAS (FORMATO PROMETHEUS) - /metrics
+# ==========================================
+# Contadores e histogramas de buckets fijos, en memoria y protegidos con un
+# lock (gunicorn con threads). Lo que más pesa en la cola de latencias está
+# fuera de la BD, así que se mide:
+#   external_call_duration_seconds{dependency="flow|smtp|cloudinary|...", operation, outcome}
+#   http_request_duration_seconds{view, method, status}
+# Prometheus saca el p50/p95/p99 con histogram_quantile() sobre los buckets.
+#
+# Varios workers de gunicorn: con METRICS_DIR cada proceso vuelca su registro
+# a METRICS_DIR/metrics-<pid>.json (como mucho una vez por
+# METRICS_FLUSH_INTERVAL segundos, con os.replace para no dejar archivos a
+# medias) y /metrics suma los de todos los procesos. Los archivos de procesos
+# que ya no existen (gunicorn reinició o reemplazó un worker) se borran al
+# leerlos: Prometheus lo ve como un reinicio de contadores, igual que al
+# reiniciar un proceso único.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'external_call_duration_seconds': "Latencia de llamadas a servicios externos (Flow, SMTP, storage).",
+    'http_request_duration_seconds': "Latencia de las vistas de Django.",
+    'email_outbox_messages_total': "Correos procesados por el outbox, por resultado.",
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _file_pid(path):
+    try:
+        return int(os.path.basename(path)[len('metrics-'):-len('.json')])
+    except ValueError:
+        return None
+
+
+def _pid_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)  # Señal 0: solo comprueba que el proceso exista
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Existe, pero es de otro usuario
+    return True
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass  # Otro worker lo borró primero
+
+
+class Registry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> valor
+        self._histograms = {}  # (name, labels) -> [conteo por bucket (+Inf al final), suma]
+        self._last_flush = 0.0
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        index = bisect_left(self.buckets, value)  # Primer bucket con le >= value
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][index] += 1
+            histogram[1] += value
+        self._maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, list(counts), total] for (name, labels), (counts, total) in self._histograms.items()],
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    # --- Modo multiproceso ---
+
+    def _file_path(self, directory):
+        return os.path.join(directory, f"metrics-{os.getpid()}.json")
+
+    def _maybe_flush(self):
+        if _setting('METRICS_DIR', None) and time.monotonic() - self._last_flush >= _setting('METRICS_FLUSH_INTERVAL', 1.0):
+            self.flush()
+
+    def flush(self):
+        directory = _setting('METRICS_DIR', None)
+        if not directory:
+            return
+        self._last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, self._file_path(directory))
+
+    def collect(self):
+        """Snapshots de este proceso y, con METRICS_DIR, de los demás workers."""
+        own = self.snapshot()
+        directory = _setting('METRICS_DIR', None)
+        if not directory:
+            return [own]
+        snapshots = [own]
+        own_path = self._file_path(directory)
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            if path == own_path:
+                continue
+            if not _pid_alive(_file_pid(path)):
+                _remove(path)
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Un worker escribiendo justo ahora: entra en el próximo scrape
+        return snapshots
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def observe_external(dependency, operation, seconds, outcome='ok'):
+    observe('external_call_duration_seconds', seconds, dependency=dependency, operation=operation, outcome=outcome)
+
+
+@contextmanager
+def track(dependency, operation):
+    """
+    with metrics.track('smtp', 'send'):
+        connection.send_messages(...)
+    Registra la latencia con outcome="ok" o el nombre de la excepción.
+    """
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        observe_external(dependency, operation, time.perf_counter() - started, outcome)
+
+
+# ==========================================
+# EXPOSICIÓN (text/plain; version=0.0.4)
+# ==========================================
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def merge(snapshots):
+    counters, histograms = {}, {}
+    buckets = tuple(snapshots[0]['buckets']) if snapshots else DEFAULT_BUCKETS
+    for snapshot in snapshots:
+        if tuple(snapshot['buckets']) != buckets:
+            continue  # Proceso con otra configuración de buckets (deploy a medias)
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            current = histograms.setdefault(key, [[0] * len(counts), 0.0])
+            current[0] = [a + b for a, b in zip(current[0], counts)]
+            current[1] += total
+    return buckets, counters, histograms
+
+
+def render(snapshots=None):
+    if snapshots is None:
+        snapshots = registry.collect()
+    buckets, counters, histograms = merge(snapshots)
+    lines = []
+
+    for name in sorted({name for name, _ in counters}):
+        if name in HELP:
+            lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+    for name in sorted({name for name, _ in histograms}):
+        if name in HELP:
+            lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), (counts, total) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for le, count in zip((*buckets, float('inf')), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, [('le', _number(le))])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,179 @@
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger('core.slow_requests')
+
+# ==========================================
+# INSTRUMENTACIÓN SQL POR REQUEST
+# ==========================================
+# Cuenta las queries y el tiempo de BD de cada request (connection.execute_wrapper),
+# agrupa las que tienen la misma forma (mismo SQL, otros parámetros: el típico
+# N+1 de un for que consulta por fila) y responde con:
+#   Server-Timing: db;dur=12.4;desc="9 queries", app;dur=48.0
+# que el navegador muestra en DevTools > Network > Timing.
+#
+# Los requests que pasan SLOW_REQUEST_MS o SLOW_REQUEST_QUERIES quedan en el
+# logger 'core.slow_requests' como una línea JSON con el nombre de la vista.
+# Para dejarlo prendido en producción solo se envuelven las queries de una
+# fracción de los requests (SQL_INSTRUMENTATION_SAMPLE_RATE); la latencia se
+# mide siempre, que cuesta dos perf_counter().
+#
+# Las vistas async (core/async_views.py) corren el ORM en otro hilo, con otra
+# conexión: ahí solo se mide la latencia.
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def sql_shape(sql):
+    # "IN (%s, %s, %s)" y "IN (%s, %s)" son la misma query con otra cantidad de ids
+    return _WHITESPACE.sub(' ', _IN_LIST.sub('(...)', sql)).strip()
+
+
+class QueryStats:
+    """Se instala con connection.execute_wrapper(); acumula lo que pasa por él."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[sql_shape(sql)] += 1
+
+    def repeated(self, threshold):
+        return [{'sql': shape, 'count': n} for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    return match.view_name or match._func_path
+
+
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not _setting('SQL_INSTRUMENTATION', True):
+            return self.get_response(request)
+
+        stats = None
+        start = time.perf_counter()
+        if random.random() < _setting('SQL_INSTRUMENTATION_SAMPLE_RATE', 1.0):
+            stats = QueryStats()
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(stats))
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+        self.finish(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        if _setting('SQL_INSTRUMENTATION', True):
+            self.finish(request, response, time.perf_counter() - start, None)
+        return response
+
+    def finish(self, request, response, elapsed, stats):
+        total_ms = elapsed * 1000
+        if stats is not None:
+            db_ms = stats.duration * 1000
+            response['Server-Timing'] = (
+                f'db;dur={db_ms:.1f};desc="{stats.count} queries", app;dur={total_ms - db_ms:.1f}'
+            )
+        else:
+            response['Server-Timing'] = f'app;dur={total_ms:.1f}'
+
+        slow_ms = _setting('SLOW_REQUEST_MS', 500)
+        max_queries = _setting('SLOW_REQUEST_QUERIES', 30)
+        repeated = stats.repeated(_setting('SQL_REPEATED_QUERY_THRESHOLD', 5)) if stats is not None else []
+        too_many = stats is not None and stats.count > max_queries
+        if total_ms < slow_ms and not too_many and not repeated:
+            return
+
+        entry = {
+            'event': 'slow_request',
+            'view': _view_name(request),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(total_ms, 1),
+        }
+        if stats is not None:
+            entry.update({
+                'db_ms': round(stats.duration * 1000, 1),
+                'queries': stats.count,
+                'repeated_queries': repeated,  # Posibles N+1
+            })
+        logger.warning(json.dumps(entry, ensure_ascii=False))
+
+
+# ==========================================
+# LATENCIA POR VISTA (/metrics)
+# ==========================================
+# Histograma http_request_duration_seconds{view, method, status} en
+# core/metrics.py. Las URLs que no resuelven van todas a view="<no resuelta>"
+# para no crear una serie por cada ruta inventada.
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, elapsed):
+        metrics.observe(
+            'http_request_duration_seconds', elapsed,
+            view=_view_name(request) or '<no resuelta>', method=request.method, status=response.status_code,
+        )
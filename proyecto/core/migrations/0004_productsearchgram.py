@@ -0,0 +1,70 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:02
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Copia de la normalización de core/search.py al momento de esta migración:
+# así cambios posteriores en search.py no rompen migraciones viejas.
+# manage.py rebuild_search_index rearma el índice con las reglas vigentes.
+FIELD_WEIGHTS = (3, 3, 2, 1)  # name, sku, categoría, descripción
+MAX_DESCRIPTION_WORDS = 60
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def text_grams(text, max_words=None):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    grams = set()
+    for word in WORD_RE.findall(text.lower())[:max_words]:
+        padded = f"  {word} "
+        grams |= {padded[i:i + 3] for i in range(len(padded) - 2)}
+    return grams
+
+
+def product_grams(name, sku, category_name, description):
+    weights = {}
+    limits = (None, None, None, MAX_DESCRIPTION_WORDS)
+    for text, weight, max_words in zip((name, sku, category_name, description), FIELD_WEIGHTS, limits):
+        for gram in text_grams(text, max_words):
+            weights[gram] = weights.get(gram, 0) + weight
+    return weights
+
+
+def build_search_index(apps, schema_editor):
+    # Arma el índice para los productos que ya existen
+    Product = apps.get_model('core', 'Product')
+    ProductSearchGram = apps.get_model('core', 'ProductSearchGram')
+    rows = []
+    for product in Product.objects.select_related('category').iterator(chunk_size=500):
+        grams = product_grams(product.name, product.sku, product.category.name, product.description)
+        rows.extend(ProductSearchGram(product_id=product.id, gram=gram, weight=weight) for gram, weight in grams.items())
+        if len(rows) >= 5000:
+            ProductSearchGram.objects.bulk_create(rows)
+            rows = []
+    ProductSearchGram.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_product_is_featured'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchGram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(db_index=True, max_length=3)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_grams', to='core.product')),
+            ],
+            options={
+                'unique_together': {('product', 'gram')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
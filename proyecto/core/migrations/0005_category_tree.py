@@ -0,0 +1,48 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+def build_category_tree(apps, schema_editor):
+    # Calcula path/depth/full_name de las categorías existentes, de la raíz hacia abajo
+    Category = apps.get_model('core', 'Category')
+    categories = list(Category.objects.all())
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+
+    pending = [(category, '/', '', 0) for category in children.get(None, [])]
+    while pending:
+        category, parent_path, name_prefix, depth = pending.pop()
+        category.path = f"{parent_path}{category.pk}/"
+        category.full_name = name_prefix + category.name
+        category.depth = depth
+        for child in children.get(category.pk, []):
+            pending.append((child, category.path, category.full_name + ' -> ', depth + 1))
+    Category.objects.bulk_update(categories, ['path', 'depth', 'full_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_productsearchgram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='full_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(build_category_tree, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:04
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def fill_final_price(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    products = list(Product.objects.only('id', 'price', 'discount_percent'))
+    for product in products:
+        discount = min(product.discount_percent, 100)
+        product.final_price = (product.price * (100 - discount) / 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    Product.objects.bulk_update(products, ['final_price'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_category_tree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='final_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Precio final'),
+        ),
+        migrations.RunPython(fill_final_price, migrations.RunPython.noop),
+    ]
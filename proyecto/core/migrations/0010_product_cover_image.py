@@ -0,0 +1,54 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+def fill_product_covers(apps, schema_editor):
+    # Misma regla que catalog.pick_main_image, copiada acá para que la
+    # migración no dependa de cómo evolucione core/catalog.py.
+    # main_image_srcset queda en None: las variantes recién se generan con
+    # process_images, que vuelve a sincronizar la portada de cada producto.
+    Product = apps.get_model('core', 'Product')
+    ProductImage = apps.get_model('core', 'ProductImage')
+    batch_size = 500
+    last_id = 0
+    while True:
+        products = list(Product.objects.filter(id__gt=last_id).only('id').order_by('id')[:batch_size])
+        if not products:
+            break
+        last_id = products[-1].id
+        images = {}
+        for image in ProductImage.objects.filter(product_id__in=[p.id for p in products]).order_by('id'):
+            images.setdefault(image.product_id, []).append(image)
+        for product in products:
+            product_images = images.get(product.id, [])
+            main = next((img for img in product_images if img.is_main), product_images[0] if product_images else None)
+            product.main_image_url = main.image.url if main else ''
+            product.image_count = len(product_images)
+        Product.objects.bulk_update(products, ['main_image_url', 'image_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Fotos'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='main_image_srcset',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='main_image_url',
+            field=models.CharField(blank=True, editable=False, max_length=500, verbose_name='URL portada'),
+        ),
+        migrations.RunPython(fill_product_covers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_emailoutbox_sending'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productimage',
+            name='productimage_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='processing_status',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('lista', 'Lista'), ('fallida', 'Fallida')], default='pendiente', editable=False, max_length=20, verbose_name='Estado variantes'),
+        ),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(condition=models.Q(('processing_status__in', ['pendiente', 'procesando'])), fields=['id'], name='productimage_pending_idx'),
+        ),
+    ]
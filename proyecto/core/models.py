@@ -1,7 +1,15 @@
-from django.db import models
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 from django.utils.text import slugify
 
+CENTS = Decimal('0.01')
+
 # ==========================================
 # 1. USUARIOS Y CLIENTES
 # ==========================================
@@ -15,6 +23,13 @@ class User(AbstractUser):
     email = models.EmailField(unique=True) # Forzamos que sea único
     phone = models.CharField(max_length=20, blank=True, null=True, verbose_name="Teléfono")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Email con que se cargó (lo lee la señal que limpia el cache email -> id de favoritos)
+        instance._loaded_email = instance.__dict__.get('email')
+        return instance
+
     def __str__(self):
         return self.username
 
@@ -36,27 +51,146 @@ class Address(models.Model):
 # 2. CATÁLOGO DE PRODUCTOS
 # ==========================================
 
+def compute_final_price(price, discount_percent):
+    # Todo en Decimal (nada de float) y redondeado a centavos
+    price = Decimal(price)
+    discount = min(int(discount_percent or 0), 100)
+    if discount <= 0:
+        return price.quantize(CENTS)
+    return (price * (100 - discount) / 100).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+class ProductQuerySet(models.QuerySet):
+    # Campos de los que depende final_price
+    PRICE_FIELDS = frozenset({'price', 'discount_percent'})
+
+    def update(self, **kwargs):
+        # .update() / bulk_update() no pasan por save(): si tocan el precio o el
+        # descuento, final_price se recalcula para las mismas filas
+        if not self.PRICE_FIELDS & kwargs.keys():
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            ids = list(self.values_list('pk', flat=True))
+            updated = super().update(**kwargs)
+            self.model._default_manager.filter(pk__in=ids).refresh_final_prices()
+        return updated
+
+    update.alters_data = True
+
+    def refresh_final_prices(self, batch_size=500):
+        """
+        Recalcula final_price con compute_final_price() (el mismo redondeo que
+        save()) por lotes de id y guarda solo las filas que cambiaron. Para
+        datos que entraron sin el ORM (SQL a mano, importaciones); ver
+        manage.py refresh_final_prices. Devuelve cuántos productos cambiaron.
+        """
+        rows = self.order_by('pk').values_list('pk', 'price', 'discount_percent', 'final_price')
+        changed = 0
+        last_pk = None
+        while True:
+            batch = list((rows.filter(pk__gt=last_pk) if last_pk is not None else rows)[:batch_size])
+            if not batch:
+                return changed
+            last_pk = batch[-1][0]
+            stale = []
+            for pk, price, discount_percent, final_price in batch:
+                value = compute_final_price(price, discount_percent)
+                if value != final_price:
+                    stale.append(Product(pk=pk, final_price=value))
+            self.model._default_manager.bulk_update(stale, ['final_price'])
+            changed += len(stale)
+
+    refresh_final_prices.alters_data = True
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True, blank=True) # URL amigable
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='subcategories')
+    # Árbol materializado (lo mantiene save()): ancestros y subárbol en UNA query indexada
+    # path: ids desde la raíz, ej: "/3/8/15/"  -> subárbol = path__startswith
+    path = models.CharField(max_length=255, default='', editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Nombre completo ya armado ("Aros -> Argollas") para que __str__ no consulte a los padres
+    full_name = models.CharField(max_length=255, default='', editable=False)
+
+    TREE_FIELDS = ('path', 'depth', 'full_name')
+    NAME_SEPARATOR = ' -> '
 
     class Meta:
         verbose_name_plural = "Categories"
 
+    def clean(self):
+        super().clean()
+        # Evita ciclos: no se puede mover una categoría dentro de su propio subárbol
+        if self.pk and self.parent_id and self.path and self.parent.path.startswith(self.path):
+            raise ValidationError({'parent': "Una categoría no puede estar dentro de sí misma o de sus subcategorías."})
+
+    def _tree_prefix(self):
+        if self.parent_id is None:
+            return '/', '', 0
+        parent = self.parent
+        return parent.path, parent.full_name + self.NAME_SEPARATOR, parent.depth + 1
+
     def save(self, *args, **kwargs):
         # Generar slug automáticamente si no existe (ej: "Aros Plata" -> "aros-plata")
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+
+        old = None
+        if self.pk:
+            old = Category.objects.filter(pk=self.pk).values('path', 'depth', 'full_name').first()
+
+        parent_path, name_prefix, self.depth = self._tree_prefix()
+        self.full_name = name_prefix + self.name
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set(self.TREE_FIELDS)
+
+        if self.pk:
+            self.path = f"{parent_path}{self.pk}/"
+            # Cambió el nombre completo o la ubicación (lo lee la señal que reindexa la búsqueda)
+            self._tree_changed = bool(old and old['path'] and (old['path'], old['full_name']) != (self.path, self.full_name))
+            super().save(*args, **kwargs)
+        else:
+            # El path incluye el id propio, que recién existe después del INSERT
+            self._tree_changed = False
+            super().save(*args, **kwargs)
+            self.path = f"{parent_path}{self.pk}/"
+            Category.objects.filter(pk=self.pk).update(path=self.path)
+
+        if self._tree_changed:
+            self._move_descendants(old)
+
+    def _move_descendants(self, old):
+        # Reescribe el prefijo de todo el subárbol en un solo UPDATE
+        Category.objects.filter(path__startswith=old['path']).exclude(pk=self.pk).update(
+            path=Concat(Value(self.path), Substr('path', len(old['path']) + 1), output_field=models.CharField()),
+            full_name=Concat(Value(self.full_name), Substr('full_name', len(old['full_name']) + 1), output_field=models.CharField()),
+            depth=F('depth') + (self.depth - old['depth']),
+        )
+
+    def ancestor_ids(self):
+        return [int(pk) for pk in self.path.strip('/').split('/') if pk]
+
+    def get_ancestors(self, include_self=False):
+        """Breadcrumbs: de la raíz hacia abajo, en una sola query."""
+        ids = self.ancestor_ids()
+        if not include_self:
+            ids = ids[:-1]
+        return Category.objects.filter(pk__in=ids).order_by('depth')
+
+    def get_descendants(self, include_self=True):
+        """Todo el subárbol en una sola query (usa el índice de path)."""
+        qs = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            qs = qs.exclude(pk=self.pk)
+        return qs
+
+    def get_subtree_products(self):
+        return Product.objects.filter(category__path__startswith=self.path)
 
     def __str__(self):
-        full_path = [self.name]
-        k = self.parent
-        while k is not None:
-            full_path.append(k.name)
-            k = k.parent
-        return ' -> '.join(full_path[::-1])
+        return self.full_name or self.name
 
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
@@ -70,25 +204,91 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False, verbose_name="Destacado")
     created_at = models.DateTimeField(auto_now_add=True)
+    # Precio con descuento guardado en la BD (lo calcula save(), y
+    # ProductQuerySet.update() en los updates masivos) para poder ordenar y
+    # filtrar por precio real en SQL. Usar compute_final_price().
+    final_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, db_index=True, verbose_name="Precio final")
+    # Portada ya resuelta (is_main, si no la primera) y cantidad de fotos, para
+    # que los listados no consulten ProductImage ni llamen al storage por fila.
+    # Las mantiene sync_product_cover() desde las señales de ProductImage.
+    main_image_url = models.CharField(max_length=500, blank=True, editable=False, verbose_name="URL portada")
+    main_image_srcset = models.JSONField(null=True, blank=True, editable=False)
+    image_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Fotos")
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Django filtra los booleanos como "WHERE is_active" (sin "= 1"), que un
+        # índice compuesto (is_active, ...) no aprovecha en SQLite/MySQL. Por eso
+        # son índices parciales: solo las filas activas, ya en el orden del catálogo.
+        # (MySQL no soporta índices parciales y Django no los crea ahí.)
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], condition=Q(is_active=True), name='product_active_newest_idx'),
+            models.Index(fields=['-created_at'], condition=Q(is_active=True, is_featured=True), name='product_featured_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sku} - {self.name}"
 
-    @property
-    def final_price(self):
-        # Propiedad calculada para usar en el frontend
-        if self.discount_percent > 0:
-            return self.price * (1 - self.discount_percent / 100)
-        return self.price
+    def save(self, *args, **kwargs):
+        self.final_price = compute_final_price(self.price, self.discount_percent)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'final_price'}
+        super().save(*args, **kwargs)
 
 class ProductImage(models.Model):
+    """
+    Foto de un producto. Al subirla queda PENDIENTE y el worker
+    (manage.py process_images) genera las variantes livianas (miniatura,
+    tarjeta, detalle; en JPEG y WebP), sus medidas y el blurhash.
+    Ver core/images.py.
+    """
+    class ProcessingChoices(models.TextChoices):
+        PENDING = 'pendiente', 'Pendiente'
+        PROCESSING = 'procesando', 'Procesando'
+        READY = 'lista', 'Lista'
+        FAILED = 'fallida', 'Fallida'
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/', verbose_name="Imagen")
     is_main = models.BooleanField(default=False, verbose_name="Es portada")
+    # Lo que llena core/images.py (nunca dentro del request del admin)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Ancho")
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Alto")
+    blurhash = models.CharField(max_length=64, blank=True, editable=False)
+    # [{"name": "card", "format": "webp", "width": 480, "height": 360, "path": "...", "url": "..."}, ...]
+    variants = models.JSONField(default=list, blank=True, editable=False, verbose_name="Variantes")
+    processing_status = models.CharField(max_length=20, choices=ProcessingChoices.choices, default=ProcessingChoices.PENDING, editable=False, verbose_name="Estado variantes")
+    processing_error = models.TextField(blank=True, editable=False)
+    # Cuándo la reclamó un worker: si muere a mitad, otro la retoma (images.PROCESSING_LEASE)
+    processing_started_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'is_main'], name='productimage_main_idx'),
+            models.Index(fields=['id'], condition=Q(processing_status__in=['pendiente', 'procesando']), name='productimage_pending_idx'),
+        ]
 
     def __str__(self):
         return f"Img: {self.product.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'image' in instance.__dict__:  # Sin .defer('image')
+            instance._loaded_image = instance.__dict__['image']
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Foto nueva o reemplazada: sus variantes hay que volver a generarlas
+        if hasattr(self, '_loaded_image') and self.image.name != self._loaded_image:
+            self.processing_status = self.ProcessingChoices.PENDING
+            self.processing_error = ''
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'processing_status', 'processing_error'}
+        super().save(*args, **kwargs)
+        self._loaded_image = self.image.name
+
 # ==========================================
 # 3. VENTAS Y PEDIDOS
 # ==========================================
@@ -108,6 +308,14 @@ class Order(models.Model):
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Historial del cliente (/api/orders/): sus órdenes, más recientes primero
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            # Filtros del admin y revisiones de órdenes vencidas por estado + fecha
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
+
     def __str__(self):
         return f"Orden #{self.id} - {self.user.username}"
 
@@ -121,7 +329,7 @@ class OrderItem(models.Model):
     def save(self, *args, **kwargs):
         # Si no se especifica precio, usar el actual del producto
         if not self.unit_price:
-            self.unit_price = self.product.final_price if hasattr(self.product, 'final_price') else self.product.price
+            self.unit_price = compute_final_price(self.product.price, self.product.discount_percent)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -179,6 +387,66 @@ class ContactMessage(models.Model):
         verbose_name = "Mensaje de Contacto"
         verbose_name_plural = "Mensajes de Contacto"
         ordering = ['-created_at']
+        indexes = [
+            # Bandeja de no leídos del admin (parcial, ver Product.Meta)
+            models.Index(fields=['-created_at'], condition=Q(is_read=False), name='contact_unread_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} - {self.name}"
+# ==========================================
+# 7. BÚSQUEDA
+# ==========================================
+
+class ProductSearchGram(models.Model):
+    """
+    Índice invertido de trigramas para /api/products/search/.
+    Una fila por (producto, trigrama) con el peso acumulado de los campos
+    donde aparece. Lo mantiene core/search.py al guardar productos/categorías.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_grams')
+    gram = models.CharField(max_length=3, db_index=True)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('product', 'gram')
+
+    def __str__(self):
+        return f"{self.gram!r} -> {self.product_id}"
+
+# ==========================================
+# 8. CORREOS (OUTBOX)
+# ==========================================
+
+class EmailOutbox(models.Model):
+    """
+    Correos pendientes de enviar. Las vistas solo insertan una fila y el
+    worker (manage.py send_outbox) los despacha en lotes por una sola
+    conexión SMTP, con reintentos y backoff. Ver core/outbox.py.
+    """
+    class StatusChoices(models.TextChoices):
+        PENDING = 'pendiente', 'Pendiente'
+        SENDING = 'enviando', 'Enviando'
+        SENT = 'enviado', 'Enviado'
+        DEAD = 'fallido', 'Fallido (sin más reintentos)'
+
+    to = models.EmailField(verbose_name="Para")
+    subject = models.CharField(max_length=255, verbose_name="Asunto")
+    body_text = models.TextField(verbose_name="Texto")
+    body_html = models.TextField(blank=True, verbose_name="HTML")
+    status = models.CharField(max_length=20, choices=StatusChoices.choices, default=StatusChoices.PENDING)
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Intentos")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Próximo intento")
+    last_error = models.TextField(blank=True, verbose_name="Último error")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Correo en cola"
+        verbose_name_plural = "Correos en cola"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.subject} - {self.name}"
\ No newline at end of file
+        return f"{self.subject} -> {self.to} ({self.status})"
@@ -0,0 +1,354 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, PositiveIntegerField, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .catalog import TRUE_VALUES, invalidate_catalog
+from .models import Product, Order, OrderItem, Address, compute_final_price
+
+User = get_user_model()
+
+# ==========================================
+# CREACIÓN DE ÓRDENES (CHECKOUT)
+# ==========================================
+# Tarifas de envío por región. Checkout.jsx las lee de /api/shipping-rates/.
+# El total de la orden se calcula aquí con los precios de la BD: no
+# confiamos en el monto que manda el navegador.
+
+SHIPPING_RATES = {
+    "Región de Arica y Parinacota": 5200,
+    "Región de Tarapacá": 5200,
+    "Región de Antofagasta": 5200,
+    "Región de Atacama": 4300,
+    "Región de Coquimbo": 4300,
+    "Región de Valparaíso": 4300,
+    "Región Metropolitana": 4300,
+    "Región del Libertador Gral. Bernardo O'Higgins": 3100,
+    "Región del Maule": 4300,
+    "Región de Ñuble": 4300,
+    "Región del Biobío": 4300,
+    "Región de La Araucanía": 4300,
+    "Región de Los Ríos": 4300,
+    "Región de Los Lagos": 4300,
+    "Región de Aysén": 5200,
+    "Región de Magallanes": 5200,
+}
+# Región desconocida: cobramos la tarifa más alta antes que quedar cortos
+DEFAULT_SHIPPING_RATE = max(SHIPPING_RATES.values())
+
+
+def shipping_cost(region):
+    return Decimal(SHIPPING_RATES.get(region, DEFAULT_SHIPPING_RATE))
+
+
+def parse_cart(cart_items):
+    # {product_id: cantidad}, juntando líneas repetidas del mismo producto
+    quantities = OrderedDict()
+    for item in cart_items:
+        try:
+            product_id = int(item['id'])
+            quantity = int(item.get('quantity', 1))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Carrito inválido")
+        if quantity <= 0:
+            raise ValueError("Carrito inválido")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def create_order_from_cart(email, cart_items, shipping_data):
+    """
+    Crea usuario (si no existe), dirección, orden e items con un número fijo
+    de queries: todos los productos con un in_bulk y los items con bulk_create.
+    Debe llamarse dentro de transaction.atomic().
+    """
+    quantities = parse_cart(cart_items)
+    products = Product.objects.in_bulk(list(quantities))
+    # Igual que antes: los productos que ya no existen se ignoran
+    lines = [(products[pk], qty) for pk, qty in quantities.items() if pk in products]
+    if not lines:
+        raise ValueError("El carrito está vacío")
+
+    items = [
+        OrderItem(product=product, quantity=qty, unit_price=compute_final_price(product.price, product.discount_percent))
+        for product, qty in lines
+    ]
+    subtotal = sum((item.unit_price * item.quantity for item in items), Decimal('0'))
+    total = (subtotal + shipping_cost(shipping_data.get('region'))).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+
+    nombre_cliente = f"{shipping_data.get('nombre', '')} {shipping_data.get('apellido', '')}".strip() or 'Cliente Invitado'
+    user, _ = User.objects.get_or_create(
+        email=email,
+        defaults={'username': email, 'first_name': nombre_cliente}
+    )
+
+    address = Address.objects.create(
+        user=user,
+        street_address=shipping_data.get('direccion', 'Sin dirección'),
+        city=shipping_data.get('ciudad', 'Sin ciudad'),
+        state='N/A',
+        zip_code='0000000',
+    )
+
+    order = Order.objects.create(
+        user=user,
+        shipping_address=address,
+        total_amount=total,
+        status=Order.StatusChoices.PENDING
+    )
+    for item in items:
+        item.order = order
+    OrderItem.objects.bulk_create(items)
+    return order
+
+
+def discard_order(order_id):
+    """
+    Deshace una orden recién creada que nunca llegó a Flow (la vista async no
+    puede mantener la transacción abierta durante la llamada HTTP). El
+    usuario invitado se conserva: get_or_create lo reutiliza en el próximo intento.
+    """
+    with transaction.atomic():
+        order = Order.objects.filter(pk=order_id, status=Order.StatusChoices.PENDING).first()
+        if order is None:
+            return
+        address_id = order.shipping_address_id
+        order.delete()  # Los items caen en cascada
+        Address.objects.filter(pk=address_id).delete()
+
+
+# ==========================================
+# CONFIRMACIÓN DE PAGO
+# ==========================================
+
+def decrement_stock(quantities):
+    """
+    Descuenta stock de varios productos en UN solo UPDATE:
+        stock = GREATEST(stock, q) - q   (nunca baja de 0)
+    La resta la hace la BD sobre el valor actual de la fila (con su lock),
+    así dos confirmaciones simultáneas no se pisan. GREATEST(stock, q) - q en
+    vez de GREATEST(stock - q, 0) para no pasar por negativos en columnas
+    UNSIGNED (MySQL).
+    """
+    if not quantities:
+        return 0
+    qty = Case(
+        *[When(pk=pk, then=Value(q)) for pk, q in quantities.items()],
+        default=Value(0),
+        output_field=PositiveIntegerField(),
+    )
+    updated = Product.objects.filter(pk__in=list(quantities)).update(stock=Greatest(F('stock'), qty) - qty)
+    # .update() no dispara señales: el stock es parte del snapshot del catálogo
+    transaction.on_commit(invalidate_catalog)
+    return updated
+
+
+def mark_order_paid(order_id):
+    """
+    Pasa la orden a PAGADO y descuenta su stock, una sola vez aunque Flow
+    reintente el webhook o lleguen confirmaciones en paralelo: el cambio de
+    estado es un UPDATE condicional y solo quien lo gana descuenta stock.
+    Solo sale de PENDIENTE: una confirmación tardía no devuelve a PAGADO una
+    orden ya enviada o entregada.
+    Devuelve (orden, items con su producto) o None si ya no estaba pendiente.
+    """
+    with transaction.atomic():
+        won = Order.objects.filter(pk=order_id, status=Order.StatusChoices.PENDING).update(status=Order.StatusChoices.PAID)
+        if not won:
+            return None
+
+        order = Order.objects.select_related('user').get(pk=order_id)
+        items = list(order.items.select_related('product'))
+        quantities = {}
+        for item in items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        decrement_stock(quantities)
+        # El UPDATE de estado no dispara señales: el seguimiento cacheado queda viejo
+        transaction.on_commit(lambda: invalidate_tracking(order_id))
+    return order, items
+
+
+# ==========================================
+# HISTORIAL DE ÓRDENES (/api/orders/)
+# ==========================================
+# Solo las columnas que muestra User.jsx (values(), sin instanciar modelos) y
+# "vencida" calculado en SQL. Con cursor/limit pagina por keyset sobre
+# (created_at, id), apoyado en el índice order_user_created_idx.
+
+ORDER_EXPIRATION = timedelta(hours=6)  # Una orden pendiente vence a las 6 horas
+ORDER_HISTORY_PAGE_SIZE = 20
+MAX_ORDER_HISTORY_PAGE_SIZE = 100
+
+ORDER_STATUS_LABELS = dict(Order.StatusChoices.choices)
+
+
+def order_history_queryset(email=None, user_id=None):
+    # Con user_id (usuario ya resuelto) filtra directo por la columna del
+    # índice order_user_created_idx, sin el JOIN contra el usuario
+    owner = Q(user_id=user_id) if user_id is not None else Q(user__email=email)
+    threshold = timezone.now() - ORDER_EXPIRATION
+    is_expired = Case(
+        When(status=Order.StatusChoices.PENDING, created_at__lt=threshold, then=Value(True)),
+        default=Value(False),
+        output_field=BooleanField(),
+    )
+    return (
+        Order.objects.filter(owner)
+        .annotate(is_expired=is_expired)
+        .order_by('-created_at', '-id')
+        .values('id', 'status', 'total_amount', 'created_at', 'is_expired')
+    )
+
+
+def serialize_order_row(row):
+    return {
+        'id': row['id'],
+        'order_number': f"POLI-{row['id']}",
+        'status': ORDER_STATUS_LABELS.get(row['status'], row['status']),
+        'total': float(row['total_amount']),
+        'date': row['created_at'].strftime("%d/%m/%Y"),
+        'raw_status': row['status'],
+        'is_expired': bool(row['is_expired']),
+    }
+
+
+def attach_item_counts(orders):
+    # Una sola consulta agregada para todas las órdenes de la página
+    counts = dict(
+        OrderItem.objects.filter(order_id__in=[o['id'] for o in orders])
+        .values('order_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('order_id', 'total')
+    )
+    for order in orders:
+        order['item_count'] = counts.get(order['id'], 0)
+    return orders
+
+
+def encode_order_cursor(created_at, pk):
+    raw = json.dumps([created_at.isoformat(), pk])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_order_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError("Cursor inválido")
+
+
+def order_history(email, with_items=False):
+    orders = [serialize_order_row(row) for row in order_history_queryset(email)]
+    return attach_item_counts(orders) if with_items else orders
+
+
+def page_order_history(email=None, cursor=None, limit=ORDER_HISTORY_PAGE_SIZE, with_items=False, user_id=None):
+    queryset = order_history_queryset(email, user_id=user_id)
+    if cursor:
+        created_at, pk = decode_order_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    # Uno extra para saber si hay página siguiente sin COUNT(*)
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_order_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+    orders = [serialize_order_row(row) for row in rows]
+    if with_items:
+        attach_item_counts(orders)
+    return {'results': orders, 'next_cursor': next_cursor}
+
+
+def query_order_history(email, params):
+    try:
+        limit = int(params.get('limit') or ORDER_HISTORY_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("Parámetro 'limit' inválido")
+    return page_order_history(
+        email,
+        cursor=params.get('cursor'),
+        limit=max(1, min(limit, MAX_ORDER_HISTORY_PAGE_SIZE)),
+        with_items=params.get('with_items') in TRUE_VALUES,
+    )
+
+
+# ==========================================
+# SEGUIMIENTO DE PEDIDOS (/api/track/)
+# ==========================================
+# Envios.jsx consulta el mismo pedido una y otra vez. La vista pública (la
+# que ve cualquiera con el código) se guarda en el cache por orden y se
+# invalida cuando cambia la orden o su envío (ver core/signals.py y
+# mark_order_paid). El dueño recibe además dirección, transportista y total,
+# que salen de una sola query extra.
+
+TRACKING_CACHE_TIMEOUT = 60 * 60  # Red de seguridad (ej: cambia el nombre de un producto)
+
+
+def _tracking_key(order_id):
+    return f'tracking:order:{order_id}'
+
+
+def invalidate_tracking(order_id):
+    cache.delete(_tracking_key(order_id))
+
+
+def build_public_tracking(order_id):
+    """
+    Devuelve (id del dueño, datos públicos) con dos queries: la orden con su
+    usuario y los items con el nombre del producto. Lanza Order.DoesNotExist.
+    """
+    order = Order.objects.select_related('user').only('id', 'status', 'created_at', 'user__email').get(pk=order_id)
+    items = OrderItem.objects.filter(order_id=order.id).order_by('id').values_list('product__name', 'quantity', 'unit_price')
+    data = {
+        'success': True,
+        'id': order.id,
+        'email': order.user.email,
+        'order_number': f"POLI-{order.id}",
+        'status': order.get_status_display(),
+        'date': order.created_at.strftime("%d/%m/%Y"),
+        'is_owner': False,
+        'items': [{'name': name, 'quantity': quantity, 'price': float(price)} for name, quantity, price in items],
+    }
+    return order.user_id, data
+
+
+def get_public_tracking(order_id):
+    key = _tracking_key(order_id)
+    cached = cache.get(key)
+    if cached is None:
+        cached = build_public_tracking(order_id)
+        cache.set(key, cached, timeout=TRACKING_CACHE_TIMEOUT)
+    return cached
+
+
+def owner_tracking(order_id):
+    # Solo para el dueño: una query con dirección, usuario y envío (JOINs)
+    order = Order.objects.select_related('user', 'shipping_address', 'shipment').get(pk=order_id)
+    courier = "Pedido en preparación"
+    tracking_number = "Pendiente de envío"
+    if hasattr(order, 'shipment'):
+        courier = order.shipment.courier or courier
+        tracking_number = order.shipment.tracking_number or tracking_number
+    return {
+        'is_owner': True,
+        'customer_name': order.user.first_name or order.user.username,
+        'address': f"{order.shipping_address.street_address}, {order.shipping_address.city}" if order.shipping_address else "No especificada",
+        'courier': courier,
+        'tracking_number': tracking_number,
+        'total': float(order.total_amount),
+        'raw_status': order.status,
+        'is_expired': False,
+    }
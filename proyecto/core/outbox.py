@@ -0,0 +1,163 @@
+import logging
+import random
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# OUTBOX DE CORREOS
+# ==========================================
+# El webhook de Flow no debe esperar a Gmail (TLS + login = segundos).
+# enqueue_email() solo inserta una fila; drain_outbox() los envía por lotes
+# reutilizando una única conexión SMTP (get_connection + send_messages).
+# Si un envío falla se reintenta con backoff exponencial y, al agotar
+# EMAIL_OUTBOX_MAX_ATTEMPTS, queda como FALLIDO para revisarlo en el admin.
+# Quien despacha es `manage.py send_outbox`: como worker (--loop) o desde un
+# cron (sin --loop vacía la cola lote a lote y termina).
+#
+# El SMTP no corre dentro de una transacción: el lote se reclama (ENVIANDO,
+# commit corto), se envía sin locks y el resultado se guarda en otra
+# transacción corta. Si el worker muere a mitad de camino, los correos
+# ENVIANDO vuelven a quedar disponibles al vencer SENDING_LEASE.
+
+DEFAULT_BATCH_SIZE = 50
+SENDING_LEASE = timedelta(minutes=10)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue_email(to, subject, body_text, body_html=''):
+    email = EmailOutbox.objects.create(to=to, subject=subject, body_text=body_text, body_html=body_html)
+    if _setting('EMAIL_OUTBOX_AUTODRAIN', False):
+        # Solo para desarrollo (en producción corre send_outbox): un hilo
+        # aparte después del commit, así el webhook no espera al SMTP.
+        transaction.on_commit(_drain_in_background)
+    return email
+
+
+def _drain_in_background():
+    def run():
+        from django.db import connection
+        try:
+            drain_outbox()
+        except Exception:
+            logger.exception("Error despachando la cola de correos")
+        finally:
+            connection.close()
+    threading.Thread(target=run, name='email-outbox', daemon=True).start()
+
+
+def backoff_delay(attempts):
+    # 1, 2, 4, 8... minutos (con tope) + jitter para no reintentar todos juntos
+    base = _setting('EMAIL_OUTBOX_BACKOFF_SECONDS', 60)
+    delay = min(base * (2 ** (attempts - 1)), 6 * 60 * 60)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def build_message(email, connection):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body_text,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[email.to],
+        connection=connection,
+    )
+    if email.body_html:
+        message.attach_alternative(email.body_html, 'text/html')
+    return message
+
+
+def claim_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Marca como ENVIANDO un lote de correos vencidos y lo devuelve. skip_locked
+    permite correr más de un worker sin que se pisen; next_attempt_at pasa a
+    ser el vencimiento del reclamo.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(
+                status__in=[EmailOutbox.StatusChoices.PENDING, EmailOutbox.StatusChoices.SENDING],
+                next_attempt_at__lte=now,
+            )
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        for email in batch:
+            email.status = EmailOutbox.StatusChoices.SENDING
+            email.next_attempt_at = now + SENDING_LEASE
+        EmailOutbox.objects.bulk_update(batch, ['status', 'next_attempt_at'])
+    return batch
+
+
+def drain_outbox(batch_size=DEFAULT_BATCH_SIZE, connection=None):
+    """
+    Envía un lote de correos vencidos. Devuelve {'sent': n, 'retry': n, 'dead': n}.
+    """
+    stats = {'sent': 0, 'retry': 0, 'dead': 0}
+    max_attempts = _setting('EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+
+    batch = claim_batch(batch_size)
+    if not batch:
+        return stats
+
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        with metrics.track('smtp', 'open'):
+            connection.open()
+    except Exception as e:
+        # No hay conexión: todo el lote vuelve a la cola con backoff
+        logger.warning("No se pudo abrir la conexión SMTP: %s", e)
+        open_error = e
+    else:
+        open_error = None
+
+    now = timezone.now()
+    try:
+        for email in batch:
+            error = open_error
+            if error is None:
+                try:
+                    with metrics.track('smtp', 'send'):
+                        connection.send_messages([build_message(email, connection)])
+                except Exception as e:
+                    error = e
+
+            email.attempts += 1
+            if error is None:
+                email.status = EmailOutbox.StatusChoices.SENT
+                email.sent_at = now
+                email.last_error = ''
+                stats['sent'] += 1
+            elif email.attempts >= max_attempts:
+                email.status = EmailOutbox.StatusChoices.DEAD
+                email.last_error = str(error)
+                stats['dead'] += 1
+                logger.error("Correo %s a %s descartado tras %s intentos: %s", email.id, email.to, email.attempts, error)
+            else:
+                email.status = EmailOutbox.StatusChoices.PENDING
+                email.next_attempt_at = now + backoff_delay(email.attempts)
+                email.last_error = str(error)
+                stats['retry'] += 1
+    finally:
+        if open_error is None:
+            connection.close()
+        # Lo que alcanzó a enviarse queda guardado aunque algo reviente a la mitad
+        done = [email for email in batch if email.status != EmailOutbox.StatusChoices.SENDING]
+        with transaction.atomic():
+            EmailOutbox.objects.bulk_update(done, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+    for result, count in stats.items():
+        if count:
+            metrics.inc('email_outbox_messages_total', count, result=result)
+    return stats
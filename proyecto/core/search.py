@@ -0,0 +1,122 @@
+import re
+import unicodedata
+
+from django.db.models import Count, Sum
+
+# ==========================================
+# BÚSQUEDA DE PRODUCTOS (ÍNDICE DE TRIGRAMAS)
+# ==========================================
+# Cada producto se descompone en trigramas de sus palabras normalizadas
+# (minúsculas y sin tildes), estilo pg_trgm: "plata" -> "  p", " pl", "pla",
+# "lat", "ata", "ta ". Buscar es contar cuántos trigramas de la consulta
+# tiene cada producto, ponderados por campo, usando solo el índice de
+# ProductSearchGram.gram: nunca se recorre la tabla de productos.
+# Como se comparan trigramas y no palabras completas, "colar" o "arós"
+# siguen encontrando "Collar" y "Aros".
+# De la categoría se indexa el nombre completo ("Aros -> Argollas"): buscar
+# "aros" también encuentra lo que está en sus subcategorías.
+
+FIELD_WEIGHTS = {
+    'name': 3,
+    'sku': 3,
+    'category': 2,
+    'description': 1,
+}
+MAX_DESCRIPTION_WORDS = 60
+MAX_QUERY_GRAMS = 64
+# Fracción mínima de trigramas de la consulta que debe tener un producto
+MIN_MATCH_RATIO = 0.3
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return WORD_RE.findall(text.lower())
+
+
+def word_grams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def text_grams(text, max_words=None):
+    words = normalize(text)
+    if max_words:
+        words = words[:max_words]
+    grams = set()
+    for word in words:
+        grams |= word_grams(word)
+    return grams
+
+
+def product_grams(name, sku, category_name, description):
+    # gram -> peso (suma de los campos donde aparece)
+    weights = {}
+    fields = (
+        (name, FIELD_WEIGHTS['name'], None),
+        (sku, FIELD_WEIGHTS['sku'], None),
+        (category_name, FIELD_WEIGHTS['category'], None),
+        (description, FIELD_WEIGHTS['description'], MAX_DESCRIPTION_WORDS),
+    )
+    for text, weight, max_words in fields:
+        for gram in text_grams(text, max_words):
+            weights[gram] = weights.get(gram, 0) + weight
+    return weights
+
+
+def index_products(products):
+    """Reindexa los productos dados (con su categoría ya cargada)."""
+    from .models import ProductSearchGram
+
+    products = list(products)
+    ProductSearchGram.objects.filter(product__in=products).delete()
+    rows = [
+        ProductSearchGram(product=product, gram=gram, weight=weight)
+        for product in products
+        for gram, weight in product_grams(
+            product.name, product.sku, product.category.full_name if product.category_id else '', product.description
+        ).items()
+    ]
+    ProductSearchGram.objects.bulk_create(rows, batch_size=2000)
+
+
+def reindex_category_tree(path, batch_size=500):
+    """
+    Reindexa los productos de una categoría y de todo su subárbol (cambió el
+    nombre completo de todas). Por bloques, cada uno en su propia transacción
+    corta, para no tener el índice bloqueado mientras se recorre el catálogo.
+    """
+    from django.db import transaction
+
+    from .models import Product
+
+    products = Product.objects.filter(category__path__startswith=path).select_related('category').order_by('id')
+    last_id = 0
+    while True:
+        batch = list(products.filter(id__gt=last_id)[:batch_size])
+        if batch:
+            last_id = batch[-1].id
+            with transaction.atomic():
+                index_products(batch)
+        if len(batch) < batch_size:
+            break
+
+
+def search_product_ids(query, limit=20):
+    """Devuelve [(product_id, score), ...] ordenado por relevancia."""
+    from .models import ProductSearchGram
+
+    grams = sorted(text_grams(query))[:MAX_QUERY_GRAMS]
+    if not grams:
+        return []
+    min_matches = max(1, int(len(grams) * MIN_MATCH_RATIO))
+    rows = (
+        ProductSearchGram.objects.filter(gram__in=grams, product__is_active=True)
+        .values('product_id')
+        .annotate(matches=Count('id'), score=Sum('weight'))
+        .filter(matches__gte=min_matches)
+        .order_by('-score', '-matches', 'product_id')[:limit]
+    )
+    return [(row['product_id'], row['score']) for row in rows]
@@ -1,33 +1,53 @@
 from rest_framework import serializers
+from .images import srcset
 from .models import Product, ProductImage, Category
 
+
+class SparseFieldsMixin:
+    """
+    Permite pedir solo algunos campos: ProductSerializer(..., fields=['id', 'name']).
+    Los viewsets lo toman de ?fields=id,name (ver core/viewsets.py).
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    # Variantes responsive (core/images.py); None mientras se generan
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'is_main']
+        fields = ['id', 'image', 'is_main', 'width', 'height', 'blurhash', 'srcset']
+
+    def get_srcset(self, obj):
+        return srcset(obj)
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug']
+        fields = ['id', 'name', 'slug', 'parent', 'full_name']
 
-class ProductSerializer(serializers.ModelSerializer):
-    # Incluimos las imágenes anidadas para que React las reciba juntas
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Incluimos las imágenes anidadas para que React las reciba juntas.
+    # Todo se lee de lo que ya trae el queryset (select_related de categoría y
+    # prefetch de imágenes, ver catalog_queryset): ninguna query por producto.
+    # La portada viene guardada en el mismo Product (ver sync_product_cover).
     images = ProductImageSerializer(many=True, read_only=True)
-    category = CategorySerializer(read_only=True)
-    
+    category = CategorySerializer(read_only=True, fields=['id', 'name', 'slug'])
+
     # Campo extra para obtener la URL de la foto principal directamente
     main_image = serializers.SerializerMethodField()
+    main_image_srcset = serializers.JSONField(read_only=True)
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'sku', 'price', 'discount_percent', 'final_price', 'description', 'category', 'images', 'main_image']
+        fields = ['id', 'name', 'sku', 'price', 'discount_percent', 'final_price', 'stock', 'is_featured', 'description', 'category', 'images', 'main_image', 'main_image_srcset']
 
     def get_main_image(self, obj):
-        # Busca la imagen marcada como 'is_main', si no, devuelve la primera, si no, None
-        main_img = obj.images.filter(is_main=True).first()
-        if not main_img:
-            main_img = obj.images.first()
-        if main_img:
-            return main_img.image.url
-        return None
\ No newline at end of file
+        # La marcada como 'is_main', si no la primera, si no None
+        return obj.main_image_url or None
@@ -0,0 +1,104 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Product, ProductImage, Category, Favorite, Order, Shipment, User
+from .catalog import invalidate_catalog, keep_single_main_image, sync_product_cover
+from .favorites import bump_favorites_version, forget_favorites_user
+from .images import delete_variant_files, schedule_processing
+from .orders import invalidate_tracking
+from .search import index_products, reindex_category_tree
+
+
+# Cualquier cambio en el catálogo invalida el snapshot de /api/products/.
+# Usamos on_commit para que nadie reconstruya el snapshot con datos viejos
+# mientras la transacción del admin todavía no termina.
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+def catalog_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_catalog)
+
+
+# Fotos nuevas o reemplazadas: variantes responsive fuera del request (core/images.py).
+# Además se recalcula la portada guardada en Product (ver sync_product_cover).
+@receiver(post_save, sender=ProductImage)
+def image_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    keep_single_main_image(instance)
+    sync_product_cover(instance.product_id)
+    if instance.processing_status == ProductImage.ProcessingChoices.PENDING:
+        schedule_processing(instance.pk)
+
+
+@receiver(post_delete, sender=ProductImage)
+def image_deleted(sender, instance, origin=None, **kwargs):
+    # Si se borra en cascada (producto, categoría) no hay portada que recalcular
+    if isinstance(origin, ProductImage) or getattr(origin, 'model', None) is ProductImage:
+        sync_product_cover(instance.product_id)
+    variants = instance.variants
+    if variants:
+        transaction.on_commit(lambda: delete_variant_files(variants))
+
+
+# Índice de búsqueda: se actualiza incrementalmente, solo para lo que cambió
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return  # loaddata: los fixtures no traen el índice armado
+    index_products([instance])
+
+
+# Renombrar o mover una categoría cambia el nombre completo de todo su
+# subárbol. Se reindexa después del commit y por bloques, no dentro del
+# guardado del admin; si no cambió el nombre ni la ubicación, no se toca.
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, '_tree_changed', False):
+        return
+    path = instance.path
+    transaction.on_commit(lambda: reindex_category_tree(path))
+
+
+# Versión de /api/favorites/ids/: cualquier alta/baja de favoritos del usuario.
+# Por user_id: un borrado en cascada con muchos favoritos no consulta usuarios.
+@receiver([post_save, post_delete], sender=Favorite)
+def favorites_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_favorites_version(user_id))
+
+
+# El email -> id cacheado (favorites_user_id) no puede apuntar a otro usuario:
+# se olvida si el email cambia, si una cuenta nueva lo reutiliza o si se borra.
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded_email', None)
+    if not created and loaded == instance.email:
+        return
+    emails = {email for email in (loaded, instance.email) if email}
+    instance._loaded_email = instance.email
+    transaction.on_commit(lambda: [forget_favorites_user(email) for email in emails])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    email = instance.email
+    transaction.on_commit(lambda: forget_favorites_user(email))
+
+
+# Seguimiento público cacheado (/api/track/): cambió la orden o su envío
+@receiver([post_save, post_delete], sender=Order)
+def order_changed(sender, instance, **kwargs):
+    order_id = instance.pk
+    transaction.on_commit(lambda: invalidate_tracking(order_id))
+
+
+@receiver([post_save, post_delete], sender=Shipment)
+def shipment_changed(sender, instance, **kwargs):
+    order_id = instance.order_id
+    transaction.on_commit(lambda: invalidate_tracking(order_id))
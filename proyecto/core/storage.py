@@ -0,0 +1,36 @@
+from cloudinary_storage.storage import MediaCloudinaryStorage
+from django.core.files.storage import FileSystemStorage
+
+from . import metrics
+
+# ==========================================
+# STORAGES CON MÉTRICAS
+# ==========================================
+# Los mismos backends de siempre, pero cada subida / descarga / borrado queda
+# en external_call_duration_seconds{dependency="cloudinary"} (ver
+# core/metrics.py): las subidas desde el admin y las variantes de
+# core/images.py son lo más lento de guardar un producto.
+
+
+class TimedStorageMixin:
+    metrics_dependency = 'storage'
+
+    def _save(self, name, content):
+        with metrics.track(self.metrics_dependency, 'upload'):
+            return super()._save(name, content)
+
+    def _open(self, name, mode='rb'):
+        with metrics.track(self.metrics_dependency, 'download'):
+            return super()._open(name, mode)
+
+    def delete(self, name):
+        with metrics.track(self.metrics_dependency, 'delete'):
+            return super().delete(name)
+
+
+class CloudinaryStorage(TimedStorageMixin, MediaCloudinaryStorage):
+    metrics_dependency = 'cloudinary'
+
+
+class LocalStorage(TimedStorageMixin, FileSystemStorage):
+    metrics_dependency = 'filesystem'
@@ -1,3 +1,1585 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import importlib
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ValidationError
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.db import connection
+from django.http import JsonResponse
+from django.test import AsyncRequestFactory, Client, RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .catalog import build_catalog, catalog_queryset, invalidate_catalog, iter_catalog_json
+from .models import Address, Category, ContactMessage, EmailOutbox, Favorite, Order, OrderItem, Product, ProductImage, Shipment, User, compute_final_price
+from .middleware import QueryInstrumentationMiddleware, sql_shape
+from .orders import SHIPPING_RATES, decrement_stock, mark_order_paid
+from .storage import LocalStorage
+from .outbox import drain_outbox, enqueue_email
+from . import async_views, favorites, flow, images, metrics
+from .management.commands import benchmark_endpoints
+
+# En los tests no usamos Cloudinary: las URLs se arman con el storage local
+LOCAL_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def create_products(category, count, images_per_product=3, start=0):
+    products = []
+    for i in range(start, start + count):
+        product = Product.objects.create(
+            category=category, sku=f"SKU-{i}", name=f"Producto {i}", price=1000 + i, stock=5
+        )
+        for j in range(images_per_product):
+            ProductImage.objects.create(product=product, image=f"products/p{i}_{j}.jpg", is_main=(j == 1))
+        products.append(product)
+    return products
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class ProductCatalogQueryTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Aros")
+        invalidate_catalog()
+
+    def test_query_count_is_constant(self):
+        create_products(self.category, 2)
+        with self.assertNumQueries(2):
+            build_catalog()
+
+        create_products(self.category, 40, start=2)
+        with self.assertNumQueries(2):
+            catalog = build_catalog()
+        self.assertEqual(len(catalog), 42)
+
+    def test_main_image_and_fallback(self):
+        with_main = create_products(self.category, 1)[0]
+        without_main = Product.objects.create(category=self.category, sku="SIN-PORTADA", name="Sin portada", price=500)
+        ProductImage.objects.create(product=without_main, image="products/a.jpg")
+        ProductImage.objects.create(product=without_main, image="products/b.jpg")
+        Product.objects.create(category=self.category, sku="INACTIVO", name="Inactivo", price=1, is_active=False)
+
+        data = {p['id']: p for p in self.client.get(reverse('get_products')).json()}
+        self.assertEqual(len(data), 2)
+        self.assertTrue(data[with_main.id]['main_image'].endswith("p0_1.jpg"))
+        self.assertEqual(len(data[with_main.id]['all_images']), 3)
+        self.assertTrue(data[without_main.id]['main_image'].endswith("a.jpg"))
+        self.assertEqual(data[without_main.id]['category__name'], "Aros")
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Collares")
+        create_products(self.category, 3)
+        invalidate_catalog()
+
+    def test_snapshot_is_reused_and_supports_304(self):
+        first = self.client.get(reverse('get_products'))
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.has_header('ETag'))
+
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('get_products'))
+        self.assertEqual(second.content, first.content)
+
+        not_modified = self.client.get(reverse('get_products'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+    def test_saving_catalog_rows_invalidates_snapshot(self):
+        first = self.client.get(reverse('get_products'))
+        product = Product.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = "Nombre nuevo"
+            product.save()
+
+        second = self.client.get(reverse('get_products'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertIn("Nombre nuevo", [p['name'] for p in second.json()])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.delete()
+        self.assertEqual(self.client.get(reverse('get_products')).json(), [])
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class CatalogFilterPaginationTests(TestCase):
+    def setUp(self):
+        self.aros = Category.objects.create(name="Aros")
+        self.argollas = Category.objects.create(name="Argollas", parent=self.aros)
+        self.collares = Category.objects.create(name="Collares")
+        for i, (category, price, stock, featured) in enumerate([
+            (self.aros, 5000, 3, True),
+            (self.argollas, 8000, 0, False),
+            (self.argollas, 12000, 1, True),
+            (self.collares, 3000, 9, False),
+            (self.collares, 8000, 2, False),
+        ]):
+            Product.objects.create(category=category, sku=f"F-{i}", name=f"Producto {i}",
+                                   price=price, stock=stock, is_featured=featured)
+
+    def get(self, **params):
+        response = self.client.get(reverse('get_products'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_filters(self):
+        names = lambda data: sorted(p['name'] for p in data['results'])
+        self.assertEqual(names(self.get(category='aros')), ["Producto 0", "Producto 1", "Producto 2"])
+        self.assertEqual(names(self.get(category='argollas')), ["Producto 1", "Producto 2"])
+        self.assertEqual(names(self.get(is_featured='1')), ["Producto 0", "Producto 2"])
+        self.assertEqual(names(self.get(min_price='5000', max_price='8000')), ["Producto 0", "Producto 1", "Producto 4"])
+        self.assertEqual(names(self.get(category='aros', in_stock='1')), ["Producto 0", "Producto 2"])
+        self.assertEqual(self.get(category='no-existe')['results'], [])
+
+    def test_keyset_pagination_walks_every_product_once(self):
+        for sort in ('newest', 'price_asc', 'price_desc', 'name'):
+            seen, cursor = [], None
+            while True:
+                params = {'sort': sort, 'limit': 2}
+                if cursor:
+                    params['cursor'] = cursor
+                page = self.get(**params)
+                seen += [p['id'] for p in page['results']]
+                cursor = page['next_cursor']
+                if not cursor:
+                    break
+            self.assertEqual(len(seen), 5, sort)
+            self.assertEqual(len(set(seen)), 5, sort)
+
+        prices = [p['price'] for p in self.get(sort='price_desc', limit=10)['results']]
+        self.assertEqual(prices, sorted(prices, reverse=True))
+
+    def test_invalid_params(self):
+        for params in ({'sort': 'azar'}, {'cursor': 'basura'}, {'min_price': 'abc'}, {'limit': 'x'}):
+            self.assertEqual(self.client.get(reverse('get_products'), params).status_code, 400)
+        cursor = self.get(sort='name', limit=1)['next_cursor']
+        self.assertEqual(self.client.get(reverse('get_products'), {'sort': 'newest', 'cursor': cursor}).status_code, 400)
+
+    def test_unrelated_params_keep_the_full_list(self):
+        # Links con tracking (?utm_source=...) no deben cambiar la forma de la respuesta
+        response = self.client.get(reverse('get_products'), {'utm_source': 'instagram', 'fbclid': 'x'})
+        self.assertIsInstance(response.json(), list)
+        self.assertEqual(len(response.json()), 5)
+        self.assertTrue(response.has_header('ETag'))
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class CatalogStreamingTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Anillos")
+        create_products(self.category, 7)
+        invalidate_catalog()
+
+    def test_stream_matches_buffered_catalog(self):
+        response = self.client.get(reverse('get_products'), {'stream': '1'})
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(streamed, build_catalog(catalog_queryset().order_by('id')))
+
+    def test_stream_chunks_and_filters(self):
+        chunks = list(iter_catalog_json(chunk_size=3))
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(len(json.loads(b''.join(chunks))), 7)
+
+        Product.objects.filter(sku="SKU-0").update(stock=0)
+        response = self.client.get(reverse('get_products'), {'stream': '1', 'in_stock': '1'})
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 6)
+
+        Product.objects.all().delete()
+        response = self.client.get(reverse('get_products'), {'stream': '1'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.aros = Category.objects.create(name="Aros")
+        self.collares = Category.objects.create(name="Collares")
+        self.argolla = Product.objects.create(category=self.aros, sku="AR-001", name="Argollas de plata",
+                                              description="Argollas pequeñas de plata 925", price=9990)
+        self.collar = Product.objects.create(category=self.collares, sku="CO-777", name="Collar corazón",
+                                             description="Cadena dorada con dije", price=14990)
+        self.perla = Product.objects.create(category=self.aros, sku="AR-002", name="Aros de perla",
+                                            description="Perlas naturales", price=12990)
+
+    def search(self, q):
+        response = self.client.get(reverse('search_products'), {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [p['id'] for p in response.json()['results']]
+
+    def test_accents_typos_and_fields(self):
+        self.assertEqual(self.search("corazon")[0], self.collar.id)
+        self.assertEqual(self.search("CORAZÓN")[0], self.collar.id)
+        self.assertEqual(self.search("argoyas plata")[0], self.argolla.id)
+        self.assertEqual(self.search("co-777")[0], self.collar.id)
+        self.assertEqual(set(self.search("aros")[:2]), {self.argolla.id, self.perla.id})
+        self.assertEqual(self.search("dorada"), [self.collar.id])
+        self.assertEqual(self.search(""), [])
+        self.assertEqual(self.search("zzzz"), [])
+
+    def test_index_updates_incrementally(self):
+        self.perla.name = "Aros de turquesa"
+        self.perla.save()
+        self.assertEqual(self.search("turquesa")[0], self.perla.id)
+
+        self.collares.name = "Gargantillas"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collares.save()
+        self.assertEqual(self.search("gargantilla"), [self.collar.id])
+
+        self.perla.is_active = False
+        self.perla.save()
+        self.assertNotIn(self.perla.id, self.search("turquesa"))
+
+    def test_category_rename_reindexes_the_subtree_after_commit(self):
+        argollas = Category.objects.create(name="Argollas", parent=self.aros)
+        mini = Product.objects.create(category=argollas, sku="AR-100", name="Mini", price=4990)
+        self.assertIn(mini.id, self.search("aros"))  # Nombre completo "Aros -> Argollas"
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.aros.save()  # Sin cambios de nombre ni ubicación: no reindexa
+        self.assertEqual(callbacks, [invalidate_catalog])
+
+        self.aros.name = "Pendientes"
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.aros.save()
+        self.assertNotIn(mini.id, self.search("pendientes"))  # Todavía no: después del commit
+        for callback in callbacks:
+            callback()
+        self.assertIn(mini.id, self.search("pendientes"))
+
+    def test_query_count_does_not_depend_on_catalog_size(self):
+        create_products(self.aros, 30)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('search_products'), {'q': "producto"})
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        self.aros = Category.objects.create(name="Aros")
+        self.argollas = Category.objects.create(name="Argollas", parent=self.aros)
+        self.mini = Category.objects.create(name="Mini", parent=self.argollas)
+        self.collares = Category.objects.create(name="Collares")
+
+    def test_paths_and_str_without_queries(self):
+        mini = Category.objects.get(pk=self.mini.pk)
+        self.assertEqual(mini.path, f"/{self.aros.pk}/{self.argollas.pk}/{self.mini.pk}/")
+        self.assertEqual(mini.depth, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(mini), "Aros -> Argollas -> Mini")
+
+    def test_ancestors_and_subtree_are_single_queries(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.mini.get_ancestors()), [self.aros, self.argollas])
+        with self.assertNumQueries(1):
+            self.assertEqual(set(self.aros.get_descendants()), {self.aros, self.argollas, self.mini})
+
+        p1 = Product.objects.create(category=self.mini, sku="M1", name="Mini 1", price=1)
+        p2 = Product.objects.create(category=self.aros, sku="A1", name="Aro 1", price=1)
+        Product.objects.create(category=self.collares, sku="C1", name="Collar 1", price=1)
+        with self.assertNumQueries(1):
+            self.assertEqual(set(self.aros.get_subtree_products()), {p1, p2})
+
+    def test_move_and_rename_update_the_subtree(self):
+        self.argollas.parent = self.collares
+        self.argollas.save()
+        mini = Category.objects.get(pk=self.mini.pk)
+        self.assertEqual(mini.path, f"/{self.collares.pk}/{self.argollas.pk}/{self.mini.pk}/")
+        self.assertEqual(str(mini), "Collares -> Argollas -> Mini")
+
+        self.collares.name = "Cadenas"
+        self.collares.save()
+        self.assertEqual(str(Category.objects.get(pk=self.mini.pk)), "Cadenas -> Argollas -> Mini")
+
+        self.argollas.parent = None
+        self.argollas.save()
+        mini = Category.objects.get(pk=self.mini.pk)
+        self.assertEqual((mini.depth, str(mini)), (1, "Argollas -> Mini"))
+
+    def test_cannot_move_into_own_subtree(self):
+        aros = Category.objects.get(pk=self.aros.pk)
+        aros.parent = self.mini
+        with self.assertRaises(ValidationError):
+            aros.full_clean()
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class FinalPriceTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Pulseras")
+
+    def test_final_price_is_stored_exactly(self):
+        product = Product.objects.create(category=self.category, sku="P1", name="Pulsera", price=Decimal("9990"), discount_percent=15)
+        self.assertEqual(Product.objects.get(pk=product.pk).final_price, Decimal("8491.50"))
+        self.assertEqual(compute_final_price(Decimal("19.99"), 33), Decimal("13.39"))
+        self.assertEqual(compute_final_price(Decimal("500"), 0), Decimal("500.00"))
+
+        product.discount_percent = 0
+        product.save(update_fields=['discount_percent'])
+        self.assertEqual(Product.objects.get(pk=product.pk).final_price, Decimal("9990.00"))
+
+    def test_bulk_updates_keep_final_price_in_sync(self):
+        cheap = Product.objects.create(category=self.category, sku="P3", name="Pulsera 3", price=Decimal("1000"))
+        other = Product.objects.create(category=self.category, sku="P4", name="Pulsera 4", price=Decimal("3000"))
+
+        # El filtro deja de calzar después del UPDATE: igual se recalculan esas filas
+        Product.objects.filter(price__lt=2000).update(price=Decimal("5000"), discount_percent=10)
+        cheap.price, other.discount_percent = Decimal("19.99"), 33
+        Product.objects.bulk_update([cheap, other], ['price', 'discount_percent'])
+        self.assertEqual(
+            dict(Product.objects.values_list('sku', 'final_price')),
+            {"P3": Decimal("19.99"), "P4": Decimal("2010.00")},
+        )
+
+    def test_refresh_final_prices_fixes_rows_written_outside_the_orm(self):
+        product = Product.objects.create(category=self.category, sku="P5", name="Pulsera 5", price=Decimal("1000"))
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE core_product SET discount_percent = 25 WHERE id = %s", [product.pk])
+        out = io.StringIO()
+        call_command('refresh_final_prices', batch_size=1, stdout=out)
+        self.assertIn("1 productos", out.getvalue())
+        self.assertEqual(Product.objects.get(pk=product.pk).final_price, Decimal("750.00"))
+        self.assertEqual(Product.objects.all().refresh_final_prices(), 0)
+
+    def test_order_item_uses_same_computation(self):
+        product = Product.objects.create(category=self.category, sku="P2", name="Pulsera 2", price=Decimal("12345"), discount_percent=10)
+        user = User.objects.create_user(username="c@x.cl", email="c@x.cl")
+        order = Order.objects.create(user=user)
+        item = OrderItem.objects.create(order=order, product=product, quantity=2)
+        self.assertEqual(item.unit_price, Decimal("11110.50"))
+
+    def test_sort_and_filter_use_final_price(self):
+        Product.objects.create(category=self.category, sku="A", name="Cara con descuento", price=10000, discount_percent=50)
+        Product.objects.create(category=self.category, sku="B", name="Normal", price=7000)
+        Product.objects.create(category=self.category, sku="C", name="Barata", price=3000)
+
+        data = self.client.get(reverse('get_products'), {'sort': 'price_asc'}).json()['results']
+        self.assertEqual([p['name'] for p in data], ["Barata", "Cara con descuento", "Normal"])
+        data = self.client.get(reverse('get_products'), {'on_sale': '1'}).json()['results']
+        self.assertEqual([p['final_price'] for p in data], [5000.0])
+        data = self.client.get(reverse('get_products'), {'max_price': '6000'}).json()['results']
+        self.assertEqual(sorted(p['name'] for p in data), ["Barata", "Cara con descuento"])
+
+
+FLOW_SETTINGS = {"FLOW_API_KEY": "test-key", "FLOW_SECRET_KEY": "test-secret", "FLOW_API_URL": "https://flow.test/api"}
+
+
+def patch_flow(**kwargs):
+    # Todas las llamadas a Flow pasan por la sesión HTTP de core.flow.FlowClient
+    return mock.patch('requests.Session.request', **kwargs)
+
+
+def flow_response(status_code=200, payload=None, text=''):
+    response = mock.Mock(status_code=status_code, text=text)
+    response.json.return_value = payload or {}
+    return response
+
+
+@override_settings(**FLOW_SETTINGS)
+@override_settings(CACHES=LOCAL_CACHES)
+class CreatePaymentTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Aros")
+        self.products = [
+            Product.objects.create(category=self.category, sku=f"C-{i}", name=f"Aro {i}", price=1000 + i, discount_percent=10 if i % 2 else 0)
+            for i in range(30)
+        ]
+
+    def post(self, cart, region="Región Metropolitana"):
+        payload = {
+            'amount': 1,  # El servidor ignora este monto
+            'email': 'compradora@correo.cl',
+            'shipping': {'nombre': 'Ana', 'apellido': 'Pérez', 'direccion': 'Calle 1', 'ciudad': 'Rancagua', 'region': region},
+            'cart': cart,
+        }
+        return self.client.post(reverse('create_payment'), json.dumps(payload), content_type='application/json')
+
+    def count_queries(self, cart):
+        ok = flow_response(payload={'url': 'https://flow/pay', 'token': 'tok'})
+        with patch_flow(return_value=ok):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.post(cart)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_constant_queries_and_server_side_total(self):
+        User.objects.create_user(username='compradora@correo.cl', email='compradora@correo.cl')
+        small = self.count_queries([{'id': p.id, 'quantity': 1} for p in self.products[:3]])
+        large = self.count_queries([{'id': p.id, 'quantity': 2} for p in self.products])
+        self.assertEqual(small, large)
+
+        order = Order.objects.latest('id')
+        self.assertEqual(order.items.count(), 30)
+        expected = sum(compute_final_price(p.price, p.discount_percent) * 2 for p in self.products) + 4300
+        self.assertEqual(order.total_amount, expected.quantize(Decimal('1')))
+
+    def test_flow_amount_and_duplicate_lines(self):
+        ok = flow_response(payload={'url': 'https://flow/pay', 'token': 'tok'})
+        p = self.products[1]  # 1001 con 10% de descuento = 900.90
+        with patch_flow(return_value=ok) as post:
+            response = self.post([{'id': p.id, 'quantity': 1}, {'id': p.id, 'quantity': 1}, {'id': 999999, 'quantity': 5}],
+                                 region="Región del Libertador Gral. Bernardo O'Higgins")
+        self.assertEqual(response.json()['url'], 'https://flow/pay?token=tok')
+        self.assertIn('amount=4902', post.call_args.kwargs['data'])
+        item = OrderItem.objects.get()
+        self.assertEqual((item.quantity, item.unit_price), (2, Decimal('900.90')))
+
+    def test_failed_flow_call_discards_the_order(self):
+        with patch_flow(return_value=flow_response(400, text='boom')):
+            response = self.post([{'id': p.id, 'quantity': 1} for p in self.products[:5]])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['details'], 'boom')
+        with patch_flow(side_effect=requests.ConnectionError("caído")):
+            self.assertEqual(self.post([{'id': self.products[0].id, 'quantity': 1}]).status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertFalse(Address.objects.exists())
+
+    def test_flow_is_called_after_the_order_commits(self):
+        test_blocks = len(connection.atomic_blocks)  # Los de TestCase
+
+        def flow_call(*args, **kwargs):
+            # Ningún atomic() propio abierto (ni sus locks) mientras esperamos a Flow
+            self.assertEqual(len(connection.atomic_blocks), test_blocks)
+            self.assertTrue(Order.objects.exists())
+            return flow_response(payload={'url': 'https://flow/pay', 'token': 'tok'})
+
+        with patch_flow(side_effect=flow_call):
+            response = self.post([{'id': self.products[0].id, 'quantity': 1}])
+        self.assertEqual(response.json()['total'], 1000 + 4300)
+
+    def test_shipping_rates_come_from_the_server_table(self):
+        rates = self.client.get(reverse('get_shipping_rates')).json()['rates']
+        self.assertEqual({r['region']: r['price'] for r in rates}, SHIPPING_RATES)
+        self.assertEqual(rates[0]['region'], "Región de Arica y Parinacota")  # De norte a sur
+        self.assertEqual(self.client.post(reverse('get_shipping_rates')).status_code, 405)
+
+    def test_invalid_cart(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post([{'id': self.products[0].id, 'quantity': 0}]).status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+def paid_status(order):
+    return flow_response(payload={'status': 2, 'commerceOrder': f"POLI-{order.id}"})
+
+
+def confirm(client, order):
+    with patch_flow(return_value=paid_status(order)):
+        return client.post(reverse('payment_confirm'), {'token': f"tok-{order.id}"})
+
+
+def create_order(user, lines):
+    order = Order.objects.create(user=user, total_amount=sum(p.price * q for p, q in lines))
+    for product, quantity in lines:
+        OrderItem.objects.create(order=order, product=product, quantity=quantity)
+    return order
+
+
+@override_settings(**FLOW_SETTINGS)
+@override_settings(CACHES=LOCAL_CACHES, EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_AUTODRAIN=False)
+class PaymentConfirmStockTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Aros")
+        self.aro = Product.objects.create(category=category, sku="S1", name="Aro", price=1000, stock=5)
+        self.collar = Product.objects.create(category=category, sku="S2", name="Collar", price=2000, stock=1)
+        self.user = User.objects.create_user(username="s@x.cl", email="s@x.cl")
+
+    def test_stock_is_decremented_once_and_clamped(self):
+        order = create_order(self.user, [(self.aro, 2), (self.collar, 3)])
+        with self.captureOnCommitCallbacks(execute=True):
+            confirm(self.client, order)
+        confirm(self.client, order)  # Reintento de Flow: no debe descontar de nuevo
+
+        self.aro.refresh_from_db()
+        self.collar.refresh_from_db()
+        self.assertEqual((self.aro.stock, self.collar.stock), (3, 0))
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.StatusChoices.PAID)
+
+    def test_late_confirmation_does_not_reopen_shipped_order(self):
+        order = create_order(self.user, [(self.aro, 2)])
+        confirm(self.client, order)
+        Order.objects.filter(pk=order.pk).update(status=Order.StatusChoices.SHIPPED)
+        confirm(self.client, order)  # Webhook repetido después del despacho
+
+        order.refresh_from_db()
+        self.aro.refresh_from_db()
+        self.assertEqual((order.status, self.aro.stock), (Order.StatusChoices.SHIPPED, 3))
+
+    def test_only_the_first_confirmation_wins(self):
+        # Lo mismo que resuelve la carrera: el segundo UPDATE condicional no encuentra la fila
+        order = create_order(self.user, [(self.aro, 1)])
+        self.assertIsNotNone(mark_order_paid(order.id))
+        self.assertIsNone(mark_order_paid(order.id))
+        self.aro.refresh_from_db()
+        self.assertEqual(self.aro.stock, 4)
+
+    def test_duplicate_webhook_mid_confirmation_does_not_decrement_again(self):
+        # La carrera de PaymentConfirmConcurrencyTests, intercalada a mano para
+        # que corra en cualquier BD: el duplicado llega cuando el primero ya
+        # cambió el estado pero todavía no descuenta el stock.
+        order = create_order(self.user, [(self.aro, 2), (self.collar, 1)])
+        duplicates = []
+
+        def interleaved(quantities):
+            if not duplicates:
+                duplicates.append(mark_order_paid(order.id))
+            return decrement_stock(quantities)
+
+        with mock.patch('core.orders.decrement_stock', side_effect=interleaved) as decrement:
+            self.assertIsNotNone(mark_order_paid(order.id))
+            self.assertIsNone(mark_order_paid(order.id))  # Reintento posterior de Flow
+        self.assertEqual(duplicates, [None])
+        self.assertEqual(decrement.call_count, 1)
+
+        self.aro.refresh_from_db()
+        self.collar.refresh_from_db()
+        self.assertEqual((self.aro.stock, self.collar.stock), (3, 0))
+
+    def test_query_count_does_not_depend_on_items(self):
+        order = create_order(self.user, [(self.aro, 1)])
+        big = create_order(self.user, [(self.aro, 1), (self.collar, 1)] * 5)
+        with CaptureQueriesContext(connection) as small_ctx:
+            confirm(self.client, order)
+        with CaptureQueriesContext(connection) as big_ctx:
+            confirm(self.client, big)
+        self.assertEqual(len(small_ctx.captured_queries), len(big_ctx.captured_queries))
+
+
+# Necesita una BD con locks por fila (Postgres en Render, MySQL en local):
+# SQLite bloquea la tabla completa y rechaza las escrituras en paralelo.
+@skipUnlessDBFeature('has_select_for_update')
+@override_settings(**FLOW_SETTINGS)
+@override_settings(CACHES=LOCAL_CACHES, EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_AUTODRAIN=False)
+class PaymentConfirmConcurrencyTests(TransactionTestCase):
+    def test_parallel_confirmations_do_not_lose_updates(self):
+        cache.clear()
+        category = Category.objects.create(name="Aros")
+        product = Product.objects.create(category=category, sku="HOT", name="Aro popular", price=1000, stock=100)
+        user = User.objects.create_user(username="p@x.cl", email="p@x.cl")
+        orders = [create_order(user, [(product, 3)]) for _ in range(8)]
+        # Cada orden se confirma dos veces (webhook duplicado de Flow)
+        jobs = orders * 2
+        barrier = threading.Barrier(len(jobs))
+        statuses = {o.id: paid_status(o) for o in orders}
+        errors = []
+
+        def fake_request(method, url, params=None, **kwargs):
+            return statuses[int(params['token'].split('-')[1])]
+
+        def worker(order):
+            try:
+                barrier.wait()
+                Client().post(reverse('payment_confirm'), {'token': f"tok-{order.id}"})
+            except Exception as e:  # pragma: no cover - se reporta abajo
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with patch_flow(side_effect=fake_request):
+            threads = [threading.Thread(target=worker, args=(order,)) for order in jobs]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(errors, [])
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 100 - 8 * 3)
+        self.assertEqual(Order.objects.filter(status=Order.StatusChoices.PAID).count(), 8)
+
+
+@override_settings(**FLOW_SETTINGS)
+@override_settings(CACHES=LOCAL_CACHES, EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_AUTODRAIN=False)
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_webhook_only_enqueues(self):
+        category = Category.objects.create(name="Aros")
+        product = Product.objects.create(category=category, sku="E1", name="Aro", price=1000, stock=5)
+        user = User.objects.create_user(username="e@x.cl", email="e@x.cl", first_name="Eva")
+        order = create_order(user, [(product, 1)])
+
+        confirm(self.client, order)
+        self.assertEqual(len(mail.outbox), 0)
+        queued = EmailOutbox.objects.get()
+        self.assertEqual(queued.to, "e@x.cl")
+        self.assertIn(f"POLI-{order.id}", queued.subject)
+
+        self.assertEqual(drain_outbox(), {'sent': 1, 'retry': 0, 'dead': 0})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.assertEqual(EmailOutbox.objects.get().status, EmailOutbox.StatusChoices.SENT)
+        self.assertEqual(drain_outbox(), {'sent': 0, 'retry': 0, 'dead': 0})
+
+    def test_email_is_enqueued_in_the_payment_transaction(self):
+        category = Category.objects.create(name="Aros")
+        product = Product.objects.create(category=category, sku="E2", name="Aro", price=1000, stock=5)
+        user = User.objects.create_user(username="f@x.cl", email="f@x.cl")
+        order = create_order(user, [(product, 1)])
+        test_blocks = len(connection.atomic_blocks)
+        seen = []
+
+        def failing_enqueue(**kwargs):
+            # Dentro del mismo atomic() que pasó la orden a PAGADO
+            seen.append((len(connection.atomic_blocks) > test_blocks, Order.objects.get(pk=order.pk).status))
+            raise RuntimeError("BD caída")
+
+        with mock.patch('core.views.enqueue_email', side_effect=failing_enqueue), self.assertLogs('core.views', 'ERROR'):
+            response = confirm(self.client, order)
+        self.assertEqual(response.status_code, 500)  # Flow reintenta
+        self.assertEqual(seen, [(True, Order.StatusChoices.PAID)])
+
+        # Se deshizo todo: el reintento paga la orden y encola su correo
+        order.refresh_from_db()
+        product.refresh_from_db()
+        self.assertEqual((order.status, product.stock), (Order.StatusChoices.PENDING, 5))
+        self.assertEqual(confirm(self.client, order).status_code, 200)
+        self.assertEqual(EmailOutbox.objects.get().to, "f@x.cl")
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 4)
+
+    def test_send_outbox_command_empties_the_queue_and_exits(self):
+        # Lo que correría un cron: sin --loop, lote a lote hasta vaciar la cola
+        for i in range(3):
+            enqueue_email(f"c{i}@x.cl", f"Asunto {i}", "Hola")
+        call_command('send_outbox', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(EmailOutbox.objects.exclude(status=EmailOutbox.StatusChoices.SENT).exists())
+
+    def test_batch_uses_one_connection_with_retry_and_dead_letter(self):
+        for i in range(3):
+            enqueue_email(f"c{i}@x.cl", f"Asunto {i}", "Hola")
+
+        def send_messages(messages):
+            if messages[0].to == ["c1@x.cl"]:
+                raise OSError("550 buzón lleno")
+            return 1
+
+        connection = mock.Mock()
+        connection.send_messages.side_effect = send_messages
+
+        self.assertEqual(drain_outbox(connection=connection), {'sent': 2, 'retry': 1, 'dead': 0})
+        self.assertEqual(connection.open.call_count, 1)
+        self.assertEqual(connection.send_messages.call_count, 3)
+
+        failed = EmailOutbox.objects.get(to="c1@x.cl")
+        self.assertEqual((failed.status, failed.attempts), (EmailOutbox.StatusChoices.PENDING, 1))
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        self.assertIn("buzón lleno", failed.last_error)
+
+        # Agota los reintentos: queda como fallido
+        with override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2):
+            EmailOutbox.objects.filter(pk=failed.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(drain_outbox(connection=connection), {'sent': 0, 'retry': 0, 'dead': 1})
+        self.assertEqual(EmailOutbox.objects.get(pk=failed.pk).status, EmailOutbox.StatusChoices.DEAD)
+
+    def test_smtp_runs_outside_the_claim_transaction(self):
+        enqueue_email("a@x.cl", "Asunto", "Hola")
+        test_blocks = len(connection.atomic_blocks)  # Los de TestCase
+        seen = []
+
+        def send_messages(messages):
+            seen.append((len(connection.atomic_blocks), EmailOutbox.objects.get().status))
+            return 1
+
+        smtp = mock.Mock()
+        smtp.send_messages.side_effect = send_messages
+        self.assertEqual(drain_outbox(connection=smtp), {'sent': 1, 'retry': 0, 'dead': 0})
+        self.assertEqual(seen, [(test_blocks, EmailOutbox.StatusChoices.SENDING)])
+
+    def test_expired_claims_are_picked_up_again(self):
+        # Un worker que murió con el lote reclamado
+        email = enqueue_email("a@x.cl", "Asunto", "Hola")
+        EmailOutbox.objects.filter(pk=email.pk).update(
+            status=EmailOutbox.StatusChoices.SENDING, next_attempt_at=timezone.now() + timedelta(minutes=5)
+        )
+        smtp = mock.Mock()
+        self.assertEqual(drain_outbox(connection=smtp), {'sent': 0, 'retry': 0, 'dead': 0})
+        EmailOutbox.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(drain_outbox(connection=smtp), {'sent': 1, 'retry': 0, 'dead': 0})
+
+    def test_smtp_down_requeues_whole_batch(self):
+        enqueue_email("a@x.cl", "Asunto", "Hola")
+        connection = mock.Mock()
+        connection.open.side_effect = OSError("timeout")
+        self.assertEqual(drain_outbox(connection=connection), {'sent': 0, 'retry': 1, 'dead': 0})
+        connection.send_messages.assert_not_called()
+
+
+@override_settings(**FLOW_SETTINGS)
+@mock.patch('core.flow.time.sleep')
+class FlowClientTests(TestCase):
+    def test_signature_and_shared_session(self, sleep):
+        client = flow.get_client()
+        self.assertIs(client, flow.get_client())
+        params = client.signed({"token": "abc"})
+        expected = hmac.new(b"test-secret", b"apiKeytest-keytokenabc", hashlib.sha256).hexdigest()
+        self.assertEqual(params["s"], expected)
+
+        with patch_flow(return_value=flow_response(payload={'status': 1})) as request:
+            client.get_status("abc")
+        method, url = request.call_args.args
+        self.assertEqual((method, url), ('GET', "https://flow.test/api/payment/getStatus"))
+        self.assertEqual(request.call_args.kwargs['timeout'], (settings.FLOW_CONNECT_TIMEOUT, settings.FLOW_READ_TIMEOUT))
+
+    def test_idempotent_calls_are_retried(self, sleep):
+        responses = [requests.ConnectionError("reset"), flow_response(503), flow_response(200)]
+        with patch_flow(side_effect=responses) as request:
+            self.assertEqual(flow.get_client().get_status("abc").status_code, 200)
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+        with patch_flow(side_effect=requests.ReadTimeout("lento")) as request:
+            with self.assertRaises(flow.FlowError):
+                flow.get_client().get_status("abc")
+        self.assertEqual(request.call_count, settings.FLOW_MAX_RETRIES + 1)
+
+    def test_create_is_only_retried_when_it_never_connected(self, sleep):
+        with patch_flow(side_effect=requests.ReadTimeout("lento")) as request:
+            with self.assertRaises(flow.FlowError):
+                flow.get_client().create_payment("POLI-1", "Pedido", 1000, "a@x.cl")
+        self.assertEqual(request.call_count, 1)
+
+        ok = flow_response(payload={'url': 'u', 'token': 't'})
+        with patch_flow(side_effect=[requests.ConnectTimeout("sin conexión"), ok]) as request:
+            response = flow.get_client().create_payment("POLI-1", "Pedido", 1000, "a@x.cl")
+        self.assertIs(response, ok)
+        self.assertIn("urlConfirmation=", request.call_args.kwargs['data'])
+
+        with patch_flow(return_value=flow_response(503)) as request:
+            self.assertEqual(flow.get_client().create_payment("POLI-1", "Pedido", 1000, "a@x.cl").status_code, 503)
+        self.assertEqual(request.call_count, 1)
+
+
+@override_settings(CACHES=LOCAL_CACHES, EMAIL_OUTBOX_AUTODRAIN=False, **FLOW_SETTINGS)
+class PaymentStatusCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Aros")
+        product = Product.objects.create(category=category, sku="K1", name="Aro", price=1000, stock=5)
+        user = User.objects.create_user(username="k@x.cl", email="k@x.cl")
+        self.order = create_order(user, [(product, 1)])
+
+    def redirect(self):
+        return self.client.post(reverse('payment_final_redirect'), {'token': 'tok-cache'})
+
+    def test_redirect_after_confirm_does_not_call_flow(self):
+        with patch_flow(return_value=paid_status(self.order)) as request:
+            self.client.post(reverse('payment_confirm'), {'token': 'tok-cache'})
+            self.client.post(reverse('payment_confirm'), {'token': 'tok-cache'})  # reintento de Flow
+            response = self.redirect()
+        self.assertEqual(request.call_count, 1)
+        self.assertIn(f"order=POLI-{self.order.id}", response['Location'])
+
+    def test_pending_status_is_short_lived_and_ignored_by_confirm(self):
+        pending = flow_response(payload={'status': flow.STATUS_PENDING, 'commerceOrder': f"POLI-{self.order.id}"})
+        with patch_flow(return_value=pending) as request:
+            self.redirect()
+            self.redirect()
+        self.assertEqual(request.call_count, 1)
+
+        # Ya pagado: el webhook debe ir a Flow aunque haya un "pendiente" en cache
+        with patch_flow(return_value=paid_status(self.order)) as request:
+            self.client.post(reverse('payment_confirm'), {'token': 'tok-cache'})
+        self.assertEqual(request.call_count, 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.StatusChoices.PAID)
+
+    def test_errors_are_not_cached(self):
+        with patch_flow(return_value=flow_response(401, text='firma inválida')) as request:
+            self.assertIsNone(flow.get_payment_status('tok-x'))
+            self.assertIsNone(flow.get_payment_status('tok-x'))
+        self.assertEqual(request.call_count, 2)
+
+
+def patch_async_flow(**kwargs):
+    # Las vistas async llaman a Flow con el httpx.AsyncClient de core.flow.AsyncFlowClient
+    return mock.patch('httpx.AsyncClient.request', new_callable=mock.AsyncMock, **kwargs)
+
+
+@override_settings(CACHES=LOCAL_CACHES, EMAIL_OUTBOX_AUTODRAIN=False, **FLOW_SETTINGS)
+class AsyncPaymentViewsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = AsyncRequestFactory()
+        category = Category.objects.create(name="Aros")
+        self.product = Product.objects.create(category=category, sku="A1", name="Aro", price=1000, stock=5)
+
+    async def test_confirm_then_redirect_hits_flow_once(self):
+        user = await User.objects.acreate(username="a@x.cl", email="a@x.cl")
+        order = await sync_to_async(create_order)(user, [(self.product, 2)])
+        paid = httpx.Response(200, json={'status': flow.STATUS_PAID, 'commerceOrder': f"POLI-{order.id}"})
+        with patch_async_flow(return_value=paid) as request:
+            for _ in range(2):  # Flow reintenta el webhook
+                response = await async_views.payment_confirm(self.factory.post('/', {'token': 'tok-a'}))
+                self.assertEqual(response.status_code, 200)
+            response = await async_views.payment_final_redirect(self.factory.post('/', {'token': 'tok-a'}))
+        self.assertEqual(request.call_count, 1)
+        self.assertIn(f"order=POLI-{order.id}", response['Location'])
+        await order.arefresh_from_db()
+        await self.product.arefresh_from_db()
+        self.assertEqual((order.status, self.product.stock), (Order.StatusChoices.PAID, 3))
+
+    async def test_create_payment_discards_order_when_flow_fails(self):
+        payload = json.dumps({
+            'email': 'b@x.cl',
+            'shipping': {'region': 'Región Metropolitana'},
+            'cart': [{'id': self.product.id, 'quantity': 1}],
+        })
+
+        def post():
+            return async_views.create_payment(self.factory.post('/', payload, content_type='application/json'))
+
+        with patch_async_flow(return_value=httpx.Response(400, text='boom')):
+            response = await post()
+        self.assertEqual((response.status_code, json.loads(response.content)['details']), (400, 'boom'))
+        with patch_async_flow(side_effect=httpx.ReadTimeout("lento")) as request:
+            self.assertEqual((await post()).status_code, 400)
+        self.assertEqual(request.call_count, 1)  # payment/create no se repite
+        self.assertFalse(await Order.objects.aexists())
+        self.assertFalse(await OrderItem.objects.aexists())
+
+        ok = httpx.Response(200, json={'url': 'https://flow/pay', 'token': 'tok'})
+        with patch_async_flow(return_value=ok) as request:
+            response = await post()
+        self.assertEqual(json.loads(response.content)['url'], 'https://flow/pay?token=tok')
+        self.assertIn('amount=5300', request.call_args.kwargs['content'])
+        self.assertEqual(await Order.objects.acount(), 1)
+
+    @mock.patch('core.flow.asyncio.sleep', new_callable=mock.AsyncMock)
+    async def test_async_client_retries_idempotent_calls(self, sleep):
+        responses = [httpx.ConnectError("reset"), httpx.Response(503), httpx.Response(200, json={'status': 1})]
+        with patch_async_flow(side_effect=responses) as request:
+            response = await flow.get_async_client().get_status("abc")
+        self.assertEqual((response.status_code, request.call_count, sleep.call_count), (200, 3, 2))
+        self.assertIs(flow.get_async_client(), flow.get_async_client())
+
+
+def full_table_scans(queryset):
+    # Líneas del plan que recorren una tabla completa, sin índice
+    plan = queryset.explain()
+    if connection.vendor == 'sqlite':
+        return [line for line in plan.splitlines() if re.search(r'\bSCAN \w+$', line)]
+    return [line for line in plan.splitlines() if 'Seq Scan' in line]
+
+
+class QueryPlanTests(TestCase):
+    """Las consultas calientes deben resolverse con índice (migración 0008)."""
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest("Solo se revisan planes de SQLite y PostgreSQL")
+        if connection.vendor == 'postgresql':
+            # Con tablas casi vacías Postgres prefiere Seq Scan aunque exista el índice
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        category = Category.objects.create(name="Aros")
+        self.product = Product.objects.create(category=category, sku="Q1", name="Aro", price=1000)
+
+    def test_hot_queries_use_indexes(self):
+        hot_queries = {
+            'historial de órdenes': Order.objects.filter(user__email='a@x.cl').order_by('-created_at'),
+            'órdenes vencidas': Order.objects.filter(status=Order.StatusChoices.PENDING, created_at__lt=timezone.now()),
+            'admin por estado': Order.objects.filter(status=Order.StatusChoices.PAID).order_by('-created_at'),
+            'catálogo newest': catalog_queryset().order_by('-created_at', '-id')[:25],
+            'catálogo destacados': catalog_queryset().filter(is_featured=True),
+            'portada': ProductImage.objects.filter(product=self.product, is_main=True),
+            'mensajes no leídos': ContactMessage.objects.filter(is_read=False),
+        }
+        for name, queryset in hot_queries.items():
+            with self.subTest(name):
+                self.assertEqual(full_table_scans(queryset), [])
+        # Control: el detector sí reconoce un recorrido completo
+        self.assertTrue(full_table_scans(ContactMessage.objects.filter(subject="Hola")))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Aros")
+        self.product = Product.objects.create(category=category, sku="H1", name="Aro", price=1000)
+        self.user = User.objects.create_user(username="h@x.cl", email="h@x.cl")
+        now = timezone.now()
+        self.orders = []
+        for i in range(25):
+            order = create_order(self.user, [(self.product, i % 3 + 1)])
+            # Varias órdenes con la misma fecha: el cursor desempata por id
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(hours=i // 2))
+            self.orders.append(order)
+        Order.objects.filter(pk=self.orders[0].pk).update(status=Order.StatusChoices.PAID)
+
+    def get(self, **params):
+        return self.client.get(reverse('get_user_orders'), {'email': 'h@x.cl', **params})
+
+    def test_keyset_pages_with_item_counts(self):
+        seen, cursor, pages = [], None, 0
+        while True:
+            params = {'limit': 10, 'with_items': 1, **({'cursor': cursor} if cursor else {})}
+            with self.assertNumQueries(2):  # página + conteo agregado de items
+                data = self.get(**params).json()
+            seen += data['results']
+            pages += 1
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(len({o['id'] for o in seen}), 25)
+        expected = Order.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual([o['id'] for o in seen], list(expected))
+        by_id = {o['id']: o for o in seen}
+        self.assertEqual(by_id[self.orders[4].id]['item_count'], 2)
+
+        expired = {o['id'] for o in seen if o['is_expired']}
+        self.assertEqual(expired, {o.id for o in self.orders[12:]})  # pendientes de hace 6 horas o más
+
+    def test_legacy_list_and_errors(self):
+        with self.assertNumQueries(1):
+            data = self.get().json()
+        self.assertEqual(len(data), 25)
+        paid = next(o for o in data if o['id'] == self.orders[0].id)
+        self.assertEqual((paid['status'], paid['raw_status'], paid['is_expired']), ("Pagado", Order.StatusChoices.PAID, False))
+        self.assertNotIn('item_count', data[0])
+        self.assertEqual(self.get(cursor='nope').status_code, 400)
+        self.assertEqual(self.get(limit='x').status_code, 400)
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class AccountDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Aros")
+        self.user = User.objects.create_user(username="d@x.cl", email="d@x.cl", first_name="Dana", phone="123")
+        Address.objects.create(user=self.user, street_address="Calle 1", city="Talca", state="N/A", zip_code="0")
+        Address.objects.create(user=self.user, street_address="Calle 2", city="Curicó", state="N/A", zip_code="0", is_default=True)
+
+    def add_data(self, count):
+        products = create_products(self.category, count, start=Product.objects.count())
+        for product in products:
+            Favorite.objects.create(user=self.user, product=product)
+            create_order(self.user, [(product, 1)])
+
+    def get(self, **params):
+        return self.client.get(reverse('get_account'), {'email': 'd@x.cl', **params})
+
+    def test_all_sections_in_fixed_queries(self):
+        self.add_data(2)
+        with CaptureQueriesContext(connection) as small:
+            self.get()
+        self.add_data(30)
+        with CaptureQueriesContext(connection) as large:
+            data = self.get().json()
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertLessEqual(len(large.captured_queries), 4)
+
+        self.assertEqual(data['profile'], {'nombre': 'Dana', 'telefono': '123', 'direccion': 'Calle 2', 'ciudad': 'Curicó'})
+        self.assertEqual(len(data['orders']['results']), 20)
+        self.assertIsNotNone(data['orders']['next_cursor'])
+        self.assertEqual(len(data['favorites']), 32)
+        self.assertTrue(data['favorites'][0]['image'].endswith('_1.jpg'))  # la portada
+
+    def test_orders_filter_on_the_resolved_user_id(self):
+        self.add_data(1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.get(sections='orders')
+        orders_sql = [q['sql'] for q in ctx.captured_queries if 'FROM "core_order"' in q['sql']]
+        self.assertEqual(len(orders_sql), 1)
+        self.assertNotIn('JOIN', orders_sql[0])  # Directo sobre order_user_created_idx
+
+    def test_profile_endpoint_shows_the_same_default_address(self):
+        profile = self.client.get(reverse('get_user_profile'), {'email': 'd@x.cl'}).json()
+        self.assertEqual(profile, self.get(sections='profile').json()['profile'])
+        self.assertEqual(profile['direccion'], 'Calle 2')
+
+    def test_section_selection_and_errors(self):
+        self.add_data(6)
+        with self.assertNumQueries(2):  # usuario + favoritos (la portada viene en el producto)
+            data = self.get(sections='favorites', favorites_limit=4).json()
+        self.assertEqual(list(data), ['favorites'])
+        self.assertEqual(len(data['favorites']), 4)
+        self.assertEqual(len(self.get(sections='orders', orders_limit=5).json()['orders']['results']), 5)
+        self.assertEqual(self.get(sections='profile,pagos').status_code, 400)
+        self.assertEqual(self.client.get(reverse('get_account'), {'email': 'nadie@x.cl'}).status_code, 404)
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class FavoritesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Aros")
+        self.user = User.objects.create_user(username="f@x.cl", email="f@x.cl")
+
+    def add_favorites(self, count):
+        for product in create_products(self.category, count, start=Product.objects.count()):
+            Favorite.objects.create(user=self.user, product=product)
+
+    def test_listing_uses_constant_queries(self):
+        self.add_favorites(2)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('get_favorites'), {'email': 'f@x.cl'})
+        self.add_favorites(20)
+        with self.assertNumQueries(1):  # favoritos+producto+categoría (con la portada)
+            data = self.client.get(reverse('get_favorites'), {'email': 'f@x.cl'}).json()
+        self.assertEqual(len(data), 22)
+        self.assertTrue(all(fav['image'].endswith('_1.jpg') for fav in data))
+
+    def test_ids_are_versioned_and_revalidated(self):
+        self.add_favorites(3)
+        url = reverse('get_favorite_ids')
+        with self.assertNumQueries(2):  # id del usuario (queda en el cache) + ids
+            self.client.get(url, {'email': 'f@x.cl'})
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'email': 'f@x.cl'})
+        data = response.json()
+        self.assertEqual(data['ids'], sorted(Product.objects.values_list('id', flat=True)))
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(url, {'email': 'f@x.cl'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.filter(product_id=data['ids'][0]).get().delete()
+        fresh = self.client.get(url, {'email': 'f@x.cl'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(fresh.json()['ids'], data['ids'][1:])
+        self.assertGreater(fresh.json()['version'], data['version'])
+
+    def test_email_to_id_cache_follows_email_changes(self):
+        self.assertEqual(favorites.favorites_user_id("f@x.cl"), self.user.id)
+        user = User.objects.get(pk=self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.email = "nuevo@x.cl"
+            user.save()
+        self.assertIsNone(favorites.favorites_user_id("f@x.cl"))
+        self.assertEqual(favorites.favorites_user_id("nuevo@x.cl"), user.id)
+
+        # Una cuenta nueva reutiliza el email viejo: no hereda los favoritos del anterior
+        with self.captureOnCommitCallbacks(execute=True):
+            other = User.objects.create_user(username="otra", email="f@x.cl")
+        self.assertEqual(favorites.favorites_user_id("f@x.cl"), other.id)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            user.first_name = "Fer"
+            user.save()  # Mismo email: nada que olvidar
+        self.assertEqual(callbacks, [])
+
+    def test_cascade_delete_does_not_query_users(self):
+        product = create_products(self.category, 1)[0]
+        users = [User.objects.create_user(username=f"u{i}@x.cl", email=f"u{i}@x.cl") for i in range(10)]
+        Favorite.objects.bulk_create(Favorite(user=user, product=product) for user in users)
+        versions = [favorites.get_favorites_version(user.id) for user in users]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as ctx:
+                product.delete()
+        self.assertFalse([q for q in ctx.captured_queries if 'core_user' in q['sql']])
+        self.assertTrue(all(favorites.get_favorites_version(u.id) > v for u, v in zip(users, versions)))
+
+    def statements(self, func):
+        # Sin contar los SAVEPOINT de transaction.atomic() dentro del TestCase
+        with CaptureQueriesContext(connection) as ctx:
+            result = func()
+        return result, [q['sql'] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+
+    def toggle(self, product_id):
+        payload = json.dumps({'email': 'f@x.cl', 'product_id': product_id})
+        return self.client.post(reverse('toggle_favorite'), payload, content_type='application/json')
+
+    def test_toggle_in_two_statements(self):
+        product = create_products(self.category, 1)[0]
+        version = favorites.get_favorites_version(self.user.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response, sql = self.statements(lambda: self.toggle(product.id))
+        self.assertEqual((response.status_code, response.json()['status']), (201, 'added'))
+        self.assertEqual(len(sql), 2)  # DELETE (nada) + INSERT
+        self.assertGreater(favorites.get_favorites_version(self.user.id), version)
+
+        # Doble clic que llega cuando la fila ya existe: se ignora el duplicado
+        self.assertEqual(favorites.add_favorites('f@x.cl', [product.id]), 0)
+
+        response, sql = self.statements(lambda: self.toggle(product.id))
+        self.assertEqual(response.json()['status'], 'removed')
+        self.assertEqual(len(sql), 1)
+        self.assertFalse(Favorite.objects.exists())
+        self.assertEqual(self.toggle(999999).status_code, 400)
+
+    def test_batch_applies_last_action_per_product(self):
+        products = create_products(self.category, 4)
+        Favorite.objects.create(user=self.user, product=products[0])
+        ops = [
+            {'product_id': products[0].id, 'action': 'remove'},
+            {'product_id': products[1].id, 'action': 'add'},
+            {'product_id': products[2].id, 'action': 'add'},
+            {'product_id': products[2].id, 'action': 'remove'},  # el último gana
+            {'product_id': products[3].id, 'action': 'add'},
+        ]
+        payload = json.dumps({'email': 'f@x.cl', 'ops': ops})
+        response, sql = self.statements(
+            lambda: self.client.post(reverse('sync_favorites'), payload, content_type='application/json')
+        )
+        self.assertEqual(len(sql), 3)  # DELETE + INSERT + ids
+        self.assertEqual(response.json(), {'added': 2, 'removed': 1, 'ids': [products[1].id, products[3].id]})
+
+        bad = json.dumps({'email': 'f@x.cl', 'ops': [{'product_id': products[0].id, 'action': 'toggle'}]})
+        self.assertEqual(self.client.post(reverse('sync_favorites'), bad, content_type='application/json').status_code, 400)
+
+
+@override_settings(CACHES=LOCAL_CACHES, EMAIL_OUTBOX_AUTODRAIN=False)
+class TrackOrderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Aros")
+        products = [Product.objects.create(category=category, sku=f"T{i}", name=f"Aro {i}", price=1000, stock=9) for i in range(5)]
+        self.owner = User.objects.create_user(username="t@x.cl", email="t@x.cl", first_name="Tere")
+        address = Address.objects.create(user=self.owner, street_address="Calle 3", city="Linares", state="N/A", zip_code="0")
+        self.order = create_order(self.owner, [(p, 2) for p in products])
+        Order.objects.filter(pk=self.order.pk).update(shipping_address=address)
+
+    def track(self, user=None):
+        headers = {}
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = f"Bearer {AccessToken.for_user(user)}"
+        return self.client.get(reverse('track_order'), {'code': f"poli-{self.order.id}"}, **headers).json()
+
+    def test_public_view_is_cached_until_the_order_changes(self):
+        with self.assertNumQueries(2):  # orden + items con nombre de producto
+            data = self.track()
+        self.assertEqual([i['name'] for i in data['items']], [f"Aro {i}" for i in range(5)])
+        self.assertFalse(data['is_owner'])
+        self.assertNotIn('address', data)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.track(), data)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_order_paid(self.order.id)
+        self.assertEqual(self.track()['status'], "Pagado")
+
+    def test_owner_is_decided_from_token_claims(self):
+        stranger = User.objects.create_user(username="o@x.cl", email="o@x.cl")
+        self.track()
+        with self.assertNumQueries(1):  # solo los datos privados, sin buscar al usuario del token
+            data = self.track(self.owner)
+        self.assertTrue(data['is_owner'])
+        self.assertEqual((data['address'], data['courier']), ("Calle 3, Linares", "Pedido en preparación"))
+        self.assertFalse(self.track(stranger)['is_owner'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Shipment.objects.create(order=self.order, courier="Starken", tracking_number="ST-1")
+        self.assertEqual(self.track(self.owner)['tracking_number'], "ST-1")
+
+    def test_unknown_codes(self):
+        self.assertFalse(self.client.get(reverse('track_order'), {'code': 'POLI-999'}).json()['success'])
+        self.assertFalse(self.client.get(reverse('track_order'), {'code': 'hola'}).json()['success'])
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class CatalogViewSetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Aros")
+        Category.objects.create(name="Mini", parent=self.category)
+
+    def list_products(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('catalog-product-list'), {'limit': 100, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_list_query_count_is_constant(self):
+        create_products(self.category, 3)
+        _, small = self.list_products()
+        create_products(self.category, 40, start=3)
+        data, large = self.list_products()
+        self.assertEqual(small, large)
+        self.assertEqual(large, 2)  # productos + categoría, imágenes
+        self.assertEqual(len(data['results']), 43)
+        first = data['results'][0]
+        self.assertTrue(first['main_image'].endswith('_1.jpg'))
+        self.assertEqual(first['category'], {'id': self.category.id, 'name': "Aros", 'slug': "aros"})
+
+    def test_sparse_fieldsets_skip_the_image_prefetch(self):
+        create_products(self.category, 5)
+        data, queries = self.list_products(fields='id,name,final_price')
+        self.assertEqual(queries, 1)
+        self.assertEqual(set(data['results'][0]), {'id', 'name', 'final_price'})
+        self.assertEqual(self.client.get(reverse('catalog-product-list'), {'fields': 'id,secreto'}).status_code, 400)
+
+        page, _ = self.list_products(limit=2, fields='id')
+        self.assertEqual(len(page['results']), 2)
+        self.assertIsNotNone(page['next'])
+
+    def test_categories_and_detail(self):
+        product = create_products(self.category, 1)[0]
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('catalog-category-list')).json()
+        self.assertEqual([c['full_name'] for c in data], ["Aros", "Aros -> Mini"])
+        detail = self.client.get(reverse('catalog-product-detail', args=[product.id]), {'fields': 'id,images'}).json()
+        self.assertEqual(len(detail['images']), 3)
+
+
+def image_upload(name, size, color=(200, 120, 40), fmt='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES, IMAGE_VARIANTS_AUTOPROCESS=False)
+class ImageVariantsTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.product = Product.objects.create(category=Category.objects.create(name="Aros"), sku="IMG-1", name="Aros sol", price=5000)
+        invalidate_catalog()
+
+    def test_upload_is_processed_outside_the_save(self):
+        image = ProductImage.objects.create(product=self.product, image=image_upload('sol.png', (2000, 1500)), is_main=True)
+        self.assertEqual(image.processing_status, ProductImage.ProcessingChoices.PENDING)
+        self.assertIsNone(self.client.get(reverse('get_products')).json()[0]['main_image_srcset'])
+
+        self.assertEqual(images.process_pending_images(), {'ready': 1, 'failed': 0})
+        image.refresh_from_db()
+        self.assertEqual((image.width, image.height), (2000, 1500))
+        self.assertEqual(len(image.blurhash), 28)  # 4x3 componentes
+        self.assertEqual(sorted({(v['name'], v['width']) for v in image.variants}), [('card', 480), ('detail', 1080), ('thumb', 160)])
+        self.assertEqual({v['format'] for v in image.variants}, {'webp', 'jpeg'})
+        for variant in image.variants:
+            self.assertTrue(default_storage.exists(variant['path']))
+            with default_storage.open(variant['path']) as f:
+                self.assertEqual(Image.open(f).size, (variant['width'], variant['height']))
+
+        invalidate_catalog()
+        data = self.client.get(reverse('get_products')).json()[0]['main_image_srcset']
+        self.assertEqual([s['type'] for s in data['sources']], ['image/webp', 'image/jpeg'])
+        self.assertIn('_card.jpeg', data['src'])
+        self.assertRegex(data['sources'][0]['srcset'], r'_thumb\.webp 160w, .*_card\.webp 480w, .*_detail\.webp 1080w$')
+        self.assertEqual((data['width'], data['height'], data['blurhash']), (2000, 1500, image.blurhash))
+
+        product = self.client.get(reverse('catalog-product-detail', args=[self.product.id])).json()
+        self.assertEqual(product['main_image_srcset'], data)
+        self.assertEqual(product['images'][0]['srcset'], data)
+
+    def test_small_images_are_not_upscaled(self):
+        image = ProductImage.objects.create(product=self.product, image=image_upload('mini.jpg', (300, 200), fmt='JPEG'))
+        images.process_pending_images()
+        image.refresh_from_db()
+        self.assertEqual(sorted({(v['name'], v['width'], v['height']) for v in image.variants}), [('card', 300, 200), ('thumb', 160, 107)])
+
+    def test_blurhash_matches_reference_encoder(self):
+        # Mismo valor que entrega la librería de referencia (blurhash-python)
+        self.assertEqual(images.blurhash(Image.new('RGB', (50, 40), (255, 0, 0))), 'LCTI:j]9fQ]9|co1fQo1fQfQfQfQ')
+
+    def test_replacing_and_deleting_cleans_up_variants(self):
+        image = ProductImage.objects.create(product=self.product, image=image_upload('a.png', (800, 600)))
+        images.process_pending_images()
+        image.refresh_from_db()
+        old_paths = [v['path'] for v in image.variants]
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            image.image = image_upload('b.png', (640, 480))
+            image.save()
+        self.assertEqual(image.processing_status, ProductImage.ProcessingChoices.PENDING)
+        self.assertNotIn(images._process_in_background, callbacks)  # Sin autoproceso: espera al worker
+
+        images.process_pending_images()
+        image.refresh_from_db()
+        self.assertFalse(any(default_storage.exists(path) for path in old_paths))
+        self.assertEqual(image.width, 640)
+
+        new_paths = [v['path'] for v in image.variants]
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(any(default_storage.exists(path) for path in new_paths))
+
+    def test_unreadable_file_is_marked_failed(self):
+        image = ProductImage.objects.create(product=self.product, image=SimpleUploadedFile('roto.jpg', b'no es una imagen'))
+        self.assertEqual(images.process_pending_images(), {'ready': 0, 'failed': 1})
+        image.refresh_from_db()
+        self.assertEqual(image.processing_status, ProductImage.ProcessingChoices.FAILED)
+        self.assertTrue(image.processing_error)
+
+    def test_resizing_runs_outside_the_claim_transaction(self):
+        image = ProductImage.objects.create(product=self.product, image=image_upload('d.png', (400, 300)))
+        test_blocks = len(connection.atomic_blocks)  # Los de TestCase
+        seen = []
+        encode = images._encode
+
+        def spy(img, pil_format):
+            seen.append((len(connection.atomic_blocks), ProductImage.objects.get(pk=image.pk).processing_status))
+            return encode(img, pil_format)
+
+        with mock.patch.object(images, '_encode', side_effect=spy):
+            self.assertEqual(images.process_pending_images(), {'ready': 1, 'failed': 0})
+        self.assertEqual(set(seen), {(test_blocks, ProductImage.ProcessingChoices.PROCESSING)})
+
+    def test_replaced_while_processing_discards_the_variants(self):
+        image = ProductImage.objects.create(product=self.product, image=image_upload('e.png', (400, 300)))
+        written = []
+        encode = images._encode
+
+        def replace_midway(img, pil_format):
+            # El admin sube otra foto mientras el worker procesa la anterior
+            ProductImage.objects.filter(pk=image.pk).update(image='products/otra.png', processing_status=ProductImage.ProcessingChoices.PENDING)
+            written.append(pil_format)
+            return encode(img, pil_format)
+
+        with mock.patch.object(images, '_encode', side_effect=replace_midway):
+            self.assertEqual(images.process_pending_images(), {'ready': 0, 'failed': 0})
+        image.refresh_from_db()
+        self.assertEqual((image.processing_status, image.variants), (ProductImage.ProcessingChoices.PENDING, []))
+        self.assertTrue(written)
+        _, files = default_storage.listdir(images.VARIANTS_DIR)
+        self.assertEqual(files, [])
+
+    def test_expired_claims_are_picked_up_again(self):
+        image = ProductImage.objects.create(product=self.product, image=image_upload('f.png', (40, 30)))
+        stuck = ProductImage.objects.filter(pk=image.pk)
+        stuck.update(processing_status=ProductImage.ProcessingChoices.PROCESSING, processing_started_at=timezone.now())
+        self.assertEqual(images.process_pending_images(), {'ready': 0, 'failed': 0})  # Otro worker la tiene
+        stuck.update(processing_started_at=timezone.now() - images.PROCESSING_LEASE - timedelta(seconds=1))
+        self.assertEqual(images.process_pending_images(), {'ready': 1, 'failed': 0})
+
+    @override_settings(IMAGE_VARIANTS_AUTOPROCESS=True)
+    def test_autoprocess_waits_for_the_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            image = ProductImage.objects.create(product=self.product, image=image_upload('c.png', (10, 10)))
+        scheduled = [c for c in callbacks if getattr(c, 'func', None) is images._process_in_background]
+        self.assertEqual([c.args for c in scheduled], [(image.pk,)])
+
+    def test_processing_can_be_limited_to_the_saved_image(self):
+        backlog = ProductImage.objects.create(product=self.product, image=image_upload('b.png', (10, 10)))
+        saved = ProductImage.objects.create(product=self.product, image=image_upload('s.png', (10, 10)))
+        self.assertEqual(images.process_pending_images(ids=[saved.pk]), {'ready': 1, 'failed': 0})
+        backlog.refresh_from_db()
+        self.assertEqual(backlog.processing_status, ProductImage.ProcessingChoices.PENDING)  # Queda para el worker
+
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class ProductCoverTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Aros")
+        self.product = create_products(self.category, 1)[0]
+
+    def cover(self):
+        return Product.objects.values_list('main_image_url', 'image_count').get(pk=self.product.pk)
+
+    def test_image_hooks_keep_the_cover_in_sync(self):
+        self.assertEqual(self.cover(), ('/media/products/p0_1.jpg', 3))
+        *_, last = self.product.images.order_by('id')
+
+        last.is_main = True
+        last.save()
+        self.assertEqual(list(self.product.images.filter(is_main=True)), [last])  # una sola portada
+        self.assertEqual(self.cover(), ('/media/products/p0_2.jpg', 3))
+
+        last.delete()
+        self.assertEqual(self.cover(), ('/media/products/p0_0.jpg', 2))  # sin portada: la primera
+        self.product.images.all().delete()
+        self.assertEqual(self.cover(), ('', 0))
+
+    def test_listings_read_the_cover_without_image_queries(self):
+        create_products(self.category, 10, start=1)
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('catalog-product-list'), {'fields': 'id,main_image,main_image_srcset'}).json()
+        self.assertTrue(all(p['main_image'].endswith('_1.jpg') for p in data['results']))
+
+    def test_backfill_command(self):
+        Product.objects.update(main_image_url='', image_count=0)
+        out = io.StringIO()
+        call_command('backfill_product_covers', batch_size=1, stdout=out)
+        self.assertIn("1 productos", out.getvalue())
+        self.assertEqual(self.cover(), ('/media/products/p0_1.jpg', 3))
+
+    def test_migration_fills_covers_of_existing_products(self):
+        # Productos que ya existían antes de 0010: fotos, pero portada sin calcular
+        Product.objects.update(main_image_url='', image_count=0)
+        bare = create_products(self.category, 1, images_per_product=0, start=1)[0]
+        migration = importlib.import_module('core.migrations.0010_product_cover_image')
+        migration.fill_product_covers(django_apps, None)
+        self.assertEqual(self.cover(), ('/media/products/p0_1.jpg', 3))
+        self.assertEqual(Product.objects.values_list('main_image_url', 'image_count').get(pk=bare.pk), ('', 0))
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES, SQL_INSTRUMENTATION_SAMPLE_RATE=1.0, SLOW_REQUEST_MS=10_000)
+class QueryInstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Aros")
+        self.products = create_products(self.category, 6, images_per_product=1)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('catalog-product-list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="2 queries", app;dur=[\d.]+$')
+        with override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=0.0):
+            response = self.client.get(reverse('catalog-product-list'))
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[\d.]+$')  # Fuera de la muestra
+
+    @override_settings(SLOW_REQUEST_QUERIES=1)
+    def test_slow_requests_are_logged_with_the_view_name(self):
+        with self.assertLogs('core.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('catalog-product-list'))
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['view'], entry['queries'], entry['status']), ('catalog-product-list', 2, 200))
+        self.assertEqual(entry['repeated_queries'], [])
+
+    def test_repeated_query_shapes_are_flagged(self):
+        def n_plus_one(request):
+            names = [Product.objects.get(pk=p.pk).name for p in self.products]
+            list(Product.objects.filter(pk__in=[p.pk for p in self.products[:2]]))
+            list(Product.objects.filter(pk__in=[p.pk for p in self.products]))
+            return JsonResponse(names, safe=False)
+
+        with self.assertLogs('core.slow_requests', 'WARNING') as logs:
+            QueryInstrumentationMiddleware(n_plus_one)(RequestFactory().get('/x/'))
+        repeated = json.loads(logs.records[0].getMessage())['repeated_queries']
+        self.assertEqual([r['count'] for r in repeated], [6])
+        self.assertIn('WHERE "core_product"."id" = %s', repeated[0]['sql'])
+        self.assertEqual(sql_shape('SELECT 1 WHERE id IN (%s, %s,\n %s)'), 'SELECT 1 WHERE id IN (...)')
+
+    async def test_async_views_only_measure_latency(self):
+        async def view(request):
+            return JsonResponse({})
+
+        response = await QueryInstrumentationMiddleware(view)(AsyncRequestFactory().get('/x/'))
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[\d.]+$')
+
+
+@override_settings(CACHES=LOCAL_CACHES, EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_AUTODRAIN=False, **FLOW_SETTINGS)
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+
+    def scrape(self, **headers):
+        response = self.client.get('/metrics', **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_histograms_are_cumulative(self):
+        registry = metrics.Registry(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            registry.observe('x_seconds', value, dep='a"b')
+        registry.inc('x_total', 2)
+        text = metrics.render([registry.snapshot()])
+        self.assertIn('x_seconds_bucket{dep="a\\"b",le="0.1"} 2\n', text)
+        self.assertIn('x_seconds_bucket{dep="a\\"b",le="1.0"} 3\n', text)
+        self.assertIn('x_seconds_bucket{dep="a\\"b",le="+Inf"} 4\n', text)
+        self.assertIn('x_seconds_count{dep="a\\"b"} 4\n', text)
+        self.assertIn('x_seconds_sum{dep="a\\"b"} 3.65\n', text)
+        self.assertIn('# TYPE x_total counter\nx_total 2\n', text)
+
+    def test_external_calls_and_views_are_measured(self):
+        category = Category.objects.create(name="Aros")
+        product = Product.objects.create(category=category, sku="M1", name="Aro", price=1000, stock=5)
+        order = create_order(User.objects.create_user(username="m@x.cl", email="m@x.cl"), [(product, 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            confirm(self.client, order)
+        drain_outbox()
+        storage = LocalStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location, ignore_errors=True)
+        storage.save('x.txt', io.BytesIO(b'hola'))
+
+        text = self.scrape()
+        self.assertIn('external_call_duration_seconds_count{dependency="flow",operation="payment/getStatus",outcome="200"} 1\n', text)
+        self.assertIn('external_call_duration_seconds_count{dependency="smtp",operation="send",outcome="ok"} 1\n', text)
+        self.assertIn('external_call_duration_seconds_count{dependency="filesystem",operation="upload",outcome="ok"} 1\n', text)
+        self.assertIn('http_request_duration_seconds_count{method="POST",status="200",view="payment_confirm"} 1\n', text)
+        self.assertIn('email_outbox_messages_total{result="sent"} 1\n', text)
+
+    def test_worker_files_are_merged(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir, ignore_errors=True)
+        other = metrics.Registry()
+        other.observe('http_request_duration_seconds', 0.2, view='get_products', method='GET', status=200)
+        # Un worker vivo (el proceso padre sirve de ejemplo) y uno que ya terminó
+        finished = subprocess.Popen([sys.executable, '-c', ''])
+        finished.wait()
+        for pid in (os.getppid(), finished.pid):
+            with open(os.path.join(metrics_dir, f'metrics-{pid}.json'), 'w') as f:
+                json.dump(other.snapshot(), f)
+
+        with override_settings(METRICS_DIR=metrics_dir):
+            self.client.get(reverse('get_products'))
+            self.assertTrue(os.path.exists(os.path.join(metrics_dir, f"metrics-{os.getpid()}.json")))
+            text = self.scrape()
+        self.assertIn('http_request_duration_seconds_count{method="GET",status="200",view="get_products"} 2\n', text)
+        self.assertFalse(os.path.exists(os.path.join(metrics_dir, f'metrics-{finished.pid}.json')))
+
+    @override_settings(METRICS_TOKEN='secreto')
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer otro').status_code, 401)
+        self.scrape(HTTP_AUTHORIZATION='Bearer secreto')
+
+
+@override_settings(STORAGES=LOCAL_STORAGES, CACHES=LOCAL_CACHES)
+class EndpointBenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_small_dataset_runs_every_scenario(self):
+        counts = benchmark_endpoints.seed_dataset(products=30, images=2, users=5, orders=40, favorites=20)
+        self.assertEqual((counts['categories'], counts['products'], counts['images']), (248, 30, 60))
+        self.assertEqual((counts['orders'], counts['favorites']), (40, 20))
+        self.assertEqual(Product.objects.filter(image_count=2, main_image_url__endswith='_1.jpg').count(), 30)
+
+        results = benchmark_endpoints.measure_endpoints(iterations=2, warmup=1)
+        self.assertEqual({name: r['status'] for name, r in results.items() if r['status'] != [200]}, {})
+        self.assertEqual(results['get_favorites']['queries'], 1)
+        self.assertEqual(Order.objects.count(), 40)  # create_payment se deshace al terminar
+
+    def test_compare_flags_query_and_p95_regressions(self):
+        base = {'a': {'queries': 2, 'p95_ms': 10.0, 'status': [200]}, 'b': {'queries': 1, 'p95_ms': 1.0, 'status': [200]}}
+        current = {'a': {'queries': 3, 'p95_ms': 14.0, 'status': [200]}, 'b': {'queries': 1, 'p95_ms': 2.5, 'status': [200]}}
+        self.assertEqual(benchmark_endpoints.compare_results(base, current), ["a: queries 2 -> 3", "a: p95 10.0 ms -> 14.0 ms"])
+        self.assertEqual(benchmark_endpoints.compare_results(base, current, query_tolerance=1, latency_tolerance=0.5), [])
+
+    def test_failed_child_run_raises_instead_of_comparing(self):
+        command = benchmark_endpoints.Command()
+        failed = subprocess.CalledProcessError(1, [], output='', stderr="Traceback...\nOperationalError: no such table")
+        with mock.patch.object(benchmark_endpoints.subprocess, 'run', side_effect=failed):
+            with self.assertRaisesMessage(CommandError, "OperationalError: no such table"):
+                command.run_child({}, '--measure')
+        # Sale con 0 pero sin resultado: tampoco se compara
+        with mock.patch.object(benchmark_endpoints.subprocess, 'run', return_value=subprocess.CompletedProcess([], 0, stdout='', stderr='')):
+            with self.assertRaises(CommandError):
+                command.run_child({}, '--measure')
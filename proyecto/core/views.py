@@ -1,46 +1,89 @@
+import hmac
 import json
-from django.http import JsonResponse
+import logging
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.contrib.auth import get_user_model
 from django.views.decorators.csrf import csrf_exempt
-from django.shortcuts import render, redirect
-from .models import Product, Order, OrderItem, Favorite, Address, Shipment, ContactMessage
-from datetime import timedelta
+from django.shortcuts import redirect
+from django.views.decorators.http import etag
+from .models import Order, Address, ContactMessage
+from .catalog import (
+    get_catalog_snapshot, is_catalog_query, query_catalog, stream_catalog, catalog_queryset, serialize_product, TRUE_VALUES,
+)
+from .search import search_product_ids
+from .account import build_account, default_address, serialize_profile
+from . import favorites
+from .orders import (
+    ORDER_EXPIRATION, SHIPPING_RATES, create_order_from_cart, discard_order, get_public_tracking, mark_order_paid,
+    order_history, owner_tracking, query_order_history,
+)
+from .outbox import enqueue_email
+from . import flow, metrics
 from django.utils import timezone
-import hmac
-import hashlib
-import requests
-import os
-from urllib.parse import urlencode
-from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 def api_home(request):
     return JsonResponse({"mensaje": "¡El Backend está vivo!"})
 
+def _wants_stream(request):
+    return request.GET.get('stream') in TRUE_VALUES
+
+def _catalog_etag(request):
+    if _wants_stream(request) or is_catalog_query(request.GET):
+        return None  # Las consultas filtradas/paginadas no pasan por el snapshot
+    return get_catalog_snapshot().etag
+
+# Sin parámetros de catálogo: el catálogo completo (lista) desde el snapshot
+# pre-serializado; si el navegador ya tiene esa versión (If-None-Match), @etag
+# responde 304 sin cuerpo. Otros parámetros (?utm_source=...) se ignoran.
+# Con filtros (category, is_featured, min_price, max_price, on_sale, in_stock,
+# sort, cursor, limit): una página {'results': [...], 'next_cursor': ...}.
+# Con stream=1: el arreglo completo (filtrado) emitido por bloques, con memoria acotada.
+@etag(_catalog_etag)
 def get_products(request):
-    products_queryset = Product.objects.filter(is_active=True)
-    products_list = []
-    for product in products_queryset:
-        main_image_obj = product.images.filter(is_main=True).first()
-        if not main_image_obj:
-            main_image_obj = product.images.first()
-            
-        image_url = main_image_obj.image.url if main_image_obj else None
-        all_images = [img.image.url for img in product.images.all()]
-        products_list.append({
-            'id': product.id,
-            'name': product.name,
-            'price': float(product.price),
-            'stock': product.stock,
-            'category__name': product.category.name if product.category else "Sin categoría",
-            'main_image': image_url,
-            'all_images': all_images,
-            'description': product.description,
-            'is_featured': product.is_featured
-        })
-    return JsonResponse(products_list, safe=False)
+    if _wants_stream(request):
+        try:
+            chunks = stream_catalog(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return StreamingHttpResponse(chunks, content_type='application/json')
+
+    if is_catalog_query(request.GET):
+        try:
+            return JsonResponse(query_catalog(request.GET))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    snapshot = get_catalog_snapshot()
+    response = HttpResponse(snapshot.body, content_type='application/json')
+    response['Cache-Control'] = 'no-cache'  # Siempre revalidar, pero con 304 barato
+    return response
+
+def search_products(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), 50))
+    except ValueError:
+        return JsonResponse({'error': "Parámetro 'limit' inválido"}, status=400)
+
+    ranked = search_product_ids(query, limit=limit) if query else []
+    scores = dict(ranked)
+    products = {p.id: p for p in catalog_queryset().filter(id__in=scores)}
+
+    results = []
+    for product_id, score in ranked:
+        if product_id in products:
+            item = serialize_product(products[product_id])
+            item['score'] = score
+            results.append(item)
+    return JsonResponse({'query': query, 'results': results})
 
 @csrf_exempt
 def register_user(request):
@@ -66,200 +109,169 @@ def create_payment(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            amount = int(data.get('amount', 0))
             email = data.get('email', 'cliente@policromica.cl')
             cart_items = data.get('cart', [])
             shipping_data = data.get('shipping', {})
-            
-            nombre_cliente = f"{shipping_data.get('nombre', '')} {shipping_data.get('apellido', '')}".strip() or 'Cliente Invitado'
-            user, created = User.objects.get_or_create(
-                email=email,
-                defaults={'username': email, 'first_name': nombre_cliente}
-            )
 
-            address = Address.objects.create(
-                user=user,
-                street_address=shipping_data.get('direccion', 'Sin dirección'),
-                city=shipping_data.get('ciudad', 'Sin ciudad'),
-                state='N/A',
-                zip_code='0000000',
-            )
-
-            order = Order.objects.create(
-                user=user,
-                shipping_address=address,
-                total_amount=amount,
-                status=Order.StatusChoices.PENDING
-            )
-
-            for item in cart_items:
-                try:
-                    product = Product.objects.get(id=item['id'])
-                    OrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        quantity=item['quantity']
-                    )
-                except Product.DoesNotExist:
-                    continue
-            
+            # La orden se confirma antes de llamar a Flow: la transacción (y los
+            # locks de sus escrituras) no queda abierta durante la llamada HTTP.
+            # Si Flow falla, la orden se deshace con discard_order.
+            with transaction.atomic():
+                order = create_order_from_cart(email, cart_items, shipping_data)
+            amount = int(order.total_amount)  # Calculado en el servidor con los precios de la BD
             commerce_order = f"POLI-{order.id}"
 
-            api_key = os.environ.get("FLOW_API_KEY")
-            secret_key = os.environ.get("FLOW_SECRET_KEY")
-            api_url = "https://sandbox.flow.cl/api"
-
-            params = {
-                "apiKey": api_key,
-                "commerceOrder": commerce_order,
-                "subject": f"Pedido {commerce_order} en Policrómica",
-                "currency": "CLP",
-                "amount": amount,
-                "email": email,
-                "urlConfirmation": "https://tienda-backend-fn64.onrender.com/api/payment/confirm/", 
-                "urlReturn": "https://tienda-backend-fn64.onrender.com/api/payment/final-redirect/", 
-            }
-
-            sorted_params = sorted(params.items(), key=lambda x: x[0])
-            to_sign = "".join([f"{key}{value}" for key, value in sorted_params])
-            signature = hmac.new(secret_key.encode(), to_sign.encode(), hashlib.sha256).hexdigest()
-            params["s"] = signature
-
-            encoded_body = urlencode(params)
-            response = requests.post(f"{api_url}/payment/create", data=encoded_body, headers={'Content-Type':'application/x-www-form-urlencoded'})
-            
-            if response.status_code == 200:
-                flow_data = response.json()
-                payment_url = f"{flow_data['url']}?token={flow_data['token']}"
-                return JsonResponse({'url': payment_url}, status=200)
-            else:
+            try:
+                response = flow.get_client().create_payment(
+                    commerce_order=commerce_order,
+                    subject=f"Pedido {commerce_order} en Policrómica",
+                    amount=amount,
+                    email=email,
+                )
+            except Exception:
+                discard_order(order.id)
+                raise
+
+            if response.status_code != 200:
+                discard_order(order.id)
                 return JsonResponse({'error': 'Error comunicando con Flow', 'details': response.text}, status=400)
 
+            flow_data = response.json()
+            payment_url = f"{flow_data['url']}?token={flow_data['token']}"
+            return JsonResponse({'url': payment_url, 'total': amount}, status=200)
+
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
     return JsonResponse({'error': 'Método no permitido'}, status=405)
 
+# Tarifas de envío que muestra Checkout.jsx: las mismas con que el servidor
+# calcula el total (core/orders.py), así no hay dos tablas que mantener.
+def get_shipping_rates(request):
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    rates = [{'region': region, 'price': price} for region, price in SHIPPING_RATES.items()]
+    return JsonResponse({'rates': rates})
+
+
+def confirmation_email(order, order_items, order_id_str):
+    # Asunto, texto plano y HTML del correo de confirmación de pago
+    items_html = ""
+    subtotal_productos = 0
+
+    for item in order_items:
+        product = item.product
+
+        # Calculamos el subtotal de este item y lo sumamos al total de productos
+        subtotal_item = int(item.unit_price * item.quantity)
+        subtotal_productos += subtotal_item
+        items_html += f'<li style="margin-bottom: 8px; color: #374151; font-size: 14px;"><strong>{item.quantity}x</strong> {product.name} <span style="color: #db2777; font-weight: bold; float: right;">${subtotal_item}</span></li>'
+
+    # Calculamos el costo de envío (Total - Subtotal productos)
+    costo_envio = int(order.total_amount) - subtotal_productos
+    if costo_envio < 0:
+        costo_envio = 0
+
+    subject = f"¡Tu pedido {order_id_str} está confirmado! - Policrómica"
+
+    html_message = f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; color: #333; line-height: 1.6; margin: 0; padding: 20px; background-color: #f9fafb;">
+        <div style="max-width: 600px; margin: 0 auto; background-color: #ffffff; border-radius: 16px; overflow: hidden; box-shadow: 0 4px 6px rgba(0,0,0,0.05); border: 1px solid #e5e7eb;">
+            <div style="background-color: #b3f3f5; padding: 30px; text-align: center;">
+                <h1 style="color: #083344; margin: 0; font-size: 24px; text-transform: uppercase; letter-spacing: 2px;">¡Pago Exitoso!</h1>
+            </div>
+            <div style="padding: 30px;">
+                <p style="font-size: 16px;">Hola <strong>{order.user.first_name or 'Cliente'}</strong>,</p>
+                <p style="font-size: 16px;">Hemos recibido tu pago correctamente. Tu pedido ya está en cola para ser preparado.</p>
+
+                <div style="background-color: #feecd4; padding: 20px; border-radius: 12px; margin: 25px 0; border: 1px solid #fbbf24;">
+                    <h2 style="margin-top: 0; color: #9d174d; font-size: 14px; text-transform: uppercase; letter-spacing: 1px;">Resumen de tu pedido</h2>
+
+                    <div style="background-color: #ffffff; padding: 15px; border-radius: 8px; text-align: center; margin-bottom: 20px;">
+                        <p style="margin: 0 0 5px 0; font-size: 12px; color: #6b7280; text-transform: uppercase; font-weight: bold;">Código de Seguimiento</p>
+                        <p style="font-size: 28px; font-weight: 900; color: #0f172a; margin: 0; letter-spacing: 2px;">{order_id_str}</p>
+                    </div>
+
+                    <p style="font-size: 12px; color: #6b7280; margin-top: 0; text-align: center;">(Ingresa este código en nuestra sección de Envíos para rastrear tu paquete)</p>
+
+                    <hr style="border: 0; border-top: 1px dashed #f59e0b; margin: 20px 0;">
+
+                    <ul style="list-style-type: none; padding: 0; margin: 0;">
+                        {items_html}
+                    </ul>
+
+                    <hr style="border: 0; border-top: 1px dashed #f59e0b; margin: 20px 0;">
+
+                    <div style="text-align: right; font-size: 14px; color: #4b5563;">
+                        <p style="margin: 5px 0;">Subtotal Productos: ${subtotal_productos}</p>
+                        <p style="margin: 5px 0;">Envío: ${costo_envio}</p>
+                        <p style="font-size: 20px; margin: 10px 0 0 0; color: #be185d;"><strong>Total Pagado: <span style="font-size: 24px;">${int(order.total_amount)}</span></strong></p>
+                    </div>
+                </div>
+
+                <p style="font-size: 14px; color: #6b7280;">Te enviaremos una notificación cuando tu paquete vaya en camino.</p>
+                <p style="font-size: 16px; margin-bottom: 0;">Un abrazo,<br><strong style="color: #db2777;">El equipo de Policrómica</strong></p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+    plain_message = f"Hola {order.user.first_name},\n\nTu pedido {order_id_str} ha sido confirmado. Total pagado: ${int(order.total_amount)}.\n\nGuarda tu código para rastrearlo en la página.\n\nGracias por comprar en Policrómica."
+    return subject, plain_message, html_message
+
+
+def confirm_paid_order(order_id, order_id_str):
+    # Marca la orden como pagada (una sola vez) y encola el correo de confirmación.
+    # La usan la vista síncrona y la asíncrona (core/async_views.py).
+    # Estado, stock y fila del outbox se confirman en la misma transacción: si
+    # el proceso muere antes del commit, Flow reintenta y la orden sigue
+    # PENDIENTE; si algo falla al encolar, no queda pagada sin su correo.
+    try:
+        with transaction.atomic():
+            paid = mark_order_paid(order_id)
+            if not paid:
+                return
+            order, order_items = paid
+            subject, plain_message, html_message = confirmation_email(order, order_items, order_id_str)
+            # Solo encolamos: el worker (send_outbox) lo despacha por SMTP
+            enqueue_email(
+                to=order.user.email,
+                subject=subject,
+                body_text=plain_message,
+                body_html=html_message,
+            )
+    except Exception:
+        logger.exception("Error al confirmar la orden %s", order_id_str)
+        raise
+    logger.info("Correo encolado para %s", order.user.email)
+
 
 @csrf_exempt
 def payment_confirm(request):
     if request.method == 'POST':
         token = request.POST.get('token')
         if token:
-            api_key = os.environ.get("FLOW_API_KEY")
-            secret_key = os.environ.get("FLOW_SECRET_KEY")
-            
-            params = {"apiKey": api_key, "token": token}
-            sorted_params = sorted(params.items(), key=lambda x: x[0])
-            to_sign = "".join([f"{key}{value}" for key, value in sorted_params])
-            params["s"] = hmac.new(secret_key.encode(), to_sign.encode(), hashlib.sha256).hexdigest()
-            
-            res = requests.get("https://sandbox.flow.cl/api/payment/getStatus", params=params)
+            try:
+                # Un "pendiente" cacheado no sirve aquí: solo se reutilizan estados finales
+                flow_data = flow.get_payment_status(token, allow_pending=False)
+            except flow.FlowError as e:
+                # Respondemos error para que Flow reintente la notificación más tarde
+                logger.warning("No se pudo consultar el estado en Flow: %s", e)
+                return JsonResponse({'error': 'Flow no disponible'}, status=502)
             
-            if res.status_code == 200:
-                flow_data = res.json()
+            if flow_data is not None:
                 status = flow_data.get('status')
                 order_id_str = flow_data.get('commerceOrder', '')
                 
-                if status == 2 and order_id_str.startswith('POLI-'):
+                if status == flow.STATUS_PAID and order_id_str.startswith('POLI-'):
                     order_id = int(order_id_str.replace('POLI-', ''))
                     try:
-                        order = Order.objects.get(id=order_id)
-                        
-                        if order.status != Order.StatusChoices.PAID:
-                            order.status = Order.StatusChoices.PAID
-                            order.save()
-                            
-                            items_html = ""
-                            subtotal_productos = 0
-                            
-                            for item in order.items.all():
-                                product = item.product
-                                if product.stock >= item.quantity:
-                                    product.stock -= item.quantity
-                                else:
-                                    product.stock = 0
-                                product.save()
-                                
-                                # Calculamos el subtotal de este item y lo sumamos al total de productos
-                                subtotal_item = int(item.unit_price * item.quantity)
-                                subtotal_productos += subtotal_item
-                                items_html += f'<li style="margin-bottom: 8px; color: #374151; font-size: 14px;"><strong>{item.quantity}x</strong> {product.name} <span style="color: #db2777; font-weight: bold; float: right;">${subtotal_item}</span></li>'
-                            
-                            # Calculamos el costo de envío (Total - Subtotal productos)
-                            costo_envio = int(order.total_amount) - subtotal_productos
-                            if costo_envio < 0:
-                                costo_envio = 0
-                            
-                            # =========================================================
-                            # LÓGICA DE ENVÍO DE CORREO AL CLIENTE
-                            # =========================================================
-                            try:
-                                subject = f"¡Tu pedido {order_id_str} está confirmado! - Policrómica"
-                                
-                                html_message = f"""
-                                <html>
-                                <body style="font-family: Arial, sans-serif; color: #333; line-height: 1.6; margin: 0; padding: 20px; background-color: #f9fafb;">
-                                    <div style="max-width: 600px; margin: 0 auto; background-color: #ffffff; border-radius: 16px; overflow: hidden; box-shadow: 0 4px 6px rgba(0,0,0,0.05); border: 1px solid #e5e7eb;">
-                                        <div style="background-color: #b3f3f5; padding: 30px; text-align: center;">
-                                            <h1 style="color: #083344; margin: 0; font-size: 24px; text-transform: uppercase; letter-spacing: 2px;">¡Pago Exitoso!</h1>
-                                        </div>
-                                        <div style="padding: 30px;">
-                                            <p style="font-size: 16px;">Hola <strong>{order.user.first_name or 'Cliente'}</strong>,</p>
-                                            <p style="font-size: 16px;">Hemos recibido tu pago correctamente. Tu pedido ya está en cola para ser preparado.</p>
-                                            
-                                            <div style="background-color: #feecd4; padding: 20px; border-radius: 12px; margin: 25px 0; border: 1px solid #fbbf24;">
-                                                <h2 style="margin-top: 0; color: #9d174d; font-size: 14px; text-transform: uppercase; letter-spacing: 1px;">Resumen de tu pedido</h2>
-                                                
-                                                <div style="background-color: #ffffff; padding: 15px; border-radius: 8px; text-align: center; margin-bottom: 20px;">
-                                                    <p style="margin: 0 0 5px 0; font-size: 12px; color: #6b7280; text-transform: uppercase; font-weight: bold;">Código de Seguimiento</p>
-                                                    <p style="font-size: 28px; font-weight: 900; color: #0f172a; margin: 0; letter-spacing: 2px;">{order_id_str}</p>
-                                                </div>
-                                                
-                                                <p style="font-size: 12px; color: #6b7280; margin-top: 0; text-align: center;">(Ingresa este código en nuestra sección de Envíos para rastrear tu paquete)</p>
-                                                
-                                                <hr style="border: 0; border-top: 1px dashed #f59e0b; margin: 20px 0;">
-                                                
-                                                <ul style="list-style-type: none; padding: 0; margin: 0;">
-                                                    {items_html}
-                                                </ul>
-                                                
-                                                <hr style="border: 0; border-top: 1px dashed #f59e0b; margin: 20px 0;">
-                                                
-                                                <div style="text-align: right; font-size: 14px; color: #4b5563;">
-                                                    <p style="margin: 5px 0;">Subtotal Productos: ${subtotal_productos}</p>
-                                                    <p style="margin: 5px 0;">Envío: ${costo_envio}</p>
-                                                    <p style="font-size: 20px; margin: 10px 0 0 0; color: #be185d;"><strong>Total Pagado: <span style="font-size: 24px;">${int(order.total_amount)}</span></strong></p>
-                                                </div>
-                                            </div>
-                                            
-                                            <p style="font-size: 14px; color: #6b7280;">Te enviaremos una notificación cuando tu paquete vaya en camino.</p>
-                                            <p style="font-size: 16px; margin-bottom: 0;">Un abrazo,<br><strong style="color: #db2777;">El equipo de Policrómica</strong></p>
-                                        </div>
-                                    </div>
-                                </body>
-                                </html>
-                                """
-                                
-                                plain_message = f"Hola {order.user.first_name},\n\nTu pedido {order_id_str} ha sido confirmado. Total pagado: ${int(order.total_amount)}.\n\nGuarda tu código para rastrearlo en la página.\n\nGracias por comprar en Policrómica."
-                                
-                                send_mail(
-                                    subject=subject,
-                                    message=plain_message,
-                                    from_email=settings.DEFAULT_FROM_EMAIL,
-                                    recipient_list=[order.user.email],
-                                    html_message=html_message,
-                                    fail_silently=False # Lo ponemos en False un momento solo para ver si hay un error real en los logs de Render
-                                )
-                                print(f"Correo enviado exitosamente a {order.user.email}")
-                            except Exception as email_error:
-                                print("=========================================")
-                                print(f"ERROR AL ENVIAR CORREO: {email_error}")
-                                print("=========================================")
-                                    
-                    except Order.DoesNotExist:
-                        print(f"La orden {order_id} no existe en la base de datos.")
-                        pass
-                        
+                        confirm_paid_order(order_id, order_id_str)
+                    except Exception:
+                        # Nada quedó confirmado: Flow reintenta la notificación
+                        return JsonResponse({'error': 'No se pudo confirmar la orden'}, status=500)
+
             return JsonResponse({'status': 'ok'}, status=200)
     return JsonResponse({'error': 'Método no permitido'}, status=400)
 
@@ -270,17 +282,14 @@ def payment_final_redirect(request):
         frontend_url = "https://policromica.vercel.app/checkout/status"
         
         if token:
-            api_key = os.environ.get("FLOW_API_KEY")
-            secret_key = os.environ.get("FLOW_SECRET_KEY")
-            params = {"apiKey": api_key, "token": token}
-            sorted_params = sorted(params.items(), key=lambda x: x[0])
-            to_sign = "".join([f"{key}{value}" for key, value in sorted_params])
-            params["s"] = hmac.new(secret_key.encode(), to_sign.encode(), hashlib.sha256).hexdigest()
-            
-            res = requests.get(f"https://sandbox.flow.cl/api/payment/getStatus", params=params)
             order_id = ""
-            if res.status_code == 200:
-                order_id = res.json().get('commerceOrder', '')
+            try:
+                # Normalmente ya viene del cache que dejó payment_confirm: sin ida a Flow
+                flow_data = flow.get_payment_status(token)
+                if flow_data is not None:
+                    order_id = flow_data.get('commerceOrder', '')
+            except flow.FlowError:
+                pass  # La página de estado del frontend igual puede consultar con el token
 
             return redirect(f"{frontend_url}?token={token}&order={order_id}")
         
@@ -300,35 +309,19 @@ def retry_payment(request):
 
             order = Order.objects.get(id=order_id, user__email=email, status=Order.StatusChoices.PENDING)
             
-            expiration_threshold = timezone.now() - timedelta(hours=6)
+            expiration_threshold = timezone.now() - ORDER_EXPIRATION
             if order.created_at < expiration_threshold:
                 return JsonResponse({'error': 'Esta orden ha expirado por inactividad. Por favor, realiza un nuevo pedido.'}, status=400)
 
             commerce_order = f"POLI-{order.id}"
             amount = int(order.total_amount)
 
-            api_key = os.environ.get("FLOW_API_KEY")
-            secret_key = os.environ.get("FLOW_SECRET_KEY")
-            api_url = "https://sandbox.flow.cl/api"
-
-            params = {
-                "apiKey": api_key,
-                "commerceOrder": commerce_order,
-                "subject": f"Reintento Pago Pedido {commerce_order} en Policrómica",
-                "currency": "CLP",
-                "amount": amount,
-                "email": email,
-                "urlConfirmation": "https://tienda-backend-fn64.onrender.com/api/payment/confirm/", 
-                "urlReturn": "https://tienda-backend-fn64.onrender.com/api/payment/final-redirect/", 
-            }
-
-            sorted_params = sorted(params.items(), key=lambda x: x[0])
-            to_sign = "".join([f"{key}{value}" for key, value in sorted_params])
-            signature = hmac.new(secret_key.encode(), to_sign.encode(), hashlib.sha256).hexdigest()
-            params["s"] = signature
-
-            encoded_body = urlencode(params)
-            response = requests.post(f"{api_url}/payment/create", data=encoded_body, headers={'Content-Type':'application/x-www-form-urlencoded'})
+            response = flow.get_client().create_payment(
+                commerce_order=commerce_order,
+                subject=f"Reintento Pago Pedido {commerce_order} en Policrómica",
+                amount=amount,
+                email=email,
+            )
             
             if response.status_code == 200:
                 flow_data = response.json()
@@ -352,13 +345,8 @@ def get_user_profile(request):
         return JsonResponse({'error': 'Faltan datos'}, status=400)
     try:
         user = User.objects.get(email=email)
-        address = user.addresses.first()
-        return JsonResponse({
-            'nombre': user.first_name,
-            'telefono': user.phone or '',
-            'direccion': address.street_address if address else '',
-            'ciudad': address.city if address else '',
-        }, status=200)
+        # Misma dirección principal que /api/account/
+        return JsonResponse(serialize_profile(user, default_address(user)), status=200)
     except User.DoesNotExist:
         return JsonResponse({'error': 'Usuario no encontrado'}, status=404)
 
@@ -380,7 +368,7 @@ def update_user_profile(request):
             city_str = data.get('ciudad')
             
             if addr_str or city_str:
-                address = user.addresses.first()
+                address = default_address(user)  # La misma que muestra el perfil
                 if address:
                     address.street_address = addr_str or address.street_address
                     address.city = city_str or address.city
@@ -399,123 +387,102 @@ def update_user_profile(request):
     return JsonResponse({'error': 'Método no permitido'}, status=405)
 
 
+# Sin parámetros: todas las órdenes del cliente (lista, como siempre).
+# Con cursor/limit/with_items: una página {'results': [...], 'next_cursor': ...};
+# with_items=1 agrega 'item_count' (unidades por orden).
 @csrf_exempt
 def get_user_orders(request):
     email = request.GET.get('email')
     if not email:
         return JsonResponse([], safe=False)
-    
-    orders = Order.objects.filter(user__email=email).order_by('-created_at')
-    data = []
-    
-    expiration_threshold = timezone.now() - timedelta(hours=6)
-
-    for o in orders:
-        is_pending = o.status == Order.StatusChoices.PENDING
-        is_expired = is_pending and o.created_at < expiration_threshold
-
-        data.append({
-            'id': o.id,
-            'order_number': f"POLI-{o.id}",
-            'status': o.get_status_display(),
-            'total': float(o.total_amount),
-            'date': o.created_at.strftime("%d/%m/%Y"),
-            'raw_status': o.status,
-            'is_expired': is_expired
-        })
-    return JsonResponse(data, safe=False)
+
+    if any(param in request.GET for param in ('cursor', 'limit', 'with_items')):
+        try:
+            return JsonResponse(query_order_history(email, request.GET))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(order_history(email), safe=False)
+
+
+# Panel de la cuenta en una sola llamada: perfil, primera página de órdenes y
+# favoritos. Parámetros opcionales: sections, orders_limit, favorites_limit.
+@csrf_exempt
+def get_account(request):
+    email = request.GET.get('email')
+    if not email:
+        return JsonResponse({'error': 'Faltan datos'}, status=400)
+    try:
+        return JsonResponse(build_account(email, request.GET))
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'Usuario no encontrado'}, status=404)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+
+def _token_user_id(request):
+    # El id del usuario sale de los claims del JWT (firmado): sin ir a la BD
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    token_string = auth_header.split(' ')[1]
+    if not token_string or token_string == 'null':  # Protección extra contra tokens nulos
+        return None
+    try:
+        return AccessToken(token_string)[jwt_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
 
 
 @csrf_exempt
 def track_order(request):
     order_code = request.GET.get('code', '').upper().replace('POLI-', '')
     try:
-        order = Order.objects.select_related('user', 'shipping_address').get(id=order_code)
-        
-        is_owner = False
-        auth_header = request.headers.get('Authorization')
-        if auth_header and auth_header.startswith('Bearer '):
-            from rest_framework_simplejwt.tokens import AccessToken
-            try:
-                token_string = auth_header.split(' ')[1]
-                if token_string and token_string != 'null': # Protección extra contra tokens nulos
-                    token = AccessToken(token_string)
-                    user_id = token['user_id']
-                    user = User.objects.get(id=user_id)
-                    if user.email == order.user.email:
-                        is_owner = True
-            except Exception as e:
-                pass 
-
-        courier = "Pedido en preparación"
-        tracking_number = "Pendiente de envío"
-        
-        if hasattr(order, 'shipment'):
-            courier = order.shipment.courier or courier
-            tracking_number = order.shipment.tracking_number or tracking_number
-
-        items_list = []
-        for item in order.items.all():
-            items_list.append({
-                'name': item.product.name,
-                'quantity': item.quantity,
-                'price': float(item.unit_price)
-            })
-
-        response_data = {
-            'success': True,
-            'id': order.id,
-            'email': order.user.email,
-            'order_number': f"POLI-{order.id}",
-            'status': order.get_status_display(),
-            'date': order.created_at.strftime("%d/%m/%Y"),
-            'is_owner': is_owner,
-            'items': items_list,
-        }
-
-        if is_owner:
-            response_data.update({
-                'customer_name': order.user.first_name or order.user.username,
-                'address': f"{order.shipping_address.street_address}, {order.shipping_address.city}" if order.shipping_address else "No especificada",
-                'courier': courier,
-                'tracking_number': tracking_number,
-                'total': float(order.total_amount),
-                'raw_status': order.status,
-                'is_expired': False 
-            })
-
-        return JsonResponse(response_data)
+        order_id = int(order_code)
+        owner_id, public_data = get_public_tracking(order_id)
+
+        user_id = _token_user_id(request)
+        if user_id is None or str(user_id) != str(owner_id):
+            return JsonResponse(public_data)
+        return JsonResponse({**public_data, **owner_tracking(order_id)})
     except (Order.DoesNotExist, ValueError):
         return JsonResponse({'success': False, 'error': 'Pedido no encontrado'})
-    
+
+
 @csrf_exempt
 def get_favorites(request):
     email = request.GET.get('email')
     if not email:
         return JsonResponse([], safe=False)
-    
-    favorites = Favorite.objects.filter(user__email=email).select_related('product')
-    products_list = []
-    
-    for fav in favorites:
-        product = fav.product
-        main_image_obj = product.images.filter(is_main=True).first()
-        if not main_image_obj:
-            main_image_obj = product.images.first()
-            
-        image_url = main_image_obj.image.url if main_image_obj else None
-        
-        products_list.append({
-            'id': product.id,
-            'name': product.name,
-            'price': float(product.price),
-            'stock': product.stock,
-            'category__name': product.category.name if product.category else "Sin categoría",
-            'image': image_url,
-        })
 
+    # Favoritos + producto + categoría en un JOIN (la portada viene en el producto)
+    products_list = [favorites.serialize_favorite(fav) for fav in favorites.favorites_queryset(email)]
     return JsonResponse(products_list, safe=False)
 
+
+def _favorites_etag(request):
+    email = request.GET.get('email')
+    user_id = favorites.favorites_user_id(email) if email else None
+    if user_id is None:
+        return None
+    return f"fav-{favorites.get_favorites_version(user_id)}"
+
+# Solo los IDs de los productos favoritos (para pintar los corazones) + la
+# versión. Con If-None-Match de la versión actual responde 304 sin ir a la BD.
+@etag(_favorites_etag)
+def get_favorite_ids(request):
+    email = request.GET.get('email')
+    if not email:
+        return JsonResponse({'ids': [], 'version': None})
+
+    user_id = favorites.favorites_user_id(email)  # Ya quedó en el cache con el ETag
+    if user_id is None:
+        return JsonResponse({'ids': [], 'version': None})
+
+    version = favorites.get_favorites_version(user_id)  # Antes de la query: si cambia entre medio, el próximo pedido no calza y se refresca
+    response = JsonResponse({'ids': favorites.favorite_product_ids(email), 'version': version})
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
 @csrf_exempt
 def toggle_favorite(request):
     if request.method == 'POST':
@@ -523,20 +490,31 @@ def toggle_favorite(request):
             data = json.loads(request.body)
             email = data.get('email')
             product_id = data.get('product_id')
-            
+
             if not email or not product_id:
                 return JsonResponse({'error': 'Faltan datos'}, status=400)
 
-            user = User.objects.get(email=email)
-            product = Product.objects.get(id=product_id)
-            
-            fav, created = Favorite.objects.get_or_create(user=user, product=product)
-            
-            if not created:
-                fav.delete()
-                return JsonResponse({'status': 'removed'}, status=200)
-                
-            return JsonResponse({'status': 'added'}, status=201)
+            # DELETE y, si no había nada que borrar, INSERT (sin get_or_create)
+            status = favorites.toggle_favorite(email, int(product_id))
+            return JsonResponse({'status': status}, status=201 if status == 'added' else 200)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'error': 'Método no permitido'}, status=405)
+
+# Lote de cambios acumulados por el frontend (clics rápidos con debounce):
+# {"email": ..., "ops": [{"product_id": 1, "action": "add"}, ...]}
+@csrf_exempt
+def sync_favorites(request):
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            email = data.get('email')
+            if not email:
+                return JsonResponse({'error': 'Faltan datos'}, status=400)
+
+            result = favorites.apply_favorite_ops(email, data.get('ops', []))
+            result['ids'] = favorites.favorite_product_ids(email)
+            return JsonResponse(result, status=200)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
     return JsonResponse({'error': 'Método no permitido'}, status=405)
@@ -563,4 +541,16 @@ def submit_contact_message(request):
             return JsonResponse({'success': True, 'mensaje': 'Mensaje guardado con éxito'}, status=201)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
-    return JsonResponse({'error': 'Método no permitido'}, status=405)
\ No newline at end of file
+    return JsonResponse({'error': 'Método no permitido'}, status=405)
+
+
+# Métricas en formato Prometheus (core/metrics.py): latencia por vista y por
+# servicio externo (Flow, SMTP, Cloudinary). Con METRICS_TOKEN exige
+# "Authorization: Bearer <token>".
+def metrics_view(request):
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    token = settings.METRICS_TOKEN
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return JsonResponse({'error': 'No autorizado'}, status=401)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
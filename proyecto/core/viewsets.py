@@ -0,0 +1,69 @@
+from rest_framework import viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import AllowAny
+
+from .catalog import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, catalog_queryset, filter_catalog
+from .models import Category, Product
+from .serializers import CategorySerializer, ProductSerializer
+
+# ==========================================
+# API DE SOLO LECTURA (DRF) - /api/catalog/
+# ==========================================
+# /api/catalog/products/?fields=id,name,final_price&category=aros&limit=24
+# /api/catalog/categories/
+# Los serializers leen solo de select_related/prefetch: el número de queries
+# de un listado no depende de cuántos productos trae. La portada viene en el
+# mismo Product, así que el prefetch de imágenes solo se hace si se piden
+# todas (?fields= sin 'images' lo evita).
+
+IMAGE_FIELDS = {'images'}
+
+
+class CatalogCursorPagination(CursorPagination):
+    page_size = DEFAULT_PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    ordering = ('-created_at', '-id')
+
+
+class SparseFieldsViewSetMixin:
+    def requested_fields(self):
+        value = self.request.query_params.get('fields')
+        if not value:
+            return None
+        fields = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = set(fields) - set(self.get_serializer_class().Meta.fields)
+        if unknown:
+            raise ValidationError({'fields': f"Campos desconocidos: {', '.join(sorted(unknown))}"})
+        return fields
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+
+class ProductViewSet(SparseFieldsViewSetMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = ProductSerializer
+    pagination_class = CatalogCursorPagination
+    authentication_classes = ()  # Catálogo público: no decodificamos JWT
+    permission_classes = (AllowAny,)
+
+    def get_queryset(self):
+        fields = self.requested_fields()
+        if fields is not None and not IMAGE_FIELDS & set(fields):
+            queryset = Product.objects.filter(is_active=True).select_related('category')
+        else:
+            queryset = catalog_queryset()
+        try:
+            # Mismos filtros que /api/products/ (category, is_featured, min_price, ...)
+            return filter_catalog(queryset, self.request.query_params)
+        except ValueError as e:
+            raise ValidationError({'detail': str(e)})
+
+
+class CategoryViewSet(SparseFieldsViewSetMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Category.objects.order_by('full_name')
+    serializer_class = CategorySerializer
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 from datetime import timedelta
 from pathlib import Path
 import os
+import sys
 import dj_database_url
 from dotenv import load_dotenv
 
@@ -58,6 +59,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.QueryInstrumentationMiddleware',  # Primero: mide el request completo
+    'core.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -114,6 +117,20 @@ if 'DATABASE_URL' in os.environ:
 
 AUTH_USER_MODEL = 'core.User'
 
+# Cache compartido entre los workers de gunicorn (misma instancia de Render).
+# Lo usa el snapshot del catálogo para enterarse de las invalidaciones.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR', '/tmp/policromica_cache'),
+    }
+}
+if sys.argv[1:2] == ['test']:
+    # Los tests no deben leer lo que dejó en disco una corrida anterior
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# Edad máxima (segundos) del snapshot de /api/products/ aunque no haya señales
+CATALOG_SNAPSHOT_MAX_AGE = int(os.environ.get('CATALOG_SNAPSHOT_MAX_AGE', 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -164,8 +181,9 @@ CLOUDINARY_STORAGE = {
 }
 STORAGES = {
     # Gestión de archivos MEDIA (Fotos de productos) -> A Cloudinary
+    # (MediaCloudinaryStorage midiendo la latencia de cada subida, ver core/storage.py)
     "default": {
-        "BACKEND": "cloudinary_storage.storage.MediaCloudinaryStorage",
+        "BACKEND": "core.storage.CloudinaryStorage",
     },
     # Gestión de archivos ESTÁTICOS (CSS/JS admin) -> A Whitenoise
     "staticfiles": {
@@ -175,6 +193,17 @@ STORAGES = {
 #DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# MEDIA_STORAGE=local guarda las fotos (y sus variantes) en MEDIA_ROOT en vez
+# de Cloudinary: sirve para desarrollar y probar core/images.py sin cuenta.
+MEDIA_STORAGE = os.environ.get('MEDIA_STORAGE', 'cloudinary')
+if MEDIA_STORAGE == 'local':
+    STORAGES["default"] = {"BACKEND": "core.storage.LocalStorage"}
+# Variantes responsive de las fotos (core/images.py). Las genera un worker
+# (o un cron que corra el comando sin --loop):
+#   python manage.py process_images --loop
+# IMAGE_VARIANTS_AUTOPROCESS=True es solo para desarrollar sin worker: procesa
+# cada foto guardada en un hilo aparte dentro del proceso web.
+IMAGE_VARIANTS_AUTOPROCESS = os.environ.get('IMAGE_VARIANTS_AUTOPROCESS', 'False') == 'True'
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 SECURE_SSL_REDIRECT = False
 SESSION_COOKIE_SECURE = False
@@ -215,6 +244,7 @@ JAZZMIN_SETTINGS = {
         "core.Shipment": "fas fa-truck",
         "core.Payment": "fas fa-credit-card",
         "core.ContactMessage": "fas fa-envelope",
+        "core.EmailOutbox": "fas fa-paper-plane",
     },
     
     # 2. ACTIVAMOS EL CONSTRUCTOR VISUAL
@@ -251,4 +281,69 @@ EMAIL_USE_TLS = True
 # AHORA SÍ, 100% SEGURO (Sin contraseñas escritas en el código)
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', 'policromicadespacho@gmail.com')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
-DEFAULT_FROM_EMAIL = 'Policrómica <policromicadespacho@gmail.com>'
\ No newline at end of file
+DEFAULT_FROM_EMAIL = 'Policrómica <policromicadespacho@gmail.com>'
+
+# Cola de correos (core/outbox.py). La despacha un worker por lotes:
+#   python manage.py send_outbox --loop
+# o un cron cada minuto con `python manage.py send_outbox` (sin --loop).
+# EMAIL_OUTBOX_AUTODRAIN=True es solo para desarrollar sin worker: despacha en
+# un hilo aparte tras cada encolado, y ese hilo muere con el worker web.
+EMAIL_OUTBOX_AUTODRAIN = os.environ.get('EMAIL_OUTBOX_AUTODRAIN', 'False') == 'True'
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_BACKOFF_SECONDS = 60
+EMAIL_TIMEOUT = 20
+
+# =========================================================
+# FLOW (PASARELA DE PAGOS) - ver core/flow.py
+# =========================================================
+FLOW_API_URL = os.environ.get('FLOW_API_URL', 'https://sandbox.flow.cl/api')
+FLOW_API_KEY = os.environ.get('FLOW_API_KEY')
+FLOW_SECRET_KEY = os.environ.get('FLOW_SECRET_KEY')
+FLOW_URL_CONFIRMATION = 'https://tienda-backend-fn64.onrender.com/api/payment/confirm/'
+FLOW_URL_RETURN = 'https://tienda-backend-fn64.onrender.com/api/payment/final-redirect/'
+FLOW_CONNECT_TIMEOUT = 3.05  # segundos
+FLOW_READ_TIMEOUT = 10
+FLOW_MAX_RETRIES = 2  # solo llamadas idempotentes (getStatus)
+FLOW_POOL_MAXSIZE = 10
+# Cache de getStatus por token (segundos): estados finales vs. pendientes
+FLOW_STATUS_TERMINAL_TTL = 60 * 60 * 24
+FLOW_STATUS_PENDING_TTL = 5
+# Vistas de pago async (core/async_views.py). Requiere servir con ASGI:
+#   uvicorn proyecto.asgi:application --workers 2
+# Con gunicorn (WSGI) dejarlo en False: ahí las vistas async no ganan nada.
+ASYNC_PAYMENT_VIEWS = os.environ.get('ASYNC_PAYMENT_VIEWS', 'False') == 'True'
+
+# =========================================================
+# INSTRUMENTACIÓN SQL (core/middleware.py)
+# =========================================================
+# Header Server-Timing + log JSON de requests lentos o con N+1 en 'core.slow_requests'.
+SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', 'True') == 'True'
+# Fracción de requests a los que se les cuentan las queries (la latencia se mide en todos)
+SQL_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('SQL_INSTRUMENTATION_SAMPLE_RATE', '1.0' if DEBUG else '0.1'))
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+SLOW_REQUEST_QUERIES = int(os.environ.get('SLOW_REQUEST_QUERIES', 30))
+SQL_REPEATED_QUERY_THRESHOLD = 5  # Misma query (otros parámetros) 5+ veces: probable N+1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# =========================================================
+# MÉTRICAS PROMETHEUS (core/metrics.py) - GET /metrics
+# =========================================================
+# Con varios workers de gunicorn, un directorio compartido donde cada proceso
+# vuelca sus métricas (sin él, /metrics solo ve las del worker que responde).
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 1.0
+# Si se define, /metrics exige "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
@@ -1,47 +1,73 @@
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 from core.views import (
     get_products, 
+    search_products,
     api_home, 
     register_user, 
     create_payment, 
+    get_shipping_rates,
     payment_confirm, 
     payment_final_redirect, 
     get_user_orders, 
+    get_account,
     track_order, 
     get_favorites, 
+    get_favorite_ids,
     toggle_favorite,
+    sync_favorites,
     get_user_profile,
     update_user_profile,
     retry_payment,
-    submit_contact_message
+    submit_contact_message,
+    metrics_view,
 )
 from django.conf import settings
 from django.conf.urls.static import static
+from core import async_views
+from core.viewsets import CategoryViewSet, ProductViewSet
+from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
 
+if settings.ASYNC_PAYMENT_VIEWS:
+    create_payment = async_views.create_payment
+    payment_confirm = async_views.payment_confirm
+    payment_final_redirect = async_views.payment_final_redirect
+    retry_payment = async_views.retry_payment
+
+catalog_router = DefaultRouter()
+catalog_router.register('products', ProductViewSet, basename='catalog-product')
+catalog_router.register('categories', CategoryViewSet, basename='catalog-category')
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/products/', get_products, name='get_products'),
+    path('api/products/search/', search_products, name='search_products'),
+    path('api/catalog/', include(catalog_router.urls)),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('', api_home, name='home'),
     path('api/register/', register_user, name='register_user'),
     path('api/payment/create/', create_payment, name='create_payment'),
+    path('api/shipping-rates/', get_shipping_rates, name='get_shipping_rates'),
     path('api/payment/confirm/', payment_confirm, name='payment_confirm'),
     path('api/payment/final-redirect/', payment_final_redirect, name='payment_final_redirect'),
     path('api/payment/retry/', retry_payment, name='retry_payment'),
     path('api/orders/', get_user_orders, name='get_user_orders'),
+    path('api/account/', get_account, name='get_account'),
     path('api/track/', track_order, name='track_order'),
     path('api/favorites/', get_favorites, name='get_favorites'),
+    path('api/favorites/ids/', get_favorite_ids, name='get_favorite_ids'),
     path('api/favorites/toggle/', toggle_favorite, name='toggle_favorite'),
+    path('api/favorites/batch/', sync_favorites, name='sync_favorites'),
     
     path('api/contact/', submit_contact_message, name='submit_contact_message'),
     path('api/profile/', get_user_profile, name='get_user_profile'),
     path('api/profile/update/', update_user_profile, name='update_user_profile'),
+    path('metrics', metrics_view, name='metrics'),  # Sin slash final: la ruta que espera Prometheus
 ]
 
 if settings.DEBUG: